@@ -7,18 +7,24 @@ Demonstrates basic usage of the Llama Stack client:
 """
 
 import os  # For environment variable access
-from llama_stack_client import LlamaStackClient  # Import the Llama Stack client
+from client_pool import get_client  # Shared pooled Llama Stack client factory
+from response_cache import enable_response_cache  # Opt-in chat completion cache
+from registry_cache import RegistryCache  # TTL-cached registry lookups
 
 # Initialize the client with base URL and API key
-client = LlamaStackClient(
+client = get_client(
     base_url="http://0.0.0.0:8321", 
     provider_data={
         "together_api_key": os.environ['TOGETHER_API_KEY']
     }
 )
 
-# List and print available models
-models = client.models.list()
+# Optionally answer repeated chat requests from a local cache (set LLAMA_STACK_RESPONSE_CACHE to a file path)
+client = enable_response_cache(client)
+
+# List and print available models (cached on disk for a few minutes; see registry_cache.py)
+registry = RegistryCache(client)
+models = registry.models()
 print("Available Models:")
 for model in models:
     print(f"- {model.identifier} ({model.model_type})")
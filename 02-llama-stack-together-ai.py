@@ -5,18 +5,20 @@ Demonstrates connecting to the hosted Llama Stack server via Together AI and mak
 """
 
 import os  # For environment variable access
-from llama_stack_client import LlamaStackClient  # Import the Llama Stack client
+from client_pool import get_client  # Shared pooled Llama Stack client factory
+from registry_cache import RegistryCache  # TTL-cached registry lookups
 
 # Initialize the client with Together AI endpoint and API key
-client = LlamaStackClient(
+client = get_client(
     base_url="https://llama-stack.together.ai", 
     provider_data={
         "together_api_key": os.environ['TOGETHER_API_KEY']
     }
 )
 
-# List and print available models
-models = client.models.list()
+# List and print available models (cached on disk for a few minutes; see registry_cache.py)
+registry = RegistryCache(client)
+models = registry.models()
 print("Available Models:")
 for model in models:
     print(f"- {model.identifier} ({model.model_type})")
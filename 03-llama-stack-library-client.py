@@ -2,25 +2,41 @@
 03-llama-stack-library-client.py
 -------------------------------
 Demonstrates usage of the Llama Stack as a library client, including initialization and chat completion.
+Set LLAMA_STACK_WARM=1 to attach to a long-lived, already initialized library client instead (see warm_library_client.py).
 """
 
 import os  # For environment variable access
 from llama_stack.distribution.library_client import LlamaStackAsLibraryClient  # Import the library client
+from response_cache import enable_response_cache  # Opt-in chat completion cache
+from warm_library_client import get_warm_client  # Warm-start mode for the library client
+from registry_cache import RegistryCache  # TTL-cached registry lookups
 
-# Initialize the library client with provider and API key
-client = LlamaStackAsLibraryClient(
-    "together",
-    provider_data={
-        "together_api_key": os.environ['TOGETHER_API_KEY']
-    }
-)
+provider_data = {
+    "together_api_key": os.environ['TOGETHER_API_KEY']
+}
+
+if os.environ.get("LLAMA_STACK_WARM"):
+    # Attach to the warm daemon (started on first use), which has already run initialize()
+    print("Attaching to warm library client...")
+    client = get_warm_client("together", provider_data=provider_data)
+else:
+    # Initialize the library client with provider and API key
+    client = LlamaStackAsLibraryClient(
+        "together",
+        provider_data=provider_data
+    )
 
-print("Initializing...")
-client.initialize()  # Explicit initialization
+    print("Initializing...")
+    client.initialize()  # Explicit initialization
 print("Ready")
 
-# List and print available models
-models = client.models.list()
+# Optionally answer repeated chat requests from a local cache (set LLAMA_STACK_RESPONSE_CACHE to a file path)
+client = enable_response_cache(client)
+
+# List and print available models (cached on disk for a few minutes; see registry_cache.py)
+# The library client has no base URL, so name the cache entry after the distribution
+registry = RegistryCache(client, namespace="library:together")
+models = registry.models()
 print("Available Models:")
 for model in models:
     print(f"- {model.identifier} ({model.model_type})")
@@ -6,10 +6,11 @@ Full workflow for starting the Llama Stack server, ensuring readiness, and runni
 
 import os  # For environment variable access
 import subprocess  # For running the server process
-import time  # For waiting/retries
-import requests  # For health checks
+import time  # For measuring time-to-ready
 from llama_stack_client import LlamaStackClient  # Llama Stack client
-from requests.exceptions import ConnectionError  # For handling connection errors
+from server_readiness import prewarm, wait_until_ready  # Backoff + log-watching readiness checks
+from response_cache import enable_response_cache  # Opt-in chat completion cache
+from registry_cache import RegistryCache  # TTL-cached registry lookups
 
 def run_llama_stack_server_background():
     """
@@ -27,26 +28,22 @@ def run_llama_stack_server_background():
     print(f"Starting Llama Stack server with PID: {process.pid}")
     return process
 
-def wait_for_server_to_start():
+def wait_for_server_to_start(process, started_at):
     """
-    Poll the server health endpoint until it responds or times out.
-    Returns True if the server is ready, False otherwise.
+    Wait until the server health endpoint answers, probing with exponential backoff and jitter
+    and waking up as soon as the server log prints its ready line.
+    Gives up early if the server process exits. Returns a ReadinessReport with the time-to-ready.
     """
-    url = "http://0.0.0.0:8321/v1/health"
-    max_retries = 30
-    retry_interval = 1
-    print("Waiting for server to start", end="")
-    for _ in range(max_retries):
-        try:
-            response = requests.get(url)
-            if response.status_code == 200:
-                print("\nServer is ready!")
-                return True
-        except ConnectionError:
-            print(".", end="", flush=True)
-            time.sleep(retry_interval)
-    print(f"\nServer failed to start after {max_retries * retry_interval} seconds")
-    return False
+    print("Waiting for server to start...")
+    report = wait_until_ready(
+        "http://0.0.0.0:8321/v1/health",
+        timeout=120,
+        log_path="llama_stack_server.log",
+        process=process,
+        started_at=started_at,
+    )
+    print(report)
+    return report
 
 def kill_llama_stack_server():
     """
@@ -56,9 +53,11 @@ def kill_llama_stack_server():
 
 # --- Main workflow ---
 # Start the server
+started_at = time.monotonic()
 server_process = run_llama_stack_server_background()
 # Wait for the server to be ready
-assert wait_for_server_to_start()
+readiness = wait_for_server_to_start(server_process, started_at)
+assert readiness.ready, readiness.reason
 
 # Initialize the Llama Stack client
 client = LlamaStackClient(
@@ -68,8 +67,16 @@ client = LlamaStackClient(
     }
 )
 
-# List and print available models
-models = client.models.list()
+# Pre-warm the model used below so the first real request does not pay its cold start
+readiness.prewarm = prewarm(client, ["meta-llama/Llama-3.2-3B-Instruct-Turbo"])
+print(readiness)
+
+# Optionally answer repeated chat requests from a local cache (set LLAMA_STACK_RESPONSE_CACHE to a file path)
+client = enable_response_cache(client)
+
+# List and print available models (cached on disk for a few minutes; see registry_cache.py)
+registry = RegistryCache(client)
+models = registry.models()
 print("Available Models:")
 for model in models:
     print(f"- {model.identifier} ({model.model_type})")
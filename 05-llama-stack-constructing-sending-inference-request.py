@@ -4,6 +4,11 @@
 Demonstrates constructing and sending a simple chat completion request using the Llama Stack client.
 """
 
+from response_cache import enable_response_cache  # Opt-in chat completion cache
+
+# Optionally answer repeated chat requests from a local cache (set LLAMA_STACK_RESPONSE_CACHE to a file path)
+client = enable_response_cache(client)
+
 # Specify the model to use
 model_id = "meta-llama/Llama-3.2-3B-Instruct-Turbo"
 
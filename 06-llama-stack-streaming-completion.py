@@ -1,9 +1,13 @@
 """
 06-llama-stack-streaming-completion.py
 -------------------------------------
-Demonstrates streaming chat completion using the Llama Stack client and event logger.
+Demonstrates streaming chat completion using the Llama Stack client and event logger,
+and reports time-to-first-token and tokens/sec for the stream.
 """
 
+import time  # For timing the request
+from stream_metrics import consume  # Stream consumer with latency metrics
+
 # Specify the model to use
 model_id = "meta-llama/Llama-3.2-3B-Instruct-Turbo"
 
@@ -26,6 +30,7 @@ messages = [
 ]
 
 # Make a streaming chat completion request
+started_at = time.perf_counter()
 response = client.inference.chat_completion(
     model_id=model_id,
     messages=messages,
@@ -35,6 +40,7 @@ response = client.inference.chat_completion(
 
 from llama_stack_client import InferenceEventLogger
 
-# Stream and print each event as it arrives
-for log in InferenceEventLogger().log(response):
-    log.print()
\ No newline at end of file
+# Stream and print each event as it arrives, then report latency metrics
+result = consume(response, logger=InferenceEventLogger(), started_at=started_at)
+print(f"\n{result.metrics}")
+print(result.metrics.format_histogram())
\ No newline at end of file
@@ -2,18 +2,35 @@
 07-llama-stack-multi-turn-conversation-and-context.py
 ----------------------------------------------------
 Implements a multi-turn conversation loop with context retention using the Llama Stack client.
+The history is kept within a token budget: old turns are summarized away while the system prompt stays pinned.
 """
 
+import os  # For environment variable access
+import time  # For timing each request
 from llama_stack_client import InferenceEventLogger  # For logging streaming events
 from termcolor import cprint  # For colored terminal output
+from client_pool import get_client  # Shared pooled Llama Stack client factory
+from context_window import ConversationWindow, llm_summarizer  # Token-budgeted conversation history
+from stream_metrics import consume  # Stream consumer with latency metrics
+
+# Initialize the client with API key
+client = get_client(
+    base_url="https://llama-stack.together.ai",
+    provider_data={
+        "together_api_key": os.environ['TOGETHER_API_KEY']
+    }
+)
 
 # Specify the model to use
 model_id = "meta-llama/Llama-3.2-3B-Instruct-Turbo"
 
-# Initialize conversation with a system prompt
-messages = [
-    {"role": "system", "content": "You are a friendly AI assistant."}
-]
+# Initialize conversation with a system prompt, keeping the prompt under 2048 tokens
+# by summarizing the oldest turns once the budget is reached
+conversation = ConversationWindow(
+    "You are a friendly AI assistant.",
+    budget=2048,
+    summarizer=llm_summarizer(client, model_id),
+)
 
 while True:
     # Get user input
@@ -22,25 +39,20 @@ while True:
         cprint("Ending conversation. Goodbye!", "blue")
         break
     # Add user message to conversation history
-    messages.append({"role": "user", "content": user_input})
+    conversation.add_user(user_input)
 
-    # Make a streaming chat completion request
+    # Make a streaming chat completion request with the budgeted history
+    started_at = time.perf_counter()
     response = client.inference.chat_completion(
         model_id=model_id,
-        messages=messages,
+        messages=conversation.messages(),
         stream=True
     )
 
-    buffer = ""  # Collect assistant's response
-
-    # Stream and print each event as it arrives
-    for log in InferenceEventLogger().log(response):
-        buffer += log.content
-        log.print()
+    # Stream and print each event as it arrives, collecting the assistant's response
+    result = consume(response, logger=InferenceEventLogger(), started_at=started_at)
 
     # Add assistant's response to conversation history
-    messages.append({
-        "role": "assistant",
-        "content": buffer,
-        "stop_reason": "end_of_turn"
-    })
\ No newline at end of file
+    conversation.add_assistant(result.text)
+    cprint(f"\n[{result.metrics}]", "dark_grey")
+    cprint(str(conversation.report()), "dark_grey")
\ No newline at end of file
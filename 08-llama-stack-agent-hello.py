@@ -5,13 +5,15 @@ Demonstrates how to use a Llama Stack Agent with web search capabilities for up-
 """
 
 import os  # For environment variable access
-from llama_stack_client import LlamaStackClient  # Llama Stack client
+from client_pool import get_client  # Shared pooled Llama Stack client factory
 from llama_stack_client import Agent  # Agent abstraction
 from llama_stack_client import AgentEventLogger  # For streaming/logging agent events
 from termcolor import cprint  # For colored terminal output
+from stream_metrics import consume  # Stream consumer with latency metrics
+import time  # For timing each turn
 
 # Initialize the Llama Stack client with API keys for Together and Tavily web search
-client = LlamaStackClient(
+client = get_client(
     base_url="https://llama-stack.together.ai", 
     provider_data={
         "together_api_key": os.environ['TOGETHER_API_KEY'],
@@ -48,6 +50,7 @@ while True:
         cprint("Ending conversation. Goodbye!", "blue")
         break
     
+    started_at = time.perf_counter()
     response = agent.create_turn(
         session_id=session_id,
         messages=[
@@ -56,5 +59,5 @@ while True:
         stream=True
     )
     
-    for log in AgentEventLogger().log(response):
-        log.print()
\ No newline at end of file
+    result = consume(response, logger=AgentEventLogger(), started_at=started_at)
+    cprint(f"[{result.metrics}]", "dark_grey")
\ No newline at end of file
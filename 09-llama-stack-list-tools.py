@@ -5,18 +5,19 @@ Lists all available tools registered with the Llama Stack client.
 """
 
 import os  # For environment variable access
-from llama_stack_client import LlamaStackClient  # Import the Llama Stack client
+from client_pool import get_client  # Shared pooled Llama Stack client factory
+from registry_cache import RegistryCache  # TTL-cached registry lookups
 
 # Initialize the client with API key
-client = LlamaStackClient(
+client = get_client(
     base_url="https://llama-stack.together.ai", 
     provider_data={
         "together_api_key": os.environ['TOGETHER_API_KEY']
     }
 )
 
-# List and print all available tools
+# List and print all available tools (cached on disk for a few minutes; see registry_cache.py)
 print("Available Tools:")
-tools = client.tools.list()
+tools = RegistryCache(client).tools()
 for tool in tools:
     print(f"- {tool.toolgroup_id} - {tool.identifier} - {tool.description}")
\ No newline at end of file
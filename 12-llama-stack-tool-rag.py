@@ -5,14 +5,19 @@ Demonstrates how to register a vector database and insert documents for RAG (Ret
 """
 
 from llama_stack_client import RAGDocument  # For document representation
-from llama_stack_client import LlamaStackClient  # Llama Stack client
+from client_pool import get_client  # Shared pooled Llama Stack client factory
+from registry_cache import RegistryCache  # TTL-cached registry lookups
+from rag_ingest import RAGIngestor, sources_from_documents  # Concurrent batched ingestion
+from ingest_manifest import DEFAULT_PATH, INGEST_MANIFEST_PATH_ENV, IngestManifest, ensure_vector_db  # Incremental ingestion
+from embedding_cache import EMBEDDING_CACHE_PATH_ENV, EmbeddingCache, embedder  # Reuses embeddings of identical chunks
+from vector_index import LOCAL_INDEX_PATH_ENV, VectorIndex, rag_query  # In-process retrieval
 import os  # For environment variable access
 
 # Define a unique ID for your vector database
 vector_db_id = "my_knowledge_base"
 
 # Initialize the client with Together AI endpoint and API key
-client = LlamaStackClient(
+client = get_client(
     base_url="https://llama-stack.together.ai", 
     provider_data={
         "together_api_key": os.environ['TOGETHER_API_KEY']
@@ -20,17 +25,31 @@ client = LlamaStackClient(
 )
 
 # List available embedding models and their dimensions
-models = client.models.list()
-for m in models:
-    if m.model_type == "embedding":
-        print(m.identifier, m.metadata["embedding_dimension"])
+registry = RegistryCache(client)
+for m in registry.models_by_type("embedding"):
+    print(m.identifier, registry.embedding_dimension(m.identifier))
 
-# Register a new vector database for RAG
-client.vector_dbs.register(
-    vector_db_id=vector_db_id,
-    embedding_model="all-MiniLM-L6-v2",
-    embedding_dimension=384,
-    provider_id="faiss"
+# The manifest remembers what is already embedded; LLAMA_STACK_INGEST_MANIFEST="" re-embeds everything
+manifest_path = os.environ.get(INGEST_MANIFEST_PATH_ENV, DEFAULT_PATH)
+manifest = IngestManifest(manifest_path, client.base_url, vector_db_id) if manifest_path else None
+# LLAMA_STACK_EMBEDDING_CACHE names a directory of cached chunk embeddings shared by every vector DB and run
+embedding_cache = EmbeddingCache(os.environ[EMBEDDING_CACHE_PATH_ENV]) if os.environ.get(EMBEDDING_CACHE_PATH_ENV) else None
+# LLAMA_STACK_LOCAL_INDEX names a file holding a local copy of the vector DB that answers queries in-process
+local_index_path = os.environ.get(LOCAL_INDEX_PATH_ENV)
+local_index = None
+if local_index_path:
+    local_index = VectorIndex.load(local_index_path) if os.path.exists(local_index_path) else VectorIndex(384)
+
+vector_db_config = dict(embedding_model="all-MiniLM-L6-v2", embedding_dimension=384, provider_id="faiss")
+# Register the vector database for RAG unless it already exists (it is rebuilt while it holds stale chunks,
+# and when a new local index has to be filled with documents the manifest says are already on the server)
+ensure_vector_db(
+    client,
+    registry,
+    vector_db_id,
+    manifest,
+    rebuild=local_index is not None and len(local_index) == 0 and manifest is not None and manifest.live_chunks() > 0,
+    **vector_db_config
 )
 
 # Prepare documents to insert into the vector database
@@ -49,17 +68,29 @@ documents = [
     )
 ]
 
-# (Continue with document insertion and search logic as needed)
-client.tool_runtime.rag_tool.insert(
-    documents=documents,
-    vector_db_id=vector_db_id,
-    chunk_size_in_tokens=50
-)
+# Insert only new and modified documents
+ingestor = RAGIngestor(client, vector_db_id, chunk_size_in_tokens=50, manifest=manifest,
+                       embedding_cache=embedding_cache, embedding_model="all-MiniLM-L6-v2", local_index=local_index)
+print("Documents loaded:", ingestor.run(sources_from_documents(documents)))
+# Chunks cannot be deleted, so the old chunks of modified or removed documents would still be retrieved:
+# rebuild the vector DB and load the documents again before querying it
+if manifest is not None and manifest.needs_compaction():
+    ensure_vector_db(client, registry, vector_db_id, manifest, **vector_db_config)
+    print("Documents reloaded:", ingestor.run(sources_from_documents(documents)))
+if manifest is not None:
+    print("Manifest:", manifest.report())
+if embedding_cache is not None:
+    print("Embedding cache:", embedding_cache.stats())
 
-results = client.tool_runtime.rag_tool.query(
-    vector_db_ids=[vector_db_id],
-    content="What is Alpaca 7?"
-)
+if local_index is not None:
+    local_index.save(local_index_path)
+    # Same result shape as rag_tool.query, without the round trip to the server's vector store
+    results = rag_query(local_index, embedder(client, "all-MiniLM-L6-v2"), "What is Alpaca 7?")
+else:
+    results = client.tool_runtime.rag_tool.query(
+        vector_db_ids=[vector_db_id],
+        content="What is Alpaca 7?"
+    )
 
 for item in results.content:
     print(item)
\ No newline at end of file
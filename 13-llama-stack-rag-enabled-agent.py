@@ -8,28 +8,41 @@ Demonstrates a Llama Stack Agent integrated with Retrieval-Augmented Generation
 # Without using RAG, Llama 3.2 will not be able to accurately answer questions about Llama Stack; it might hallucinate instead.
 
 from llama_stack_client import RAGDocument  # For document representation
-from llama_stack_client import LlamaStackClient  # Llama Stack client
+from client_pool import get_client  # Shared pooled Llama Stack client factory
+from registry_cache import RegistryCache  # TTL-cached registry lookups
+from rag_ingest import RAGIngestor, sources_from_documents, sources_from_file  # Concurrent batched ingestion
+from ingest_manifest import DEFAULT_PATH, INGEST_MANIFEST_PATH_ENV, IngestManifest, ensure_vector_db  # Incremental ingestion
+from embedding_cache import EMBEDDING_CACHE_PATH_ENV, EmbeddingCache, embedder  # Reuses embeddings of identical chunks
+from query_cache import QUERY_CACHE_ENV, enable_query_cache  # Opt-in semantic cache for knowledge base queries
 from llama_stack_client import Agent  # Agent abstraction
 from llama_stack_client import AgentEventLogger  # For streaming/logging agent events
 from termcolor import cprint  # For colored terminal output
 import os  # For environment variable access
 
 # Initialize the client with Together AI endpoint and API key
-client = LlamaStackClient(
+client = get_client(
     base_url="https://llama-stack.together.ai", 
     provider_data={
         "together_api_key": os.environ['TOGETHER_API_KEY']
     }
 )
+# With LLAMA_STACK_QUERY_CACHE=1, repeated and near-identical questions are answered from a cache that the
+# document inserts below invalidate
+query_cache_enabled = os.environ.get(QUERY_CACHE_ENV) == "1"
+client = enable_query_cache(client, embed=embedder(client, "all-MiniLM-L6-v2"))
 
-# Register a vector database for RAG
 vector_db_id = "my_knowledge_base"
-client.vector_dbs.register(
-    vector_db_id=vector_db_id,
-    embedding_model="all-MiniLM-L6-v2",
-    embedding_dimension=384,
-    provider_id="faiss"
-)
+
+# The manifest remembers what is already embedded; LLAMA_STACK_INGEST_MANIFEST="" re-embeds everything
+manifest_path = os.environ.get(INGEST_MANIFEST_PATH_ENV, DEFAULT_PATH)
+manifest = IngestManifest(manifest_path, client.base_url, vector_db_id) if manifest_path else None
+# LLAMA_STACK_EMBEDDING_CACHE names a directory of cached chunk embeddings shared by every vector DB and run
+embedding_cache = EmbeddingCache(os.environ[EMBEDDING_CACHE_PATH_ENV]) if os.environ.get(EMBEDDING_CACHE_PATH_ENV) else None
+
+vector_db_config = dict(embedding_model="all-MiniLM-L6-v2", embedding_dimension=384, provider_id="faiss")
+registry = RegistryCache(client)
+# Register a vector database for RAG unless it already exists (it is rebuilt while it holds stale chunks)
+ensure_vector_db(client, registry, vector_db_id, manifest, **vector_db_config)
 
 # Prepare and load documents into the vector database
 urls = [
@@ -49,15 +62,47 @@ documents = [
     for i, url in enumerate(urls)
 ]
 
+# RAG_SOURCES names a file of further URLs or file paths, one per line, to ingest instead
+def sources():
+    return sources_from_file(os.environ["RAG_SOURCES"]) if os.environ.get("RAG_SOURCES") else sources_from_documents(documents)
+
 print("Inserting documents into the database")
-client.tool_runtime.rag_tool.insert(
-    documents=documents,
-    vector_db_id=vector_db_id,
-    chunk_size_in_tokens=256
+ingestor = RAGIngestor(
+    client,
+    vector_db_id,
+    chunk_size_in_tokens=256,
+    batch_size=int(os.environ.get("RAG_BATCH_SIZE", "64")),
+    fetch_workers=int(os.environ.get("RAG_FETCH_WORKERS", "8")),
+    manifest=manifest,
+    embedding_cache=embedding_cache,
+    embedding_model="all-MiniLM-L6-v2",
 )
-print("Documents loaded")
+print("Documents loaded:", ingestor.run(sources()))
+# Chunks cannot be deleted, so the old chunks of modified or removed documents would still be retrieved:
+# rebuild the vector DB and load the documents again before the agent searches it
+if manifest is not None and manifest.needs_compaction():
+    ensure_vector_db(client, registry, vector_db_id, manifest, **vector_db_config)
+    print("Documents reloaded:", ingestor.run(sources()))
+if manifest is not None:
+    print("Manifest:", manifest.report())
+if embedding_cache is not None:
+    print("Embedding cache:", embedding_cache.stats())
+
+
+def knowledge_search(query: str) -> str:
+    """
+    Searches the Llama Stack documentation for passages relevant to a question.
+
+    :param query: The question or keywords to search for
+    :return: The most relevant passages
+    """
+    result = client.tool_runtime.rag_tool.query(content=query, vector_db_ids=[vector_db_id])
+    if isinstance(result.content, str):
+        return result.content
+    return "".join(getattr(item, "text", "") for item in result.content or [])
+
 
-# Create an agent with RAG tool enabled
+# Create an agent with RAG tool enabled; with the query cache the search runs client-side so it can be cached
 agent = Agent(
     client=client,
     model="meta-llama/Llama-3.2-3B-Instruct-Turbo",
@@ -72,7 +117,7 @@ agent = Agent(
         
         For other questions outside this domain, use your general knowledge as usual.
         """,
-    tools=[
+    tools=[knowledge_search] if query_cache_enabled else [
         {
             "name": "builtin::rag/knowledge_search",
             "args": {"vector_db_ids": ["my_knowledge_base"]}
@@ -86,6 +131,8 @@ session_id = agent.create_session("rag-qa-session")
 while True:
     user_input = input("You: ")
     if user_input.lower() == "exit":
+        if query_cache_enabled:
+            print("Query cache:", client.tool_runtime.rag_tool.cache.stats())
         cprint("Ending conversation. Goodbye!", "blue")
         break
     # Create a new turn with user input
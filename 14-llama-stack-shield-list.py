@@ -5,18 +5,19 @@ Lists all available shields (safety/guardrail models) registered with the Llama
 """
 
 import os  # For environment variable access
-from llama_stack_client import LlamaStackClient  # Llama Stack client
+from client_pool import get_client  # Shared pooled Llama Stack client factory
+from registry_cache import RegistryCache  # TTL-cached registry lookups
 
 # Initialize the client with Together AI endpoint and API key
-client = LlamaStackClient(
+client = get_client(
     base_url="https://llama-stack.together.ai", 
     provider_data = {
         "together_api_key": os.environ['TOGETHER_API_KEY']
     }
 )
 
-# List all available shields (guardrails)
-shields = client.shields.list()
+# List all available shields (guardrails), cached on disk for a few minutes; see registry_cache.py
+shields = RegistryCache(client).shields()
 print("Available shields:")
 for shield in shields:
     # Print each shield's identifier and provider
@@ -5,11 +5,12 @@ Demonstrates registering a shield (guardrail), using it with an agent for safe i
 """
 
 import os  # For environment variable access
-from llama_stack_client import LlamaStackClient  # Llama Stack client
+from client_pool import get_client  # Shared pooled Llama Stack client factory
+from registry_cache import RegistryCache  # TTL-cached registry lookups
 from llama_stack_client import Agent  # Agent abstraction
 
 # Initialize the client
-client = LlamaStackClient(
+client = get_client(
     base_url="https://llama-stack.together.ai", 
     provider_data = {
         "together_api_key": os.environ['TOGETHER_API_KEY']
@@ -23,6 +24,8 @@ client.shields.register(
     shield_id=shield_id,
     provider_shield_id="meta-llama/Llama-Guard-3-8B"
 )
+# The server's shield list just changed
+RegistryCache(client).invalidate("shields")
 
 # Create an agent that uses the shield for both input and output
 agent = Agent(
@@ -7,13 +7,13 @@ Demonstrates Llama Stack telemetry: logging, streaming, and querying spans for o
 # Telemetry makes Llama Stack applications observable. Whether we're debugging one bad response or evaluating system performance at scale, having structured, queryable logs gives us the visibility we need to build reliable, responsive AI systems.
 
 import os  # For environment variable access
-from llama_stack_client import LlamaStackClient  # Llama Stack client
+from client_pool import get_client  # Shared pooled Llama Stack client factory
 from llama_stack_client import Agent  # Agent abstraction
 from llama_stack_client import AgentEventLogger  # For streaming/logging agent events
 from rich.pretty import pprint  # For pretty-printing telemetry output
 
 # Initialize the client
-client = LlamaStackClient(
+client = get_client(
     base_url="https://llama-stack.together.ai", 
     provider_data = {
         "together_api_key": os.environ['TOGETHER_API_KEY']
@@ -5,11 +5,12 @@ Lists available scoring functions and demonstrates a simple evaluation loop for
 """
 
 import os  # For environment variable access
-from llama_stack_client import LlamaStackClient  # Llama Stack client
+from client_pool import get_client  # Shared pooled Llama Stack client factory
+from rate_limiter import lane  # Priority lanes for the shared request scheduler
 from llama_stack_client import Agent  # Agent abstraction
 
 # Initialize the client
-client = LlamaStackClient(
+client = get_client(
     base_url="https://llama-stack.together.ai", 
     provider_data = {
         "together_api_key": os.environ['TOGETHER_API_KEY']
@@ -42,16 +43,17 @@ scoring_params = {
 }
 
 # Evaluate agent responses for each row
-for row in eval_rows:
-    response = agent.create_turn(
-        messages=[{"role": "user", "content": row["input_query"]}],
-        session_id=session_id,
-        stream=False
-    )
-    generated_answer = response.output_message.content
-    print(generated_answer)
-    row["generated_answer"] = generated_answer
-    
+with lane("batch"):  # Evaluation traffic yields to interactive requests in the same process
+    for row in eval_rows:
+        response = agent.create_turn(
+            messages=[{"role": "user", "content": row["input_query"]}],
+            session_id=session_id,
+            stream=False
+        )
+        generated_answer = response.output_message.content
+        print(generated_answer)
+        row["generated_answer"] = generated_answer
+
 scoring_response = client.scoring.score(
     input_rows=eval_rows, 
     scoring_functions=scoring_params
@@ -3,14 +3,21 @@
 ---------------------------------------------------
 Demonstrates running two Llama Stack agents with different providers (hosted vs. local/Ollama) side-by-side.
 Shows how the same logic can be used with different models/environments, and compares outputs.
+With HEDGE=1 the question is instead sent hedged: to one provider first and to the other only if the first
+has not started answering by its p95 time-to-first-token (see hedged_requests.py).
+With PROVIDER_ROUTING=1 it goes to whichever provider has recently been fastest and reliable among those
+meeting PROVIDER_MIN_TIER (see provider_router.py).
 """
 
 import os  # For environment variable access
-from llama_stack_client import LlamaStackClient  # Llama Stack client
+from client_pool import get_client  # Shared pooled Llama Stack client factory
+from hedged_requests import Hedger, compare, format_comparison  # Hedged requests across providers
+from stream_metrics import drain  # Consumes a streamed agent turn into text and metrics
+from provider_router import Candidate, ProviderRouter  # Latency-adaptive provider selection
 from llama_stack_client import Agent  # Agent abstraction
 
 # Initialize the client
-client = LlamaStackClient(
+client = get_client(
     base_url="https://llama-stack.together.ai", 
     provider_data = {
         "together_api_key": os.environ['TOGETHER_API_KEY']
@@ -44,17 +51,51 @@ session_local = agent_local.create_session("local-session")
 
 question = "What is the capital of the country whose flag has a red circle on a white background, and which is located in East Asia?"
 
-response_hosted = agent_hosted.create_turn(
-    session_id=session_hosted,
-    messages=[{"role": "user", "content": question}],
-    stream=False
-)
+if os.environ.get("HEDGE") == "1":
+    agents = {"hosted": (agent_hosted, session_hosted), "local": (agent_local, session_local)}
 
-response_local = agent_local.create_turn(
-    session_id=session_local,
-    messages=[{"role": "user", "content": question}],
-    stream=False
-)
+    def open_stream(target, message):
+        agent, session_id = agents[target]
+        return client.agents.turn.create(session_id=session_id, agent_id=agent.agent_id,
+                                         messages=[{"role": "user", "content": message}], stream=True)
+
+    # HEDGE_PRIMARY picks the provider asked first; the other one is the backup
+    primary = os.environ.get("HEDGE_PRIMARY", "hosted")
+    hedger = Hedger(open_stream, primary, "local" if primary == "hosted" else "hosted")
+    # Each question is asked of the primary alone first, to measure the tail hedging removes
+    baseline, stats = compare(hedger, [question] * int(os.environ.get("HEDGE_REPEATS", "8")))
+    outcome = hedger.run(question)
+    print(f"Hedged answer ({outcome.winner}):", outcome.result.text if outcome.result else outcome.errors)
+    print(format_comparison(baseline, stats))
+elif os.environ.get("PROVIDER_ROUTING") == "1":
+    # The hosted 3B model is the higher quality tier; tier 1 lets the local 1B model take requests too
+    candidates = {
+        Candidate("meta-llama/Llama-3.2-3B-Instruct-Turbo", "together", tier=2): (agent_hosted, session_hosted),
+        Candidate("llama3.2:1b", "ollama", tier=1): (agent_local, session_local),
+    }
+    router = ProviderRouter(candidates)
+
+    def ask(candidate):
+        agent, session_id = candidates[candidate]
+        return drain(client.agents.turn.create(session_id=session_id, agent_id=agent.agent_id,
+                                               messages=[{"role": "user", "content": question}], stream=True))
+
+    candidate, result = router.call(ask, min_tier=int(os.environ.get("PROVIDER_MIN_TIER", "1")))
+    router.save()
+    print(f"Routed to {candidate.provider} ({candidate.model}):", result.text)
+    print(router.report())
+else:
+    response_hosted = agent_hosted.create_turn(
+        session_id=session_hosted,
+        messages=[{"role": "user", "content": question}],
+        stream=False
+    )
+
+    response_local = agent_local.create_turn(
+        session_id=session_local,
+        messages=[{"role": "user", "content": question}],
+        stream=False
+    )
 
-print("Hosted Agent:", response_hosted.output_message.content)
-print("\nLocal Agent:", response_local.output_message.content)
\ No newline at end of file
+    print("Hosted Agent:", response_hosted.output_message.content)
+    print("\nLocal Agent:", response_local.output_message.content)
\ No newline at end of file
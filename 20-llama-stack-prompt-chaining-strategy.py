@@ -6,8 +6,9 @@ each building on the previous, to solve a multi-step problem (summarize, simplif
 """
 
 import os  # For environment variable access
-from llama_stack_client import LlamaStackClient  # Llama Stack client
-from llama_stack_client import Agent  # Agent abstraction
+from chain_checkpoints import ChainCheckpoints, checkpoint_path  # Resumable stages
+from chain_pipeline import ChainPipeline, Stage, chat_call, read_jsonl  # Pipelined chaining over many documents
+from client_pool import get_client  # Shared pooled Llama Stack client factory
 
 # Pattern 1: Prompt chaining
 # Prompt chaining is the simplest and most reliable agent workflow. It sequences multiple LLM calls, with each step building directly on the previous one.
@@ -15,9 +16,18 @@ from llama_stack_client import Agent  # Agent abstraction
 # - The overall task can be broken down into a sequence of simple subtasks
 # - Each subtask has a clear and unambiguous goal
 # - Deterministic flow is more important than flexibility
+#
+# Each step passes the previous output explicitly instead of relying on one session's history, so a step
+# depends only on (model, instructions, prompt, input). That lets step outputs be checkpointed
+# (chain_checkpoints.py; opt in with LLAMA_STACK_CHAIN_CHECKPOINTS=1 or a SQLite path), so rerunning after a
+# failure or after editing a later prompt only repeats the steps that changed.
+#
+# To run the same chain over many documents set CHAIN_INPUT to a JSONL file of {"id": ..., "text": ...} records.
+# The stages then run as a pipeline (chain_pipeline.py): each stage has CHAIN_WORKERS workers (default 4) fed by
+# a bounded queue, and every finished document is appended to CHAIN_OUTPUT (default chain_output.jsonl).
 
 # Initialize the client
-client = LlamaStackClient(
+client = get_client(
     base_url="https://llama-stack.together.ai", 
     provider_data = {
         "together_api_key": os.environ['TOGETHER_API_KEY']
@@ -31,25 +41,36 @@ document = """
         enabling flexible deployment across local, cloud, and edge environments.
         """
 
-agent = Agent(
-    client=client,
-    model="meta-llama/Llama-3.2-3B-Instruct-Turbo",
-    instructions="You are a helpful assistant capable of formatting report data."
-)
-
-session_id = agent.create_session("fact-check-prompt_chain_demo")
+model_id = "meta-llama/Llama-3.2-3B-Instruct-Turbo"
+instructions = "You are a helpful assistant capable of formatting report data."
 
-prompts = [
-    f"Summarize the following paragraph in 2-3 sentences:\n{document}",
-    "Now rewrite the summary in plain English, avoiding any jargon.",
-    "Translate the result into Spanish. Use a natural tone.",
-    "Rewrite the Spanish version to sound more casual and conversational."
+# Each step receives the previous step's output as {input}
+workers = int(os.environ.get("CHAIN_WORKERS", "4"))
+stages = [
+    Stage("summarize", "Summarize the following paragraph in 2-3 sentences:\n{input}", workers),
+    Stage("simplify", "Rewrite this summary in plain English, avoiding any jargon. Reply with the rewrite only:\n{input}", workers),
+    Stage("translate", "Translate this text into Spanish. Use a natural tone. Reply with the translation only:\n{input}", workers),
+    Stage("casualize", "Rewrite this Spanish text to sound more casual and conversational. Reply with the rewrite only:\n{input}", workers),
 ]
 
-for i, prompt in enumerate(prompts):
-    response = agent.create_turn(
-        session_id=session_id,
-        messages=[{"role": "user", "content": prompt}],
-        stream=False,
-    )
-    print(f"Turn {i+1}:\n{response.output_message.content}\n")
\ No newline at end of file
+# With checkpoints enabled a rerun resumes at the first changed or failed stage
+path = checkpoint_path()
+checkpoints = ChainCheckpoints(path, model_id, instructions) if path else None
+
+pipeline = ChainPipeline(stages, chat_call(client, model_id, instructions), checkpoints=checkpoints)
+
+if os.environ.get("CHAIN_INPUT"):
+    output_path = os.environ.get("CHAIN_OUTPUT", "chain_output.jsonl")
+    for item in pipeline.run(read_jsonl(os.environ["CHAIN_INPUT"]), jsonl_path=output_path):
+        print(f"{item.id}: {item.error or 'done'}")
+    print(pipeline.stats())
+else:
+    for item in pipeline.run([("demo", document)]):
+        for i, (name, output) in enumerate(item.outputs.items()):
+            source = " (checkpoint)" if name in item.checkpointed else ""
+            print(f"Turn {i+1}: {name}{source}\n{output}\n")
+        if item.error:
+            print(f"Stage {item.failed_stage} failed: {item.error}")
+
+if checkpoints is not None:
+    print(checkpoints.report())
@@ -20,12 +20,33 @@ mimicking real-world triage and delegation in multi-agent LLM systems.
 # This structure mirrors real-world systems in customer service, IT support, and internal automation.
 # It also scales well. Adding a new intent means adding one agent and updating the routing logic schema,
 # without disrupting the flow.
+#
+# Most queries are easy to classify, so a local TF-IDF classifier (intent_router.py) answers the confident
+# ones in well under a millisecond and only ambiguous queries pay for a routing-agent turn.
+# Add labeled examples to HR_EXAMPLES when adding an intent; ROUTING_CONFIDENCE tunes the fallback threshold.
+#
+# With ROUTING_MODE=speculative the most frequently routed specialist starts answering while the router
+# is still deciding; its answer is kept when the router agrees and cancelled when it does not. Each speculation
+# runs in a fresh session: a hit's session becomes the specialist's main session (the accepted answer is not
+# generated twice, so the conversation continues from that turn), a miss's session is deleted.
+#
+# The routing agent's JSON reply is streamed and parsed as it arrives, so the query is dispatched as soon as
+# the "intent" field is complete instead of after the whole "reason" has been written (ROUTING_STREAM=0 waits).
+#
+# For overnight triage set HR_BATCH_FILE to a file with one query per line ("-" reads stdin). Queries are then
+# routed concurrently and answered by HR_BATCH_WORKERS workers per specialist (default 4), each ticket in a fresh
+# session so no employee's query reaches another's reply, and throughput, queue depths and latency percentiles
+# are printed at the end.
 
 from pydantic import BaseModel
 import json
 import os  # For environment variable access
-from llama_stack_client import LlamaStackClient  # Llama Stack client
-from llama_stack_client import Agent  # Agent abstraction
+import sys  # For reading batch queries from stdin
+from batch_router import BatchRouter  # Concurrent batch triage with per-specialist worker pools
+from agent_pool import AgentPool  # Lazily created, reused agents and named sessions
+from client_pool import get_client  # Shared pooled Llama Stack client factory
+from intent_router import HR_EXAMPLES, LocalIntentClassifier, SpeculativeRouter, TieredRouter, read_fields_until  # Routing strategies
+from stream_metrics import drain  # Cancellable consumer for specialist turn streams
 
 base_config = {
     "model": "meta-llama/Llama-3.2-3B-Instruct-Turbo",
@@ -35,31 +56,38 @@ base_config = {
 }
 
 # Initialize the client
-client = LlamaStackClient(
+client = get_client(
     base_url="https://llama-stack.together.ai", 
     provider_data = {
         "together_api_key": os.environ['TOGETHER_API_KEY']
     }
 )
 
-specialized_agents = {
-    "policy": Agent(client, instructions="You are an HR policy assistant. Answer questions about vacation, benefits, leave, etc.", **base_config),
-    "feedback": Agent(client, instructions="You collect anonymous employee feedback. Be neutral and encouraging.", **base_config),
-    "scheduling": Agent(client, instructions="You help schedule internal meetings. Confirm times and required participants.", **base_config)
+# Specialists and the routing agent come from an agent pool: each is created on first use (or adopted from an
+# earlier run, since the pool remembers agent ids per server); routing turns borrow pooled sessions that are
+# retired after max_session_turns, so their history stays short
+agent_pool = AgentPool(client)
+
+specialist_instructions = {
+    "policy": "You are an HR policy assistant. Answer questions about vacation, benefits, leave, etc.",
+    "feedback": "You collect anonymous employee feedback. Be neutral and encouraging.",
+    "scheduling": "You help schedule internal meetings. Confirm times and required participants."
 }
 
-specialized_agents_session_ids = {
-    "policy": specialized_agents["policy"].create_session("policy_agent"),
-    "feedback": specialized_agents["feedback"].create_session("feedback_agent"),
-    "scheduling": specialized_agents["scheduling"].create_session("scheduling_agent"),
-}    
+def specialist(category: str):
+    return agent_pool.agent(instructions=specialist_instructions[category], **base_config)
+
+def specialist_session(category: str):
+    # The main conversation with a specialist
+    return agent_pool.named_session(specialist(category), f"{category}_agent")
+
+routing_mode = os.environ.get("ROUTING_MODE", "tiered")
 
 class RoutingDecision(BaseModel):
-    intent: str  # one of: policy, feedback, scheduling
+    intent: str  # one of: policy, feedback, scheduling (keep first: the streamed router dispatches on it)
     reason: str
 
-routing_agent = Agent(
-    client,
+routing_config = dict(
     instructions="""
     You're an intent classifier for an HR assistant. Decide whether the employee's query relates to:
     - policy
@@ -76,32 +104,86 @@ routing_agent = Agent(
     **base_config
 )
 
-routing_agent_session_id = routing_agent.create_session("routing_agent")
+def route_with_llm(user_input: str):
+    # Each routing turn borrows a session to itself (batch mode routes from several threads at once)
+    with agent_pool.session(**routing_config) as (routing_agent, session_id):
+        if os.environ.get("ROUTING_STREAM", "1") == "1":
+            stream = client.agents.turn.create(
+                agent_id=routing_agent.agent_id,
+                session_id=session_id,
+                messages=[{"role": "user", "content": user_input}],
+                stream=True
+            )
+            # RoutingDecision lists intent first, so the reason can be skipped once the intent is known
+            decision = read_fields_until(stream, "intent")
+            return decision["intent"], decision.get("reason", "(dispatched before the reason was written)")
+
+        routing_turn = routing_agent.create_turn(
+            messages=[{"role": "user", "content": user_input}],
+            session_id=session_id,
+            stream=False
+        )
+    decision = json.loads(routing_turn.output_message.content)
+    return decision["intent"], decision["reason"]
 
-def handle_hr_query(user_input: str):
-    routing_turn = routing_agent.create_turn(
+# The routing agent is only consulted when the local classifier is unsure
+router = TieredRouter(LocalIntentClassifier(HR_EXAMPLES), route_with_llm)
+
+def specialist_turn(category: str, session_id: str, user_input: str, cancelled=None):
+    # The raw turn stream (rather than agent.create_turn) can be closed to cancel generation on the server
+    stream = client.agents.turn.create(
+        agent_id=specialist(category).agent_id,
+        session_id=session_id,
         messages=[{"role": "user", "content": user_input}],
-        session_id=routing_agent_session_id,
-        stream=False
+        stream=True
     )
+    result = drain(stream, cancelled)
+    result.session_id = session_id
+    return result
+
+def ask_specialist(category: str, user_input: str, cancelled=None, speculative=False, session_id=None):
+    if category not in specialist_instructions:
+        return None
+    if speculative:
+        # A session per speculation, kept until the router decides (see accept/discard_speculation)
+        session_id = agent_pool.create_session(specialist(category), f"{category}_speculative")
+        try:
+            return specialist_turn(category, session_id, user_input, cancelled)
+        except Exception:
+            agent_pool.retire_session(specialist(category), session_id)
+            raise
+    return specialist_turn(category, session_id or specialist_session(category), user_input, cancelled)
+
+def accept_speculation(category: str, user_input: str, answer):
+    # The hit's session already holds the accepted turn: make it the main session instead of replaying the turn
+    agent_pool.adopt_session(specialist(category), f"{category}_agent", answer.session_id)
+
+def discard_speculation(category: str, user_input: str, answer):
+    # A miss never shows up in the main conversation
+    agent_pool.retire_session(specialist(category), answer.session_id)
+
+speculator = (
+    SpeculativeRouter(router.route, ask_specialist, accept=accept_speculation, discard=discard_speculation)
+    if routing_mode == "speculative" else None
+)
 
+def handle_hr_query(user_input: str):
     try:
-        decision = json.loads(routing_turn.output_message.content)
-        category = decision["intent"]
-        reason = decision["reason"]
-
-        print(f"[Routing → {category}] {reason}")
-
-        agent = specialized_agents.get(category)
-        if not agent:
+        if speculator is not None:
+            outcome = speculator.handle(user_input)
+            route, response = outcome.route, outcome.answer
+            speculation = f", speculative {'hit' if outcome.hit else 'miss'}" if outcome.speculated else ""
+        else:
+            route = router.route(user_input)
+            response = ask_specialist(route.intent, user_input)
+            speculation = ""
+        category = route.intent
+
+        print(f"[Routing → {category} via {route.source}, {route.latency * 1000:.1f} ms{speculation}] {route.reason}")
+
+        if response is None:
             return f"No handler for category '{category}'"
-
-        response = agent.create_turn(
-            messages=[{"role": "user", "content": user_input}],
-            session_id=specialized_agents_session_ids.get(category),
-            stream=False
-        )
-        return response.output_message.content
+        return response.text
 
     except Exception as e:
         return f"Routing error: {str(e)}"
@@ -112,7 +194,29 @@ queries = [
     "Can you book a 30-minute 1:1 with my manager this Friday afternoon?"
 ]
 
-for q in queries:
-    print("\n---")
-    print("Employee:", q)
-    print("Assistant:", handle_hr_query(q))
\ No newline at end of file
+batch_file = os.environ.get("HR_BATCH_FILE")
+
+if batch_file:
+    batch = BatchRouter(
+        router.route,
+        lambda category, user_input, session_id: ask_specialist(category, user_input, session_id=session_id),
+        lambda category: agent_pool.temporary_session(specialist(category), f"{category}_ticket"),
+        specialist_instructions,
+        workers=int(os.environ.get("HR_BATCH_WORKERS", "4"))
+    )
+    with (sys.stdin if batch_file == "-" else open(batch_file)) as lines:
+        for result in batch.run(line.strip() for line in lines if line.strip()):
+            print("\n---")
+            print("Employee:", result.query)
+            print(f"[{result.intent}, {result.latency:.2f}s]", result.error or result.answer.text)
+    print("\n" + str(batch.stats()))
+else:
+    for q in queries:
+        print("\n---")
+        print("Employee:", q)
+        print("Assistant:", handle_hr_query(q))
+
+print("\n" + str(router.stats()))
+if speculator is not None:
+    speculator.shutdown()
+    print(speculator.stats())
\ No newline at end of file
@@ -30,8 +30,8 @@ mirroring scalable, map-reduce style LLM workflows in production.
 import os  # For environment variable access
 from concurrent.futures import ThreadPoolExecutor
 
-from llama_stack_client import LlamaStackClient  # Llama Stack client
-from llama_stack_client import Agent  # Agent abstraction
+from agent_pool import AgentPool  # Agents and warm sessions reused by configuration
+from client_pool import get_client  # Shared pooled Llama Stack client factory
 
 base_config = {
     "model": "meta-llama/Llama-3.2-3B-Instruct-Turbo",
@@ -40,14 +40,6 @@ base_config = {
     }
 }
 
-# Initialize the client
-client = LlamaStackClient(
-    base_url="https://llama-stack.together.ai", 
-    provider_data = {
-        "together_api_key": os.environ['TOGETHER_API_KEY']
-    }
-)
-
 base_alert = """
 ⚠️ Critical Notice:
 Due to a system vulnerability identified in our authentication service, we are temporarily restricting new user sign-ups. 
@@ -61,25 +53,36 @@ locale_configs = {
     "jp": "Translate into Japanese using business etiquette. Append: 'サポート: support-jp@example.com'"
 }
 
-def build_agent(instructions):
-    return Agent(
-        client=client,
+# Initialize the client, sizing its connection pool to one connection per worker thread
+client = get_client(
+    base_url="https://llama-stack.together.ai", 
+    provider_data = {
+        "together_api_key": os.environ['TOGETHER_API_KEY']
+    },
+    pool_size=len(locale_configs)
+)
+
+# Agents are pooled by configuration: each locale's agent is created once (and its id remembered across runs),
+# and its sessions are kept warm, so repeated alerts skip the agent and session round trips
+agent_pool = AgentPool(client)
+
+def agent_config(instructions):
+    return dict(
         model="meta-llama/Llama-3.2-3B-Instruct-Turbo",
         instructions=instructions,
         sampling_params={
             "strategy": {"type": "top_p", "temperature": 0.5, "top_p": 0.85}
         }
     )
-    
+
 def localize_alert(language, prompt, message):
-    print(f"Creating {language} agent")
-    agent = build_agent(prompt)
-    session_id = agent.create_session(session_name=f"alert_{language}")
-    response = agent.create_turn(
-        session_id=session_id,
-        messages=[{"role": "user", "content": message}],
-        stream=False
-    )
+    print(f"Getting {language} agent")
+    with agent_pool.session(**agent_config(prompt)) as (agent, session_id):
+        response = agent.create_turn(
+            session_id=session_id,
+            messages=[{"role": "user", "content": message}],
+            stream=False
+        )
     return language, response.output_message.content
 
 # This setup offers simultaneous processing, which means immediate readiness across time zones. 
@@ -89,6 +92,8 @@ def localize_alert(language, prompt, message):
 # AI-powered evaluations in parallel (e.g. scoring or grading). This approach mirrors map-reduce-style data 
 # processing pipelines and is a strong candidate for serverless or autoscaled backends.
 
+# One thread per locale is fine for a handful of regions. For hundreds of locales and tenants, use the
+# asyncio engine in async_fanout.py, which bounds concurrency and yields translations as they complete.
 with ThreadPoolExecutor(max_workers=len(locale_configs)) as executor:
     futures = [
         executor.submit(localize_alert, lang, prompt, base_alert)
@@ -97,4 +102,6 @@ with ThreadPoolExecutor(max_workers=len(locale_configs)) as executor:
     results = [future.result() for future in futures]
 
 for lang, output in results:
-    print(f"\n🌐 [{lang.upper()}] Translated Alert:\n{output}")
\ No newline at end of file
+    print(f"\n🌐 [{lang.upper()}] Translated Alert:\n{output}")
+
+print(f"\nAgent pool: {agent_pool.stats().as_dict()}")
\ No newline at end of file
@@ -5,13 +5,17 @@ Demonstrates building a conversational chatbot agent with Llama Stack, safety sh
 tool use (Wolfram Alpha, web search), and a streaming interactive loop.
 """
 
-from llama_stack_client import LlamaStackClient, Agent, AgentEventLogger
+from llama_stack_client import Agent, AgentEventLogger
+from client_pool import get_client
+from registry_cache import RegistryCache
 from termcolor import cprint
+from stream_metrics import consume
+import time
 import os
 
 # Step 1: Setting the stage and connecting to our LLM
 
-client = LlamaStackClient(
+client = get_client(
     base_url="https://llama-stack.together.ai", 
     provider_data = {
         "together_api_key": os.environ['TOGETHER_API_KEY'],
@@ -28,6 +32,7 @@ client.shields.register(
     shield_id=shield_id,
     provider_shield_id="meta-llama/Llama-Guard-3-8B"
 )
+RegistryCache(client).invalidate("shields")
 
 # Step 3: Defining the agent and its tools
 
@@ -66,6 +71,7 @@ while True:
         cprint("Ending conversation. Goodbye!", "blue")
         break
     
+    started_at = time.perf_counter()
     response = agent.create_turn(
         session_id=session_id,
         messages=[
@@ -74,5 +80,5 @@ while True:
         stream=True
     )
     
-    for log in AgentEventLogger().log(response):
-        log.print()
\ No newline at end of file
+    result = consume(response, logger=AgentEventLogger(), started_at=started_at)
+    cprint(f"[{result.metrics}]", "dark_grey")
\ No newline at end of file
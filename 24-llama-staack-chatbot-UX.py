@@ -7,9 +7,12 @@ with a modern chat interface and robust error handling. Shows how to build a pro
 
 import gradio as gr
 from gradio import ChatMessage
+from gradio_stream import FrameCoalescer, render_turn
 import os
-from llama_stack_client import LlamaStackClient, Agent
-import uuid
+from llama_stack_client import Agent
+from client_pool import get_client
+from registry_cache import RegistryCache
+from session_registry import SessionLimitError, SessionRegistry
 from datetime import datetime
 
 # --- 1. SETUP AND INITIALIZATION ---
@@ -18,7 +21,7 @@ def get_current_date_formatted():
 
 # Initialize the LlamaStack client
 try:
-    client = LlamaStackClient(
+    client = get_client(
         base_url="https://llama-stack.together.ai",
         provider_data={
             "together_api_key": os.environ['TOGETHER_API_KEY'],
@@ -35,6 +38,7 @@ client.shields.register(
     shield_id=shield_id,
     provider_shield_id="meta-llama/Llama-Guard-3-8B"
 )
+RegistryCache(client).invalidate("shields")
 
 # Define agent instructions
 instructions = f"""
@@ -64,6 +68,16 @@ agent = Agent(
     output_shields=[shield_id]
 )
 
+# One agent session per browser session, bounded so memory and server-side state stay flat under many users
+sessions = SessionRegistry(
+    agent,
+    max_sessions=int(os.environ.get("GRADIO_MAX_SESSIONS", "256")),
+    idle_timeout=float(os.environ.get("GRADIO_SESSION_IDLE_SECONDS", "1800")),
+    max_in_flight=1,
+)
+# Turns streamed at once across all users; further requests wait in Gradio's queue
+concurrency_limit = int(os.environ.get("GRADIO_CONCURRENCY", "16"))
+
 print("✅ Agent and Client initialized successfully.")
 
 # --- 2. GRADIO CHAT LOGIC ---
@@ -78,92 +92,46 @@ def add_user_message(user_input, history):
     
     return gr.update(value="", interactive=False), history
 
-def stream_response(history, session_id):
+def stream_response(history, request: gr.Request):
     """
     Streams the response, updating the last ChatMessage's content and metadata.
+    Text deltas are coalesced into frames (see gradio_stream.py) so the UI is not re-sent on every token.
+    The agent session comes from the session registry, keyed by the browser's Gradio session.
     """
-    if not session_id:
-        session_id = agent.create_session(f"gradio-chat-{uuid.uuid4()}")
-        print(f"✨ New session created: {session_id}")
-
     user_message = history[-1]["content"]
-    
-    response_stream = agent.create_turn(
-        session_id=session_id,
-        messages=[{"role": "user", "content": user_message}],
-        stream=True
-    )
 
-    # State to track if we are currently inside an inference block
-    in_inference_block = False
-    
-    for chunk in response_stream:
-        try:
-            if not hasattr(chunk, "event") or not hasattr(chunk.event, "payload"):
-                continue
-
-            payload = chunk.event.payload
-            event_type = payload.event_type
-            step_type = getattr(payload, 'step_type', None)
-
-            # --- Event 1: A Tool Execution step has completed ---
-            if step_type == "tool_execution" and event_type == "step_complete":
-                in_inference_block = False
-                details = getattr(payload, 'step_details', None)
-                if details:
-                    for t in getattr(details, 'tool_calls', []):
-                        history.append(ChatMessage(
-                            role="assistant",
-                            content=f"Tool `{t.tool_name}` was used.",
-                            metadata={"title": f"⚙️ Used Tool: `{t.tool_name}`"}
-                        ))
-                        yield history, session_id
-
-            # --- Event 2: A Shield Call step has completed ---
-            elif step_type == "shield_call" and event_type == "step_complete":
-                in_inference_block = False
-                details = getattr(payload, 'step_details', None)
-                if details:
-                    title = "🛡️ Safety Check: Passed"
-                    content = "Message passed the safety check."
-                    if details.violation:
-                        title = f"🚨 Safety Violation - Please clear chat"
-                        content = details.violation.user_message
-                        history.append(ChatMessage(
-                            role="assistant",
-                            content=content,
-                            metadata={"title": title}
-                        ))
-                    yield history, session_id
-
-            # --- Event 3: An Inference step is in progress (streaming text) ---
-            elif step_type == "inference" and event_type == "step_progress":
-                delta = getattr(payload, 'delta', None)
-                if delta and delta.type == "text":
-                    # If this is the first text chunk, create a new message bubble
-                    if not in_inference_block:
-                        in_inference_block = True
-                        history.append(ChatMessage(role="assistant", content=""))
-                    # Append the streamed text to the last message
-                    history[-1].content += delta.text
-                    yield history, session_id
-
-        except Exception as e:
-            print(f"Error processing stream chunk: {e}\nChunk: {chunk}")
-            continue
-
-    yield history, session_id
-
-
-def clear_chat():
+    try:
+        with sessions.acquire(request.session_hash) as session_id:
+            response_stream = agent.create_turn(
+                session_id=session_id,
+                messages=[{"role": "user", "content": user_message}],
+                stream=True
+            )
+
+            yield from render_turn(response_stream, history, FrameCoalescer())
+    except SessionLimitError:
+        raise gr.Error("Please wait for the current reply to finish.")
+
+
+def clear_chat(request: gr.Request):
     """Clears the chat history and resets the session."""
-    return [], None
+    sessions.close(request.session_hash)
+    return []
+
+
+def end_session(request: gr.Request):
+    """Releases the agent session when the browser tab is closed."""
+    sessions.close(request.session_hash)
+
+
+def session_stats():
+    """Evicts idle sessions and reports live-session and eviction counts for monitoring."""
+    sessions.sweep()
+    return sessions.stats().as_dict()
 
 # --- 3. GRADIO UI DEFINITION ---
 
 with gr.Blocks(theme=gr.themes.Soft(), title="LlamaStack Agent") as demo:
-    session_id_state = gr.State(None)
-    
     gr.Markdown(
         """
         # 🤖 LlamaStack Chatbot Agent
@@ -184,6 +152,9 @@ with gr.Blocks(theme=gr.themes.Soft(), title="LlamaStack Agent") as demo:
 
     clear_btn = gr.Button("🗑️ Clear Chat", variant="stop")
 
+    with gr.Accordion("Server stats", open=False):
+        stats_json = gr.JSON(label="Agent sessions")
+
     # --- 4. Event Handlers ---
     
     submit_event = user_input_textbox.submit(
@@ -192,8 +163,10 @@ with gr.Blocks(theme=gr.themes.Soft(), title="LlamaStack Agent") as demo:
         outputs=[user_input_textbox, chatbot]
     ).then(
         fn=stream_response,
-        inputs=[chatbot, session_id_state],
-        outputs=[chatbot, session_id_state]
+        inputs=[chatbot],
+        outputs=[chatbot],
+        concurrency_limit=concurrency_limit,
+        concurrency_id="agent_turns"
     ).then(
         fn=lambda: gr.update(interactive=True),
         outputs=[user_input_textbox]
@@ -205,16 +178,22 @@ with gr.Blocks(theme=gr.themes.Soft(), title="LlamaStack Agent") as demo:
         outputs=[user_input_textbox, chatbot]
     ).then(
         fn=stream_response,
-        inputs=[chatbot, session_id_state],
-        outputs=[chatbot, session_id_state]
+        inputs=[chatbot],
+        outputs=[chatbot],
+        concurrency_limit=concurrency_limit,
+        concurrency_id="agent_turns"
     ).then(
         fn=lambda: gr.update(interactive=True),
         outputs=[user_input_textbox]
     )
 
-    clear_btn.click(fn=clear_chat, outputs=[chatbot, session_id_state], queue=False)
+    clear_btn.click(fn=clear_chat, outputs=[chatbot], queue=False)
+
+    # Reclaim sessions of closed tabs right away and idle ones periodically
+    demo.unload(end_session)
+    gr.Timer(30).tick(fn=session_stats, outputs=[stats_json], queue=False)
 
 # --- 5. LAUNCH THE APP ---
 
 if __name__ == "__main__":
-    demo.queue().launch(server_name="0.0.0.0", debug=True)
\ No newline at end of file
+    demo.queue(default_concurrency_limit=concurrency_limit).launch(server_name="0.0.0.0", debug=True)
\ No newline at end of file
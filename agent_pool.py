@@ -0,0 +1,275 @@
+"""
+agent_pool.py
+-------------
+Agents and sessions pooled by configuration, for scripts that would otherwise build an agent (one
+`agents.create` round trip) and a session (another round trip) for every message, such as
+22-llama-stack-parallelization-strategy.py and 21-llama-stack-routing-specialized-agents.py.
+Agents are keyed by their configuration (model, instructions, tools, shields, sampling_params, ...),
+created on first use and reused afterwards. Their ids are saved to a JSON file per server, so a later
+process adopts the existing agent instead of creating a new one; ids the server no longer knows are
+detected on the first session and replaced. Each agent keeps a bounded set of warm sessions that
+`session()` hands out; a session is retired after `max_session_turns` uses so its history stays short.
+"""
+
+import contextlib  # For the session() context manager
+import hashlib  # For configuration keys
+import json  # For canonical keys and the id file
+import logging  # For reporting failed remote deletes
+import os  # For paths and atomic replacement
+import tempfile  # For atomic writes
+import threading  # For guarding the pool
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional
+
+from llama_stack_client import Agent, APIStatusError  # Agent abstraction and API errors
+from llama_stack_client.lib.agents.client_tool import ClientTool, client_tool  # For client tool definitions
+
+# Where agent ids are remembered between runs; set it to an empty string to keep them in memory only
+AGENT_POOL_PATH_ENV = "LLAMA_STACK_AGENT_POOL"
+DEFAULT_PATH = os.environ.get(
+    AGENT_POOL_PATH_ENV, os.path.join(os.path.expanduser("~"), ".cache", "llama-stack-examples", "agents.json")
+)
+DEFAULT_WARM_SESSIONS = 4
+DEFAULT_MAX_SESSION_TURNS = 16
+
+logger = logging.getLogger(__name__)
+
+
+def _canonical(value):
+    if isinstance(value, ClientTool) or callable(value):
+        # Client tools: key them by name and by the definition the agent is created with, so editing a tool's
+        # parameters or docstring gives a new agent instead of adopting one that advertises the old tool
+        tool = value if isinstance(value, ClientTool) else client_tool(value)
+        name = getattr(value, "__qualname__", type(value).__qualname__)
+        return {"tool": f"{getattr(value, '__module__', '')}.{name}", "definition": _canonical(tool.get_tool_definition())}
+    if hasattr(value, "model_dump"):
+        return _canonical(value.model_dump(exclude_none=True))
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in value.items() if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    return value
+
+
+def config_key(base_url, config):
+    """Stable key for an agent configuration on one server; key order and omitted (None) options do not matter."""
+    encoded = json.dumps([str(base_url), _canonical(config)], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class _PooledAgent(Agent):
+    """An Agent that adopts `known_agent_id` instead of creating a new agent on the server."""
+
+    def __init__(self, client, known_agent_id=None, **config):
+        self.known_agent_id = known_agent_id
+        super().__init__(client, **config)
+
+    def initialize(self):
+        if self.known_agent_id is None:
+            super().initialize()
+            return
+        self.agent_id = self.known_agent_id
+        # Same tool bookkeeping as Agent.initialize, minus the agents.create call
+        for tg in self.agent_config["toolgroups"]:
+            toolgroup_id = tg if isinstance(tg, str) else tg.get("name")
+            for tool in self.client.tools.list(toolgroup_id=toolgroup_id, extra_headers=self.extra_headers):
+                self.builtin_tools[tool.identifier] = tg.get("args", {}) if isinstance(tg, dict) else {}
+
+    def recreate(self):
+        """Create a fresh agent on the server with the same configuration."""
+        self.known_agent_id = None
+        self.builtin_tools = {}
+        self.sessions = []
+        self.initialize()
+
+
+@dataclass
+class PoolStats:
+    agents_created: int = 0
+    agents_adopted: int = 0  # Reused from the id file instead of created
+    agents_stale: int = 0  # Adopted ids the server no longer knew
+    agent_hits: int = 0
+    sessions_created: int = 0
+    sessions_reused: int = 0
+    sessions_retired: int = 0
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+@dataclass
+class _Entry:
+    key: str = ""
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    agent: Optional[_PooledAgent] = None
+    verified: bool = False
+    named: dict = field(default_factory=dict)  # session name -> session id
+    idle: deque = field(default_factory=deque)  # (session id, turns used)
+
+
+class AgentPool:
+    """
+    `agent(**config)` returns the pooled Agent for that configuration (keyword arguments as for Agent()).
+    `with pool.session(**config) as (agent, session_id):` borrows a warm session for one or more turns.
+    `named_session(agent, name)` returns a long-lived session that is created once and kept by name.
+    `with pool.temporary_session(agent) as session_id:` runs turns in a session that is deleted afterwards.
+    `create_session(agent, name)` / `retire_session(agent, session_id)` manage a session's lifetime by hand, and
+    `adopt_session(agent, name, session_id)` turns such a session into the named one.
+    """
+
+    def __init__(self, client, path=DEFAULT_PATH, warm_sessions=DEFAULT_WARM_SESSIONS,
+                 max_session_turns=DEFAULT_MAX_SESSION_TURNS):
+        self.client = client
+        self.path = path
+        self.warm_sessions = warm_sessions
+        self.max_session_turns = max_session_turns
+        self._entries: dict = {}
+        self._by_agent: dict = {}  # id(agent) -> entry
+        self._stats = PoolStats()
+        self._lock = threading.Lock()
+
+    def agent(self, **config):
+        return self._entry(config).agent
+
+    def _entry(self, config):
+        key = config_key(self.client.base_url, config)
+        with self._lock:
+            entry = self._entries.setdefault(key, _Entry(key))
+        # Per-configuration lock: one thread creates the agent, others for the same config wait for it
+        with entry.lock:
+            if entry.agent is not None:
+                with self._lock:
+                    self._stats.agent_hits += 1
+                return entry
+            known = self._load_file().get(key)
+            entry.agent = _PooledAgent(self.client, known_agent_id=known, **config)
+            entry.verified = known is None
+            with self._lock:
+                self._by_agent[id(entry.agent)] = entry
+                if known is None:
+                    self._stats.agents_created += 1
+                else:
+                    self._stats.agents_adopted += 1
+            if known is None:
+                self._remember(key, entry.agent.agent_id)
+        return entry
+
+    def named_session(self, agent, name):
+        """The session called `name` on a pooled `agent`, created on first use."""
+        entry = self._by_agent[id(agent)]
+        with entry.lock:
+            session_id = entry.named.get(name)
+        if session_id is None:
+            session_id = self._create_session(entry, name)
+            with entry.lock:
+                session_id = entry.named.setdefault(name, session_id)
+        return session_id
+
+    def adopt_session(self, agent, name, session_id):
+        """Make `session_id` the session called `name` on a pooled `agent`; the session it replaces is deleted."""
+        entry = self._by_agent[id(agent)]
+        with entry.lock:
+            replaced = entry.named.get(name)
+            entry.named[name] = session_id
+        if replaced is not None and replaced != session_id:
+            self._retire(entry.agent, replaced)
+
+    def create_session(self, agent, name="temporary"):
+        """A new session on a pooled `agent` that the caller deletes with retire_session() or adopts."""
+        return self._create_session(self._by_agent[id(agent)], name)
+
+    def retire_session(self, agent, session_id):
+        """Delete a session created with create_session() on the server."""
+        self._retire(self._by_agent[id(agent)].agent, session_id)
+
+    @contextlib.contextmanager
+    def temporary_session(self, agent, name="temporary"):
+        """A new session on a pooled `agent` for a single turn that is deleted afterwards, yielding its id."""
+        session_id = self.create_session(agent, name)
+        try:
+            yield session_id
+        finally:
+            self.retire_session(agent, session_id)
+
+    @contextlib.contextmanager
+    def session(self, **config):
+        """Borrow a warm session of the agent for `config`, yielding (agent, session_id)."""
+        entry = self._entry(config)
+        with entry.lock:
+            session_id, turns = entry.idle.popleft() if entry.idle else (None, 0)
+        if session_id is None:
+            session_id = self._create_session(entry, f"pooled-{len(entry.agent.sessions)}")
+        else:
+            with self._lock:
+                self._stats.sessions_reused += 1
+        try:
+            yield entry.agent, session_id
+        finally:
+            turns += 1
+            with entry.lock:
+                keep = turns < self.max_session_turns and len(entry.idle) < self.warm_sessions
+                if keep:
+                    entry.idle.append((session_id, turns))
+            if not keep:
+                self._retire(entry.agent, session_id)
+
+    def _create_session(self, entry, name):
+        try:
+            session_id = entry.agent.create_session(name)
+        except APIStatusError as e:
+            if entry.verified or e.status_code not in (400, 404):
+                raise
+            # The server was reset since this agent id was saved: create the agent again
+            with entry.lock:
+                if not entry.verified:
+                    entry.agent.recreate()
+                    entry.verified = True
+                    entry.named.clear()
+                    entry.idle.clear()
+                    self._remember(entry.key, entry.agent.agent_id)
+                    with self._lock:
+                        self._stats.agents_stale += 1
+                        self._stats.agents_created += 1
+            session_id = entry.agent.create_session(name)
+        entry.verified = True
+        with self._lock:
+            self._stats.sessions_created += 1
+        return session_id
+
+    def _retire(self, agent, session_id):
+        try:
+            self.client.agents.session.delete(session_id, agent_id=agent.agent_id)
+        except Exception as e:
+            logger.warning("Could not delete agent session %s: %s", session_id, e)
+        if session_id in agent.sessions:
+            agent.sessions.remove(session_id)
+        with self._lock:
+            self._stats.sessions_retired += 1
+
+    def stats(self):
+        with self._lock:
+            return PoolStats(**self._stats.as_dict())
+
+    def _remember(self, key, agent_id):
+        if not self.path:
+            return
+        with self._lock:
+            stored = self._load_file()
+            stored[key] = agent_id
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            # Write to a temp file and rename so concurrent readers never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(stored, f)
+            os.replace(tmp_path, self.path)
+
+    def _load_file(self):
+        if not self.path:
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
@@ -0,0 +1,175 @@
+"""
+async_fanout.py
+---------------
+Asyncio fan-out engine for the parallelization pattern in 22-llama-stack-parallelization-strategy.py.
+Runs many independent subtasks (e.g. one translation per locale) on AsyncLlamaStackClients,
+with a bounded number in flight, a timeout per subtask, cancellation of whatever is still pending,
+and results yielded as each subtask finishes rather than in submission order.
+Run this file directly to benchmark it against the thread-pool version at 4, 64 and 512 subtasks.
+"""
+
+import asyncio  # For the event loop, semaphore and timeouts
+import itertools  # For spreading subtasks over clients
+import logging  # For silencing per-request logs during the benchmark
+import time  # For wall-clock measurements
+import tracemalloc  # For benchmark memory measurements
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from llama_stack_client import Agent, LlamaStackClient  # Agent abstraction and sync client
+from llama_stack_client.lib.agents.agent import AsyncAgent  # Async agent abstraction
+
+from client_pool import build_http_client, get_async_clients  # Pooled client factories
+
+# Subtasks allowed in flight at once when the caller does not say otherwise
+DEFAULT_CONCURRENCY = 64
+
+MODEL_ID = "meta-llama/Llama-3.2-3B-Instruct-Turbo"
+SAMPLING_PARAMS = {"strategy": {"type": "top_p", "temperature": 0.5, "top_p": 0.85}}
+
+
+@dataclass
+class FanOutResult:
+    """Outcome of one subtask: its value, or the exception (including TimeoutError) that ended it."""
+    key: Any
+    value: Any = None
+    error: Optional[BaseException] = None
+    elapsed: float = 0.0
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+async def fan_out(jobs, concurrency=DEFAULT_CONCURRENCY, timeout=None, semaphore=None):
+    """
+    Run `jobs`, an iterable of (key, coroutine_function) pairs, and yield one FanOutResult per job
+    in completion order.
+    At most `concurrency` jobs run at once; pass a shared `semaphore` instead to bound several fan-outs together.
+    `timeout` applies to each job once it starts running, so time spent queued for the semaphore does not count.
+    Closing the generator early (break, aclose) or cancelling its consumer cancels every unfinished job.
+    """
+    semaphore = semaphore or asyncio.BoundedSemaphore(concurrency)
+    finished: asyncio.Queue = asyncio.Queue()
+    loop = asyncio.get_running_loop()
+
+    async def run(key, job):
+        async with semaphore:
+            start = loop.time()
+            try:
+                value = await asyncio.wait_for(job(), timeout)
+                finished.put_nowait(FanOutResult(key, value=value, elapsed=loop.time() - start))
+            except asyncio.CancelledError as e:
+                # Only a cancellation of this task propagates; a job that raises CancelledError itself (e.g. from
+                # a cancelled inner task) still needs its result, or the consumer would wait for it forever
+                task = asyncio.current_task()
+                if task is not None and task.cancelling():
+                    raise
+                finished.put_nowait(FanOutResult(key, error=e, elapsed=loop.time() - start))
+            except Exception as e:
+                finished.put_nowait(FanOutResult(key, error=e, elapsed=loop.time() - start))
+
+    tasks = [asyncio.create_task(run(key, job)) for key, job in jobs]
+    try:
+        for _ in range(len(tasks)):
+            yield await finished.get()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def localize_alert(client, language, prompt, message, model=MODEL_ID, sampling_params=SAMPLING_PARAMS):
+    """Async version of localize_alert from script 22: one agent, one session, one turn."""
+    agent = AsyncAgent(client, model=model, instructions=prompt, sampling_params=sampling_params)
+    session_id = await agent.create_session(f"alert_{language}")
+    response = await agent.create_turn(
+        session_id=session_id,
+        messages=[{"role": "user", "content": message}],
+        stream=False,
+    )
+    return response.output_message.content
+
+
+async def localize_alerts(clients, locale_configs, message, concurrency=DEFAULT_CONCURRENCY, timeout=None):
+    """
+    Fan `message` out to one translation subtask per locale and yield FanOutResult(key=language) as each finishes.
+    `clients` is one AsyncLlamaStackClient or a list of them (see client_pool.get_async_clients);
+    subtasks are spread over the list round-robin.
+    """
+    if not isinstance(clients, (list, tuple)):
+        clients = [clients]
+    assigned = zip(locale_configs.items(), itertools.cycle(clients))
+    jobs = [
+        (language, lambda c=client, lang=language, p=prompt: localize_alert(c, lang, p, message))
+        for (language, prompt), client in assigned
+    ]
+    async for result in fan_out(jobs, concurrency=concurrency, timeout=timeout):
+        yield result
+
+
+def _localize_alerts_threaded(client, locale_configs, message):
+    """The thread-pool version from script 22, kept here as the benchmark baseline."""
+    def localize(language, prompt):
+        agent = Agent(client=client, model=MODEL_ID, instructions=prompt, sampling_params=SAMPLING_PARAMS)
+        session_id = agent.create_session(session_name=f"alert_{language}")
+        response = agent.create_turn(
+            session_id=session_id,
+            messages=[{"role": "user", "content": message}],
+            stream=False,
+        )
+        return language, response.output_message.content
+
+    with ThreadPoolExecutor(max_workers=len(locale_configs)) as executor:
+        futures = [executor.submit(localize, lang, prompt) for lang, prompt in locale_configs.items()]
+        return [future.result() for future in as_completed(futures)]
+
+
+async def _localize_alerts_async(base_url, locale_configs, message):
+    clients = get_async_clients(base_url, connections=len(locale_configs))
+    try:
+        return [r async for r in localize_alerts(clients, locale_configs, message, concurrency=len(locale_configs))]
+    finally:
+        await asyncio.gather(*(client.close() for client in clients))
+
+
+def _measure(run):
+    """Wall-clock seconds of one run, then peak traced Python heap of a second run."""
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def benchmark(sizes=(4, 64, 512), latency=0.05):
+    """
+    Compare wall-clock time and peak Python heap of the thread-pool and asyncio versions, running every
+    subtask concurrently, against a stand-in server process that adds `latency` seconds to each request.
+    Thread stacks live outside the Python heap, so the thread-pool memory figure is a lower bound.
+    """
+    import stand_in_server
+
+    message = "Critical Notice: new user sign-ups are temporarily restricted."
+    rows = []
+    with stand_in_server.spawn(latency=latency) as base_url:
+        for size in sizes:
+            locale_configs = {f"locale-{i}": f"Translate the alert for locale {i}." for i in range(size)}
+            with LlamaStackClient(base_url=base_url, http_client=build_http_client(pool_size=size)) as sync_client:
+                threaded = _measure(lambda: _localize_alerts_threaded(sync_client, locale_configs, message))
+            asynced = _measure(lambda: asyncio.run(_localize_alerts_async(base_url, locale_configs, message)))
+            rows.append((size, threaded, asynced))
+
+    print(f"{'subtasks':>8} | {'threads s':>9} | {'asyncio s':>9} | {'threads MiB':>11} | {'asyncio MiB':>11}")
+    for size, (t_time, t_mem), (a_time, a_mem) in rows:
+        print(f"{size:>8} | {t_time:>9.3f} | {a_time:>9.3f} | {t_mem / 2**20:>11.2f} | {a_mem / 2**20:>11.2f}")
+    return rows
+
+
+if __name__ == "__main__":
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    benchmark()
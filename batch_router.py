@@ -0,0 +1,237 @@
+"""
+batch_router.py
+---------------
+Batch triage for 21-llama-stack-routing-specialized-agents.py: routes a stream of queries concurrently and
+dispatches each to a bounded worker pool per specialist. Every query borrows a session of its own for its
+turn, so turns for the same specialist run side by side, no session's history grows with the batch, and one
+ticket never shows up in the context of another.
+Specialist queues are bounded, so a slow specialist applies backpressure to classification and reading
+rather than letting the whole input pile up in memory.
+`stats()` reports throughput, per-specialist queue depths and latency percentiles.
+Run this file directly to benchmark batch triage against the serial loop of script 21.
+"""
+
+import logging  # For silencing per-request logs during the benchmark
+import queue  # For per-specialist work queues and collecting results
+import threading  # For worker threads
+import time  # For latency and throughput
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from shared_utils import percentile  # Shared nearest-rank percentile
+from stream_metrics import drain  # Stream draining
+
+DEFAULT_WORKERS = 4
+DEFAULT_CLASSIFY_WORKERS = 8
+DEFAULT_QUEUE_SIZE = 32
+
+_STOP = object()
+
+
+@dataclass
+class BatchResult:
+    query: str
+    intent: Optional[str] = None
+    answer: Any = None
+    error: Optional[str] = None
+    latency: float = 0.0  # From when the query was read to when its answer was ready
+    waited: float = 0.0  # Time spent in the specialist queue
+
+
+@dataclass
+class BatchStats:
+    completed: int = 0
+    failed: int = 0
+    elapsed: float = 0.0
+    sessions: int = 0
+    queue_depth: dict = field(default_factory=dict)  # intent -> current depth
+    max_queue_depth: dict = field(default_factory=dict)  # intent -> deepest seen
+    latencies: dict = field(default_factory=dict)  # intent -> [seconds]
+
+    @property
+    def throughput(self):
+        return (self.completed + self.failed) / self.elapsed if self.elapsed else 0.0
+
+    def latency(self, p, intent=None):
+        values = self.latencies.get(intent, []) if intent else [v for vs in self.latencies.values() for v in vs]
+        return percentile(values, p)
+
+    def __str__(self):
+        lines = [f"{self.completed} answered, {self.failed} failed in {self.elapsed:.2f}s "
+                 f"({self.throughput:.2f} queries/s) using {self.sessions} sessions; "
+                 f"latency p50 {self.latency(50):.2f}s / p95 {self.latency(95):.2f}s / p99 {self.latency(99):.2f}s"]
+        for intent in sorted(self.max_queue_depth):
+            lines.append(f"  {intent:>12}: queue {self.queue_depth.get(intent, 0)} now / {self.max_queue_depth[intent]} max, "
+                         f"latency p50 {self.latency(50, intent):.2f}s / p95 {self.latency(95, intent):.2f}s")
+        return "\n".join(lines)
+
+
+class BatchRouter:
+    """
+    `route(query)` returns an object with an `intent` attribute (e.g. TieredRouter.route).
+    `session(intent)` returns a context manager yielding a session id for one query, e.g. a fresh session that
+    is deleted afterwards (AgentPool.temporary_session), and `answer(intent, query, session_id)` runs the
+    specialist turn in it. `intents` are the specialists to start
+    pools for; queries routed anywhere else fail with "no handler". `workers` is either a count for every
+    specialist or a dict of counts per intent.
+    """
+
+    def __init__(self, route, answer, session, intents, workers=DEFAULT_WORKERS,
+                 classify_workers=DEFAULT_CLASSIFY_WORKERS, queue_size=DEFAULT_QUEUE_SIZE):
+        self.route = route
+        self.answer = answer
+        self.session = session
+        self.intents = list(intents)
+        self.workers = workers if isinstance(workers, dict) else {intent: workers for intent in self.intents}
+        self.classify_workers = classify_workers
+        self.queue_size = queue_size
+        self._stats = BatchStats()
+        self._queues: dict = {}
+        self._lock = threading.Lock()
+
+    def run(self, queries):
+        """Route and answer every query from the iterable `queries`, yielding BatchResults as they finish."""
+        self._stats = BatchStats(max_queue_depth={intent: 0 for intent in self.intents},
+                                 latencies={intent: [] for intent in self.intents})
+        self._queues = {intent: queue.Queue(maxsize=self.queue_size) for intent in self.intents}
+        results: queue.Queue = queue.Queue()
+        started = time.perf_counter()
+        workers = [
+            threading.Thread(target=self._work, args=(intent, results), name=f"{intent}-{i}", daemon=True)
+            for intent in self.intents for i in range(self.workers.get(intent, 0))
+        ]
+        for worker in workers:
+            worker.start()
+        feeder = threading.Thread(target=self._feed, args=(queries, results, workers), daemon=True)
+        feeder.start()
+
+        while True:
+            result = results.get()
+            if result is _STOP:
+                break
+            with self._lock:
+                if result.error is None:
+                    self._stats.completed += 1
+                else:
+                    self._stats.failed += 1
+                self._stats.elapsed = time.perf_counter() - started
+            yield result
+
+    def _feed(self, queries, results, workers):
+        # At most two classifications per classifier thread are queued at once, so input is read lazily
+        slots = threading.BoundedSemaphore(self.classify_workers * 2)
+        try:
+            with ThreadPoolExecutor(self.classify_workers, thread_name_prefix="classify") as classify:
+                for query in queries:
+                    slots.acquire()
+                    classify.submit(self._classify, query, time.perf_counter(), results).add_done_callback(
+                        lambda _: slots.release())
+        except Exception as e:
+            results.put(BatchResult(query="", error=f"Reading queries failed: {e}"))
+        finally:
+            for intent, work in self._queues.items():
+                for _ in range(self.workers.get(intent, 0)):
+                    work.put(_STOP)
+            for worker in workers:
+                worker.join()
+            results.put(_STOP)
+
+    def _classify(self, query, read_at, results):
+        try:
+            intent = self.route(query).intent
+        except Exception as e:
+            results.put(BatchResult(query, error=f"Routing failed: {e}", latency=time.perf_counter() - read_at))
+            return
+        work = self._queues.get(intent)
+        if work is None or not self.workers.get(intent):
+            results.put(BatchResult(query, intent, error=f"No handler for category '{intent}'",
+                                    latency=time.perf_counter() - read_at))
+            return
+        # Blocks while this specialist's queue is full
+        work.put((query, read_at, time.perf_counter()))
+        with self._lock:
+            self._stats.max_queue_depth[intent] = max(self._stats.max_queue_depth[intent], work.qsize())
+
+    def _work(self, intent, results):
+        work = self._queues[intent]
+        while True:
+            job = work.get()
+            if job is _STOP:
+                return
+            query, read_at, queued_at = job
+            result = BatchResult(query, intent, waited=time.perf_counter() - queued_at)
+            try:
+                with self.session(intent) as session_id:
+                    with self._lock:
+                        self._stats.sessions += 1
+                    result.answer = self.answer(intent, query, session_id)
+            except Exception as e:
+                result.error = f"{intent} specialist failed: {e}"
+            result.latency = time.perf_counter() - read_at
+            if result.error is None:
+                with self._lock:
+                    self._stats.latencies[intent].append(result.latency)
+            results.put(result)
+
+    def stats(self):
+        with self._lock:
+            return BatchStats(
+                completed=self._stats.completed, failed=self._stats.failed, elapsed=self._stats.elapsed,
+                sessions=self._stats.sessions,
+                queue_depth={intent: work.qsize() for intent, work in self._queues.items()},
+                max_queue_depth=dict(self._stats.max_queue_depth),
+                latencies={intent: list(values) for intent, values in self._stats.latencies.items()},
+            )
+
+
+def benchmark(queries=48, latency=0.05, token_latency=0.002, workers=4):
+    """
+    Triage `queries` HR queries against the stand-in server (`latency` s per request plus `token_latency` s
+    per streamed token), first one at a time through one session per specialist as script 21 does, then
+    with BatchRouter and a fresh session per query, and compare throughput and latency.
+    """
+    from llama_stack_client import LlamaStackClient
+    from agent_pool import AgentPool
+    from intent_router import HR_EXAMPLES, LocalIntentClassifier, TieredRouter
+    import stand_in_server
+
+    workload = [text for texts in HR_EXAMPLES.values() for text in texts]
+    workload = [workload[i % len(workload)] + f" (ticket {i})" for i in range(queries)]
+    with stand_in_server.StandInServer(latency=latency, token_latency=token_latency) as server:
+        client = LlamaStackClient(base_url=server.base_url)
+        pool = AgentPool(client, path="")
+        agents = {intent: pool.agent(model="m", instructions=f"You handle {intent} questions.") for intent in HR_EXAMPLES}
+        router = TieredRouter(LocalIntentClassifier(HR_EXAMPLES), lambda query: ("feedback", "fallback"), threshold=0.0)
+
+        def answer(intent, query, session_id):
+            return drain(client.agents.turn.create(session_id=session_id, agent_id=agents[intent].agent_id,
+                                                   messages=[{"role": "user", "content": query}], stream=True))
+
+        def session(intent):
+            return pool.temporary_session(agents[intent], f"{intent}_ticket")
+
+        sessions = {intent: agent.create_session(intent) for intent, agent in agents.items()}
+        serial = []
+        start = time.perf_counter()
+        for query in workload:
+            read_at = time.perf_counter()
+            intent = router.route(query).intent
+            answer(intent, query, sessions[intent])
+            serial.append(time.perf_counter() - read_at)
+        serial_elapsed = time.perf_counter() - start
+
+        batch = BatchRouter(router.route, answer, session, agents, workers=workers)
+        for _ in batch.run(iter(workload)):
+            pass
+        stats = batch.stats()
+
+    print(f"serial: {queries / serial_elapsed:.2f} queries/s, latency p50 {percentile(serial, 50):.2f}s / "
+          f"p95 {percentile(serial, 95):.2f}s")
+    print(f"batch:  {stats}")
+    return serial_elapsed, stats
+
+
+if __name__ == "__main__":
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    benchmark()
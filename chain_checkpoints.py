@@ -0,0 +1,120 @@
+"""
+chain_checkpoints.py
+--------------------
+Content-addressed checkpoints for the prompt-chain stages of 20-llama-stack-prompt-chaining-strategy.py.
+Every stage output is stored in a SQLite file under a hash of the model, the system instructions, the stage
+prompt template and the stage input. Rerunning the chain therefore skips every stage whose prompt and
+input are unchanged and resumes at the first stage that changed or failed last time; stages after a
+changed one see a new input and are recomputed automatically.
+`report()` shows how many LLM calls and (estimated) tokens the checkpoints saved.
+Checkpointing is opt-in: script 20 only keeps checkpoints when LLAMA_STACK_CHAIN_CHECKPOINTS is set.
+"""
+
+import hashlib  # For content addresses
+import json  # For canonical key encoding
+import os  # For environment variable access
+import sqlite3  # For the checkpoint file
+import threading  # For sharing one connection between stage workers
+import time  # For creation timestamps
+from dataclasses import dataclass, field
+
+from context_window import estimate_tokens  # Token estimate for the savings report
+
+# Opts script 20 into checkpoints: "1" for DEFAULT_PATH, or the path of a SQLite file
+CHECKPOINT_PATH_ENV = "LLAMA_STACK_CHAIN_CHECKPOINTS"
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "llama-stack-examples", "chain-checkpoints.sqlite")
+
+
+def checkpoint_path():
+    """The checkpoint file named by LLAMA_STACK_CHAIN_CHECKPOINTS, or None when checkpointing is off."""
+    path = os.environ.get(CHECKPOINT_PATH_ENV, "")
+    return DEFAULT_PATH if path == "1" else path or None
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+@dataclass
+class CheckpointReport:
+    hits: int = 0
+    misses: int = 0
+    stored: int = 0
+    saved_tokens: int = 0
+    stages: dict = field(default_factory=dict)  # stage name -> hits
+
+    @property
+    def saved_calls(self):
+        return self.hits
+
+    def __str__(self):
+        per_stage = ", ".join(f"{name} {hits}" for name, hits in self.stages.items())
+        return (f"checkpoints saved {self.saved_calls} LLM calls and ~{self.saved_tokens} tokens "
+                f"({self.misses} calls made, {self.stored} outputs stored; hits per stage: {per_stage or 'none'})")
+
+
+class ChainCheckpoints:
+    """
+    Stage outputs keyed by (model_id, instructions, stage prompt template, stage input), persisted in `path`.
+    Pass an instance as ChainPipeline(checkpoints=...); only successful stage outputs are stored.
+    """
+
+    def __init__(self, path, model_id, instructions=""):
+        self.model_id = model_id
+        self.instructions = instructions
+        self._report = CheckpointReport()
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            "key TEXT PRIMARY KEY, stage TEXT NOT NULL, output TEXT NOT NULL, tokens INTEGER NOT NULL, created REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    def key(self, stage, text):
+        parts = [self.model_id, _digest(self.instructions), _digest(stage.prompt), _digest(text)]
+        return _digest(json.dumps(parts))
+
+    def get(self, stage, text):
+        """The stored output of `stage` for input `text`, or None."""
+        with self._lock:
+            row = self._db.execute("SELECT output, tokens FROM checkpoints WHERE key = ?",
+                                   (self.key(stage, text),)).fetchone()
+            if row is None:
+                self._report.misses += 1
+                return None
+            self._report.hits += 1
+            self._report.saved_tokens += row[1]
+            self._report.stages[stage.name] = self._report.stages.get(stage.name, 0) + 1
+            return row[0]
+
+    def put(self, stage, text, output):
+        if not isinstance(output, str):
+            # get() hands stored outputs back as the next stage's input, so only text can round-trip
+            raise TypeError(f"stage {stage.name!r} returned {type(output).__name__}, checkpoints store str outputs")
+        # What the call cost: system prompt and rendered stage prompt in, output out
+        tokens = estimate_tokens(self.instructions) + estimate_tokens(stage.render(text)) + estimate_tokens(output)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO checkpoints (key, stage, output, tokens, created) VALUES (?, ?, ?, ?, ?)",
+                (self.key(stage, text), stage.name, output, tokens, time.time()),
+            )
+            self._db.commit()
+            self._report.stored += 1
+
+    def report(self):
+        with self._lock:
+            return CheckpointReport(self._report.hits, self._report.misses, self._report.stored,
+                                    self._report.saved_tokens, dict(self._report.stages))
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM checkpoints")
+            self._db.commit()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,273 @@
+"""
+chain_pipeline.py
+-----------------
+Pipelined prompt chaining for 20-llama-stack-prompt-chaining-strategy.py over many documents.
+Each chain stage (summarize, simplify, translate, ...) is a pool of worker threads, connected to the next
+stage by a bounded queue, so document N+1 is being summarized while document N is being translated.
+Full queues block the stage feeding them, and ultimately the reading of input documents (backpressure).
+Finished documents are written to a JSONL file as they complete, and `stats()` reports per-stage
+latency percentiles, queue depths and overall throughput.
+Stages are stateless: each prompt receives the previous stage's output in place of `{input}`, so no
+session history is needed and any worker can process any document. With `checkpoints`
+(chain_checkpoints.ChainCheckpoints) unchanged stages are answered from stored outputs instead of the LLM.
+Run this file directly to benchmark the pipeline against running the chain one document at a time.
+"""
+
+import json  # For JSONL output
+import logging  # For silencing per-request logs during the benchmark
+import queue  # For the queues between stages
+import threading  # For stage workers
+import time  # For stage latency and throughput
+from dataclasses import dataclass, field
+from typing import Optional
+
+from shared_utils import percentile  # Shared nearest-rank percentile
+
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 16
+
+_STOP = object()
+
+
+@dataclass
+class Stage:
+    name: str
+    prompt: str  # "{input}" is replaced by the previous stage's output (the document, for the first stage)
+    workers: int = DEFAULT_WORKERS
+
+    def render(self, text):
+        return self.prompt.replace("{input}", text)
+
+
+@dataclass
+class ChainItem:
+    id: str
+    text: str
+    outputs: dict = field(default_factory=dict)  # stage name -> output
+    latencies: dict = field(default_factory=dict)  # stage name -> seconds
+    error: Optional[str] = None
+    failed_stage: Optional[str] = None
+    checkpointed: list = field(default_factory=list)  # stages answered from checkpoints
+
+    @property
+    def result(self):
+        """The last stage's output."""
+        return next(reversed(self.outputs.values()), None) if self.error is None else None
+
+    def as_dict(self):
+        return {"id": self.id, "outputs": self.outputs, "latencies": self.latencies,
+                "error": self.error, "failed_stage": self.failed_stage, "checkpointed": self.checkpointed}
+
+
+@dataclass
+class StageStats:
+    processed: int = 0
+    failed: int = 0
+    max_queue_depth: int = 0
+    latencies: list = field(default_factory=list)  # LLM calls only
+    checkpointed: int = 0
+
+    def __str__(self):
+        return (f"{self.processed} done ({self.checkpointed} from checkpoints), {self.failed} failed, "
+                f"latency p50 {percentile(self.latencies, 50):.2f}s / p95 {percentile(self.latencies, 95):.2f}s, "
+                f"input queue peak {self.max_queue_depth}")
+
+
+@dataclass
+class PipelineStats:
+    completed: int = 0
+    failed: int = 0
+    elapsed: float = 0.0
+    stages: dict = field(default_factory=dict)  # stage name -> StageStats
+
+    @property
+    def throughput(self):
+        return (self.completed + self.failed) / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        lines = [f"{self.completed} documents chained, {self.failed} failed in {self.elapsed:.2f}s "
+                 f"({self.throughput:.2f} documents/s)"]
+        lines += [f"  {name:>12}: {stats}" for name, stats in self.stages.items()]
+        return "\n".join(lines)
+
+
+class ChainPipeline:
+    """
+    Runs `stages` in order over many documents. `call(stage, prompt) -> str` makes one LLM call
+    (see chat_call()). A document whose stage fails skips the remaining stages and is reported with its error.
+    `checkpoints`, if given, is consulted before each call and stores each successful output.
+    """
+
+    def __init__(self, stages, call, queue_size=DEFAULT_QUEUE_SIZE, checkpoints=None):
+        self.stages = list(stages)
+        self.call = call
+        self.queue_size = queue_size
+        self.checkpoints = checkpoints
+        self._stats = PipelineStats()
+        self._lock = threading.Lock()
+
+    def run(self, documents, jsonl_path=None):
+        """
+        Chain every document from the iterable `documents` ((id, text) pairs), yielding ChainItems in
+        completion order and, with `jsonl_path`, appending each one to that file as soon as it finishes.
+        """
+        self._stats = PipelineStats(stages={stage.name: StageStats() for stage in self.stages})
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages] + [queue.Queue()]
+        started = time.perf_counter()
+        pools = []
+        for index, stage in enumerate(self.stages):
+            pool = [threading.Thread(target=self._work, args=(stage, queues[index], queues[index + 1]),
+                                     name=f"{stage.name}-{i}", daemon=True) for i in range(stage.workers)]
+            for worker in pool:
+                worker.start()
+            pools.append(pool)
+        threading.Thread(target=self._feed, args=(documents, queues, pools), daemon=True).start()
+
+        output = open(jsonl_path, "a", encoding="utf-8") if jsonl_path else None
+        try:
+            while True:
+                item = queues[-1].get()
+                if item is _STOP:
+                    break
+                with self._lock:
+                    if item.error is None:
+                        self._stats.completed += 1
+                    else:
+                        self._stats.failed += 1
+                    self._stats.elapsed = time.perf_counter() - started
+                if output is not None:
+                    output.write(json.dumps(item.as_dict(), ensure_ascii=False) + "\n")
+                    output.flush()
+                yield item
+        finally:
+            if output is not None:
+                output.close()
+
+    def _feed(self, documents, queues, pools):
+        try:
+            for doc_id, text in documents:
+                self._put(self.stages[0], queues[0], ChainItem(str(doc_id), text))
+        except Exception as e:
+            queues[-1].put(ChainItem("", "", error=f"Reading documents failed: {e}"))
+        finally:
+            # Shut stages down in order, so each drains everything the previous one produced
+            for work, pool in zip(queues, pools):
+                for _ in pool:
+                    work.put(_STOP)
+                for worker in pool:
+                    worker.join()
+            queues[-1].put(_STOP)
+
+    def _put(self, stage, work, item):
+        work.put(item)  # Blocks while the stage is saturated
+        with self._lock:
+            stats = self._stats.stages[stage.name]
+            stats.max_queue_depth = max(stats.max_queue_depth, work.qsize())
+
+    def _work(self, stage, work, downstream):
+        next_stage = self._next_stage(stage)
+        while True:
+            item = work.get()
+            if item is _STOP:
+                return
+            if item.error is None:
+                self._process(stage, item)
+            if next_stage is None or item.error is not None:
+                downstream.put(item)
+            else:
+                self._put(next_stage, downstream, item)
+
+    def _next_stage(self, stage):
+        index = self.stages.index(stage)
+        return self.stages[index + 1] if index + 1 < len(self.stages) else None
+
+    def _process(self, stage, item):
+        previous = next(reversed(item.outputs.values()), item.text)
+        start = time.perf_counter()
+        output = self.checkpoints.get(stage, previous) if self.checkpoints is not None else None
+        from_checkpoint = output is not None
+        if from_checkpoint:
+            item.checkpointed.append(stage.name)
+        else:
+            try:
+                output = self.call(stage, stage.render(previous))
+                if self.checkpoints is not None:
+                    self.checkpoints.put(stage, previous, output)
+            except Exception as e:
+                item.error, item.failed_stage = f"{type(e).__name__}: {e}", stage.name
+        if item.error is None:
+            item.outputs[stage.name] = output
+        elapsed = item.latencies[stage.name] = time.perf_counter() - start
+        with self._lock:
+            stats = self._stats.stages[stage.name]
+            if item.error is not None:
+                stats.failed += 1
+                return
+            stats.processed += 1
+            if from_checkpoint:
+                stats.checkpointed += 1
+            else:
+                stats.latencies.append(elapsed)
+
+    def stats(self):
+        with self._lock:
+            return PipelineStats(
+                self._stats.completed, self._stats.failed, self._stats.elapsed,
+                {name: StageStats(s.processed, s.failed, s.max_queue_depth, list(s.latencies), s.checkpointed)
+                 for name, s in self._stats.stages.items()},
+            )
+
+
+def chat_call(client, model_id, instructions):
+    """A `call` for ChainPipeline that sends each stage prompt as one chat completion under `instructions`."""
+    def call(stage, prompt):
+        response = client.inference.chat_completion(
+            model_id=model_id,
+            messages=[{"role": "system", "content": instructions}, {"role": "user", "content": prompt}],
+        )
+        return response.completion_message.content
+    return call
+
+
+def read_jsonl(path, text_field="text", id_field="id"):
+    """Yield (id, text) pairs from a JSONL file lazily, numbering lines that have no id."""
+    with open(path, encoding="utf-8") as lines:
+        for number, line in enumerate(lines):
+            if line.strip():
+                record = json.loads(line)
+                yield record.get(id_field, number), record[text_field]
+
+
+def benchmark(documents=40, latency=0.05, token_latency=0.0, workers=4):
+    """
+    Chain `documents` documents through four stages against the stand-in server (`latency` s per request),
+    one document and one stage at a time vs. pipelined with `workers` workers per stage.
+    """
+    from llama_stack_client import LlamaStackClient
+    import stand_in_server
+
+    stages = [Stage(name, f"{name}: {{input}}", workers) for name in ("summarize", "simplify", "translate", "casualize")]
+    corpus = [(i, f"Document {i} about the Llama Stack architecture.") for i in range(documents)]
+    with stand_in_server.StandInServer(latency=latency, token_latency=token_latency) as server:
+        client = LlamaStackClient(base_url=server.base_url)
+        call = chat_call(client, "m", "You are a helpful assistant.")
+
+        start = time.perf_counter()
+        for _, text in corpus:
+            for stage in stages:
+                text = call(stage, stage.render(text))
+        serial = time.perf_counter() - start
+
+        pipeline = ChainPipeline(stages, call)
+        for _ in pipeline.run(iter(corpus)):
+            pass
+        stats = pipeline.stats()
+
+    print(f"serial:    {documents} documents in {serial:.2f}s ({documents / serial:.2f} documents/s)")
+    print(f"pipelined: {stats}")
+    return serial, stats
+
+
+if __name__ == "__main__":
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    benchmark()
@@ -0,0 +1,305 @@
+"""
+client_pool.py
+--------------
+Shared, pooled LlamaStackClient factory used by the example scripts.
+Clients are cached per (base_url, provider_data, pool settings), so every script and every worker
+thread reuses the same keep-alive connection pool (and TLS connections) instead of building its own.
+Shared clients send their requests through the process-wide rate_limiter scheduler.
+Run this file directly to benchmark a pooled client against a cold one on a local stand-in server.
+"""
+
+import importlib.util  # For detecting optional HTTP/2 support
+import logging  # For silencing per-request logs during the benchmark
+import os  # For environment variable access
+import ssl  # For sharing one TLS context across pools
+import statistics  # For benchmark summaries
+import threading  # For guarding the client cache and counters
+import time  # For benchmark timing
+from dataclasses import dataclass
+
+import httpx  # HTTP transport used by llama_stack_client
+from llama_stack_client import AsyncLlamaStackClient, LlamaStackClient  # Llama Stack clients
+
+from rate_limiter import get_scheduler  # Process-wide rate limiting and priority lanes
+
+# Pool size used when the caller does not size the pool to its worker count
+DEFAULT_POOL_SIZE = int(os.environ.get("LLAMA_STACK_POOL_SIZE", "10"))
+# Seconds an idle connection is kept open for reuse
+DEFAULT_KEEPALIVE_EXPIRY = 30.0
+# Connections per async pool when a fan-out is spread over several pools (see get_async_clients)
+DEFAULT_SHARD_SIZE = 8
+# HTTP/2 needs the optional `h2` package (pip install "httpx[http2]")
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+@dataclass
+class PoolStats:
+    """Snapshot of a connection pool: live connections plus lifetime request/connection counters."""
+    open: int
+    idle: int
+    requests: int
+    connections_opened: int
+    tls_handshakes: int
+
+    @property
+    def reused(self):
+        """Requests that were served on an already-open connection."""
+        return max(self.requests - self.connections_opened, 0)
+
+
+class _PoolCounters:
+    """Request/connection counters fed by httpcore trace events, shared by the sync and async transports."""
+
+    def _init_counters(self):
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._connections_opened = 0
+        self._tls_handshakes = 0
+
+    def _count(self, event_name):
+        if event_name == "connection.connect_tcp.complete":
+            with self._lock:
+                self._connections_opened += 1
+        elif event_name == "connection.start_tls.complete":
+            with self._lock:
+                self._tls_handshakes += 1
+
+    def _instrument(self, request, asynchronous=False):
+        with self._lock:
+            self._requests += 1
+        outer_trace = request.extensions.get("trace")
+
+        # httpcore requires a coroutine trace callback on async connections and a plain one on sync ones
+        async def async_trace(event_name, info):
+            self._count(event_name)
+            if outer_trace is not None:
+                await outer_trace(event_name, info)
+
+        def sync_trace(event_name, info):
+            self._count(event_name)
+            if outer_trace is not None:
+                outer_trace(event_name, info)
+
+        trace = async_trace if asynchronous else sync_trace
+        request.extensions = {**request.extensions, "trace": trace}
+
+    def _stats(self, connections):
+        with self._lock:
+            return PoolStats(
+                open=sum(1 for c in connections if not c.is_closed()),
+                idle=sum(1 for c in connections if c.is_idle()),
+                requests=self._requests,
+                connections_opened=self._connections_opened,
+                tls_handshakes=self._tls_handshakes,
+            )
+
+
+class PooledTransport(_PoolCounters, httpx.HTTPTransport):
+    """
+    httpx transport that counts requests and new connections via httpcore trace events,
+    so that pool reuse can be reported without reaching into httpcore internals.
+    With a `scheduler` (rate_limiter.RequestScheduler) every request waits for its rate-limit buckets first.
+    """
+
+    def __init__(self, scheduler=None, **kwargs):
+        super().__init__(**kwargs)
+        self._init_counters()
+        self.scheduler = scheduler
+
+    def handle_request(self, request):
+        if self.scheduler is not None:
+            return self.scheduler.send(request, self._send)
+        return self._send(request)
+
+    def _send(self, request):
+        self._instrument(request)
+        return super().handle_request(request)
+
+    def stats(self):
+        return self._stats(self._pool.connections)
+
+
+class AsyncPooledTransport(_PoolCounters, httpx.AsyncHTTPTransport):
+    """Async counterpart of PooledTransport, for AsyncLlamaStackClient."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._init_counters()
+
+    async def handle_async_request(self, request):
+        self._instrument(request, asynchronous=True)
+        return await super().handle_async_request(request)
+
+    def stats(self):
+        return self._stats(self._pool.connections)
+
+
+_ssl_context = None
+_clients: dict = {}
+_clients_lock = threading.Lock()
+
+
+def _shared_ssl_context():
+    """One TLS context (CA bundle loaded once) shared by every pooled transport."""
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = ssl.create_default_context()
+    return _ssl_context
+
+
+def _transport_options(pool_size, http2, keepalive_expiry):
+    pool_size = pool_size or DEFAULT_POOL_SIZE
+    return {
+        "verify": _shared_ssl_context(),
+        "http2": HTTP2_AVAILABLE if http2 is None else http2,
+        "limits": httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=keepalive_expiry,
+        ),
+    }
+
+
+def build_http_client(pool_size=None, http2=None, keepalive_expiry=DEFAULT_KEEPALIVE_EXPIRY, uds=None,
+                      scheduler=None):
+    """
+    Build an httpx.Client backed by a PooledTransport.
+    `pool_size` caps both total and keep-alive connections; size it to the number of worker threads.
+    `http2` defaults to True when the `h2` package is installed.
+    `uds` connects to a Unix domain socket path instead of the URL's host and port.
+    `scheduler` (rate_limiter.RequestScheduler) rate-limits and prioritizes the client's requests.
+    """
+    transport = PooledTransport(uds=uds, scheduler=scheduler, **_transport_options(pool_size, http2, keepalive_expiry))
+    return httpx.Client(transport=transport, follow_redirects=True)
+
+
+def build_async_http_client(pool_size=None, http2=None, keepalive_expiry=DEFAULT_KEEPALIVE_EXPIRY):
+    """Build an httpx.AsyncClient backed by an AsyncPooledTransport (same options as build_http_client)."""
+    transport = AsyncPooledTransport(**_transport_options(pool_size, http2, keepalive_expiry))
+    return httpx.AsyncClient(transport=transport, follow_redirects=True)
+
+
+def _canonical(value):
+    """A hashable form of a client option; dict key order does not matter, unhashable objects compare by repr."""
+    if isinstance(value, dict):
+        return tuple(sorted((str(k), _canonical(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_canonical(v) for v in value)
+    if isinstance(value, (str, int, float, bool, type(None))):
+        return value
+    return repr(value)
+
+
+def _cache_key(base_url, provider_data, pool_size, http2, keepalive_expiry=DEFAULT_KEEPALIVE_EXPIRY, client_kwargs=None):
+    return (str(base_url).rstrip("/"), _canonical(provider_data or {}), pool_size or DEFAULT_POOL_SIZE, http2,
+            float(keepalive_expiry), _canonical(client_kwargs or {}))
+
+
+def get_client(base_url, provider_data=None, pool_size=None, http2=None,
+               keepalive_expiry=DEFAULT_KEEPALIVE_EXPIRY, **client_kwargs):
+    """
+    Return a shared LlamaStackClient for `base_url` and `provider_data`.
+    Calls with the same arguments get the same client (and therefore the same connection pool); extra keyword
+    arguments (timeouts, headers, ...) are passed to LlamaStackClient and are part of the key, so a call with
+    different options gets a client of its own.
+    Requests go through the process-wide rate_limiter scheduler (see rate_limiter.get_scheduler).
+    """
+    key = _cache_key(base_url, provider_data, pool_size, http2, keepalive_expiry, client_kwargs)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = LlamaStackClient(
+                base_url=base_url,
+                provider_data=provider_data,
+                http_client=build_http_client(pool_size, http2, keepalive_expiry, scheduler=get_scheduler()),
+                **client_kwargs,
+            )
+            _clients[key] = client
+        return client
+
+
+def get_async_client(base_url, provider_data=None, pool_size=None, http2=None,
+                     keepalive_expiry=DEFAULT_KEEPALIVE_EXPIRY, **client_kwargs):
+    """
+    Return a new AsyncLlamaStackClient with a pooled keep-alive transport.
+    Async connections belong to the event loop that opened them, so async clients are not shared
+    between calls; create one per event loop and reuse it for every task on that loop.
+    """
+    return AsyncLlamaStackClient(
+        base_url=base_url,
+        provider_data=provider_data,
+        http_client=build_async_http_client(pool_size, http2, keepalive_expiry),
+        **client_kwargs,
+    )
+
+
+def get_async_clients(base_url, provider_data=None, connections=DEFAULT_POOL_SIZE,
+                      shard_size=DEFAULT_SHARD_SIZE, **kwargs):
+    """
+    Return enough AsyncLlamaStackClients of `shard_size` connections each to hold `connections` in total.
+    httpcore re-scans every pooled connection (and every queued request) each time a request starts or ends,
+    so one very large pool spends more CPU on bookkeeping than on requests; several small pools do not.
+    """
+    shards = max(1, -(-connections // shard_size))
+    return [
+        get_async_client(base_url, provider_data, pool_size=min(shard_size, connections), **kwargs)
+        for _ in range(shards)
+    ]
+
+
+def pool_stats(client):
+    """Return PoolStats for a client created by this module, or for an httpx client built by it."""
+    http_client = client if isinstance(client, (httpx.Client, httpx.AsyncClient)) else client._client
+    transport = http_client._transport
+    if not isinstance(transport, (PooledTransport, AsyncPooledTransport)):
+        raise ValueError("client was not created by client_pool")
+    return transport.stats()
+
+
+def close_all():
+    """Close every shared client and forget it."""
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+def benchmark(requests_count=200, latency=0.0):
+    """
+    Compare per-request latency of a cold client (new connection every request)
+    with a pooled keep-alive client against the local stand-in server.
+    """
+    from stand_in_server import StandInServer
+
+    with StandInServer(latency=latency) as server:
+        url = f"{server.base_url}/v1/health"
+
+        cold = []
+        for _ in range(requests_count):
+            start = time.perf_counter()
+            with httpx.Client() as http_client:
+                http_client.get(url)
+            cold.append(time.perf_counter() - start)
+
+        pooled = []
+        with build_http_client(pool_size=1, http2=False) as http_client:
+            http_client.get(url)  # Open the connection once, as a long-lived process would
+            for _ in range(requests_count):
+                start = time.perf_counter()
+                http_client.get(url)
+                pooled.append(time.perf_counter() - start)
+            stats = pool_stats(http_client)
+
+    cold_ms = statistics.median(cold) * 1000
+    pooled_ms = statistics.median(pooled) * 1000
+    print(f"Requests per client:   {requests_count}")
+    print(f"Cold client p50:       {cold_ms:.3f} ms")
+    print(f"Pooled client p50:     {pooled_ms:.3f} ms")
+    print(f"Saved per request:     {cold_ms - pooled_ms:.3f} ms")
+    print(f"Pool stats:            {stats} (reused={stats.reused})")
+    return cold_ms, pooled_ms, stats
+
+
+if __name__ == "__main__":
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    benchmark()
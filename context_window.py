@@ -0,0 +1,139 @@
+"""
+context_window.py
+-----------------
+Token-budgeted sliding context window for multi-turn conversations (see 07-llama-stack-multi-turn-conversation-and-context.py).
+Each message's token count is computed once when it is added and kept with it, so the window total is
+maintained incrementally. When the total exceeds the budget the oldest turns are evicted, optionally folded
+into a running summary; the system prompt is always kept. `report()` shows how many prompt tokens the
+window saves compared with resending the full history.
+"""
+
+from collections import deque
+from dataclasses import dataclass
+
+DEFAULT_BUDGET = 4096
+# Llama 3 chat template tokens around each message (header start/end, role, end-of-turn)
+MESSAGE_OVERHEAD = 4
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token for English text); pass a real tokenizer's count instead for exact budgets."""
+    return (len(text) + 3) // 4
+
+
+def _message_text(message):
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        return "".join(item.get("text", "") for item in content if isinstance(item, dict))
+    return str(content)
+
+
+@dataclass
+class ContextReport:
+    prompt_tokens: int
+    history_tokens: int
+    evicted_turns: int
+    summarized: bool
+
+    @property
+    def saved_tokens(self):
+        return self.history_tokens - self.prompt_tokens
+
+    def __str__(self):
+        return (f"[context: {self.prompt_tokens} prompt tokens, {self.saved_tokens} saved vs full history "
+                f"({self.history_tokens}); {self.evicted_turns} turns evicted"
+                f"{', summarized' if self.summarized else ''}]")
+
+
+class ConversationWindow:
+    """
+    Conversation history that stays within `budget` prompt tokens.
+    `counter(text) -> int` counts tokens (defaults to estimate_tokens).
+    `summarizer(evicted_messages, previous_summary) -> str`, if given, condenses evicted turns into a summary
+    message kept right after the system prompt; without it evicted turns are simply dropped.
+    The newest turn is never evicted, so a single oversized turn can still exceed the budget.
+    """
+
+    def __init__(self, system_prompt, budget=DEFAULT_BUDGET, counter=estimate_tokens, summarizer=None):
+        self.budget = budget
+        self.counter = counter
+        self.summarizer = summarizer
+        self.evicted_turns = 0
+        self._system = self._entry({"role": "system", "content": system_prompt})
+        self._summary = None
+        self._turns: deque = deque()
+        self._tokens = self._system[1]
+        # What resending every message ever added would cost
+        self._history_tokens = self._system[1]
+
+    def _entry(self, message):
+        return message, self.counter(_message_text(message)) + MESSAGE_OVERHEAD
+
+    def add(self, message):
+        """Add a message; a user message starts a new turn, anything else joins the current one."""
+        entry = self._entry(message)
+        if message["role"] == "user" or not self._turns:
+            self._turns.append([entry])
+        else:
+            self._turns[-1].append(entry)
+        self._tokens += entry[1]
+        self._history_tokens += entry[1]
+        self._enforce_budget()
+
+    def add_user(self, content):
+        self.add({"role": "user", "content": content})
+
+    def add_assistant(self, content, stop_reason="end_of_turn"):
+        self.add({"role": "assistant", "content": content, "stop_reason": stop_reason})
+
+    def _enforce_budget(self):
+        while self._tokens > self.budget and len(self._turns) > 1:
+            evicted = []
+            while self._tokens > self.budget and len(self._turns) > 1:
+                turn = self._turns.popleft()
+                self._tokens -= sum(tokens for _, tokens in turn)
+                evicted.extend(message for message, _ in turn)
+                self.evicted_turns += 1
+            if self.summarizer is None:
+                return
+            previous = None
+            if self._summary is not None:
+                previous = self._summary[0]["content"]
+                self._tokens -= self._summary[1]
+            self._summary = self._entry({"role": "system", "content": self.summarizer(evicted, previous)})
+            # A longer summary can push the window back over budget, in which case evict and fold again
+            self._tokens += self._summary[1]
+
+    def messages(self):
+        """The messages to send: system prompt, summary (if any), then the retained turns in order."""
+        prompt = [self._system[0]]
+        if self._summary is not None:
+            prompt.append(self._summary[0])
+        for turn in self._turns:
+            prompt.extend(message for message, _ in turn)
+        return prompt
+
+    @property
+    def tokens(self):
+        return self._tokens
+
+    def report(self):
+        return ContextReport(self._tokens, self._history_tokens, self.evicted_turns, self._summary is not None)
+
+
+def llm_summarizer(client, model_id, max_tokens=256):
+    """A summarizer for ConversationWindow that asks `model_id` to fold evicted turns into the running summary."""
+    def summarize(evicted, previous_summary):
+        transcript = "\n".join(f"{m['role']}: {_message_text(m)}" for m in evicted)
+        if previous_summary:
+            transcript = f"Earlier summary: {previous_summary}\n{transcript}"
+        response = client.inference.chat_completion(
+            model_id=model_id,
+            messages=[
+                {"role": "system", "content": "Summarize this conversation in a few sentences, keeping names, facts and decisions."},
+                {"role": "user", "content": transcript},
+            ],
+            sampling_params={"max_tokens": max_tokens},
+        )
+        return f"Summary of the earlier conversation: {response.completion_message.content}"
+    return summarize
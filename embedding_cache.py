@@ -0,0 +1,329 @@
+"""
+embedding_cache.py
+------------------
+Local cache of chunk embeddings for 12-llama-stack-tool-rag.py and 13-llama-stack-rag-enabled-agent.py, so the
+`all-MiniLM-L6-v2` vectors of identical chunks are computed once across vector DBs, reruns and test fixtures.
+Entries are keyed by (embedding model, 64-bit hash of the chunk text). Each model has a directory holding an
+append-only file of vectors (float32, or float16 for half the disk) and a parallel file of keys: row i of one
+belongs to key i of the other, so the index costs 8 bytes per entry. Vectors are read through a memory map and
+only the requested rows are copied, so several processes can read one cache without loading it into RAM;
+writers append under a file lock. `embed()` looks a batch up, computes only the misses and fills them in.
+Run this file directly to benchmark hit rate, size on disk and lookup latency against the stand-in server.
+"""
+
+import fcntl  # For the writers' file lock
+import hashlib  # For text keys
+import json  # For the per-model metadata file
+import logging  # For silencing per-request logs during the benchmark
+import os  # For paths and file sizes
+import re  # For directory names
+import threading  # For guarding the index within a process
+import time  # For lookup latency
+from dataclasses import dataclass, field
+
+import numpy as np  # For the memory-mapped vectors (installed with faiss-cpu)
+
+from shared_utils import percentile  # Shared nearest-rank percentile
+
+# Setting this to a directory turns the cache on in scripts 12 and 13
+EMBEDDING_CACHE_PATH_ENV = "LLAMA_STACK_EMBEDDING_CACHE"
+DEFAULT_DTYPE = "float32"
+DEFAULT_BATCH_SIZE = 64  # Texts per embeddings request for the misses
+MERGE_MIN = 4096  # Keys appended since the last merge are kept in a dict until there are this many
+
+
+def text_key(text):
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "little")
+
+
+def embedder(client, model_id):
+    """compute(texts) for `embed()`, using the server's inference embeddings API."""
+    def compute(texts):
+        return client.inference.embeddings(model_id=model_id, contents=list(texts)).embeddings
+    return compute
+
+
+@dataclass
+class EmbeddingCacheStats:
+    hits: int = 0
+    misses: int = 0
+    lookup_seconds: list = field(default_factory=list)  # One sample per batched lookup
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __str__(self):
+        return (f"{self.hits} hits, {self.misses} misses ({self.hit_rate:.0%} hit rate); lookup p50 "
+                f"{percentile(self.lookup_seconds, 50) * 1000:.2f} ms / p95 {percentile(self.lookup_seconds, 95) * 1000:.2f} ms")
+
+
+class _ModelStore:
+    """The vectors and keys of one embedding model."""
+
+    def __init__(self, directory, model, dtype):
+        self.directory = directory
+        self.model = model
+        self.dtype = np.dtype(dtype)
+        self.dimension = None
+        self._keys_path = os.path.join(directory, "keys.u64")
+        self._vectors_path = os.path.join(directory, "vectors.bin")
+        self._meta_path = os.path.join(directory, "meta.json")
+        self._count = 0
+        self._sorted_keys = np.empty(0, dtype="<u8")
+        self._sorted_rows = np.empty(0, dtype="<u4")
+        self._recent = {}  # key -> row, for keys not merged into the sorted arrays yet
+        self._vectors = None
+        self._lock = threading.Lock()
+        self._read_meta()
+
+    def _read_meta(self):
+        try:
+            with open(self._meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return
+        # The file's format wins over the dtype asked for
+        self.dtype = np.dtype(meta["dtype"])
+        self.dimension = meta["dimension"]
+
+    @property
+    def _row_bytes(self):
+        return self.dimension * self.dtype.itemsize
+
+    def _complete_rows(self):
+        """Rows present in both files; a writer that died between the two appends leaves extra bytes behind."""
+        try:
+            keys = os.path.getsize(self._keys_path) // 8
+            vectors = os.path.getsize(self._vectors_path) // self._row_bytes
+        except OSError:
+            return 0
+        return min(keys, vectors)
+
+    def refresh(self):
+        """Pick up rows appended since the last call, by this process or another one. Call with _lock held."""
+        if self.dimension is None:
+            self._read_meta()
+            if self.dimension is None:
+                return
+        count = self._complete_rows()
+        if count <= self._count:
+            return
+        new_keys = np.fromfile(self._keys_path, dtype="<u8", count=count - self._count, offset=self._count * 8)
+        for row, key in enumerate(new_keys.tolist(), start=self._count):
+            self._recent.setdefault(key, row)  # The first copy of a key wins
+        self._count = count
+        if len(self._recent) >= max(MERGE_MIN, len(self._sorted_keys) // 4):
+            self._merge()
+        self._vectors = np.memmap(self._vectors_path, dtype=self.dtype, mode="r", shape=(count, self.dimension))
+
+    def _merge(self):
+        keys = np.concatenate([self._sorted_keys, np.fromiter(self._recent.keys(), "<u8", len(self._recent))])
+        rows = np.concatenate([self._sorted_rows, np.fromiter(self._recent.values(), "<u4", len(self._recent))])
+        order = np.argsort(keys, kind="stable")
+        self._sorted_keys, self._sorted_rows = keys[order], rows[order]
+        self._recent = {}
+
+    def rows(self, keys):
+        """Row of each key, or -1 when it is not cached. Call with _lock held."""
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        if len(self._sorted_keys):
+            positions = np.minimum(np.searchsorted(self._sorted_keys, keys), len(self._sorted_keys) - 1)
+            found = self._sorted_keys[positions] == keys
+            rows[found] = self._sorted_rows[positions[found]]
+        if self._recent:
+            for i in np.flatnonzero(rows < 0).tolist():
+                rows[i] = self._recent.get(int(keys[i]), -1)
+        return rows
+
+    def lookup(self, keys):
+        """(rows, vectors of the found rows as float32)."""
+        with self._lock:
+            self.refresh()
+            rows = self.rows(keys)
+            found = rows[rows >= 0]
+            vectors = self._vectors[found].astype(np.float32) if len(found) else np.empty((0, self.dimension or 0), np.float32)
+        return rows, vectors
+
+    def append(self, keys, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, "lock"), "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    if self.dimension is None:
+                        self._read_meta()
+                    if self.dimension is None:
+                        self._write_meta(vectors.shape[1])
+                    if vectors.shape[1] != self.dimension:
+                        raise ValueError(f"{self.model} vectors have {vectors.shape[1]} dimensions, the cache has {self.dimension}")
+                    self.refresh()
+                    new = self.rows(keys) < 0
+                    _, first = np.unique(keys, return_index=True)  # Drop repeats within the batch
+                    new[np.setdiff1d(np.arange(len(keys)), first)] = False
+                    if not new.any():
+                        return 0
+                    self._append_rows(keys[new], vectors[new])
+                    self.refresh()
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+        return int(new.sum())
+
+    def _write_meta(self, dimension):
+        self.dimension = dimension
+        tmp_path = self._meta_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"model": self.model, "dimension": dimension, "dtype": self.dtype.name}, f)
+        os.replace(tmp_path, self._meta_path)
+
+    def _append_rows(self, keys, vectors):
+        # Cut off a row left half-written by a writer that died, so both files stay aligned
+        count = self._complete_rows()
+        for path, size in ((self._vectors_path, count * self._row_bytes), (self._keys_path, count * 8)):
+            with open(path, "ab") as f:
+                if f.tell() > size:
+                    f.truncate(size)
+        # Vectors go first: a key is only ever visible once its vector is complete
+        with open(self._vectors_path, "ab") as f:
+            f.write(vectors.astype(self.dtype.newbyteorder("<")).tobytes())
+        with open(self._keys_path, "ab") as f:
+            f.write(keys.astype("<u8").tobytes())
+
+    def size_on_disk(self):
+        return sum(os.path.getsize(path) for path in (self._keys_path, self._vectors_path, self._meta_path)
+                   if os.path.exists(path))
+
+    def __len__(self):
+        with self._lock:
+            self.refresh()
+            return self._count
+
+    def close(self):
+        with self._lock:
+            self._vectors = None  # np.memmap closes the mapping when the last reference goes
+
+
+class EmbeddingCache:
+    """
+    Embeddings by (model, text) under `path`. `lookup(model, texts)` returns cached vectors or None,
+    `fill(model, texts, vectors)` adds vectors, `embed(model, texts, compute)` does both around `compute(missing_texts)`
+    (e.g. `embedder(client, model)`). New models are stored as `dtype` (float32 or float16).
+    Keys are 64-bit hashes of the text: collisions are negligible below billions of chunks.
+    """
+
+    def __init__(self, path, dtype=DEFAULT_DTYPE):
+        self.path = path
+        self.dtype = dtype
+        self._stores = {}
+        self._stats = EmbeddingCacheStats()
+        self._lock = threading.Lock()
+
+    def _store(self, model):
+        with self._lock:
+            store = self._stores.get(model)
+            if store is None:
+                name = re.sub(r"[^A-Za-z0-9._-]+", "_", model)
+                digest = hashlib.sha256(model.encode()).hexdigest()[:8]
+                store = self._stores[model] = _ModelStore(os.path.join(self.path, f"{name}-{digest}"), model, self.dtype)
+            return store
+
+    def lookup(self, model, texts):
+        """Cached float32 vector for each text, or None."""
+        start = time.perf_counter()
+        rows, vectors = self._store(model).lookup(np.array([text_key(text) for text in texts], dtype="<u8"))
+        found = iter(vectors)
+        result = [next(found) if row >= 0 else None for row in rows.tolist()]
+        with self._lock:
+            hits = len(vectors)
+            self._stats.hits += hits
+            self._stats.misses += len(texts) - hits
+            self._stats.lookup_seconds.append(time.perf_counter() - start)
+        return result
+
+    def fill(self, model, texts, vectors):
+        """Add vectors for texts; returns how many were new."""
+        if not texts:
+            return 0
+        keys = np.array([text_key(text) for text in texts], dtype="<u8")
+        return self._store(model).append(keys, vectors)
+
+    def embed(self, model, texts, compute, batch_size=DEFAULT_BATCH_SIZE):
+        """A float32 (len(texts), dimension) array of embeddings; only uncached texts are passed to compute()."""
+        texts = list(texts)
+        vectors = self.lookup(model, texts)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        computed = {}
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            embeddings = np.asarray(compute(batch), dtype=np.float32)
+            self.fill(model, batch, embeddings)
+            computed.update(zip(batch, embeddings))
+        return np.array([vector if vector is not None else computed[text] for text, vector in zip(texts, vectors)],
+                        dtype=np.float32).reshape(len(texts), -1)
+
+    def entries(self, model):
+        return len(self._store(model))
+
+    def size_on_disk(self):
+        """Bytes used by every model's files."""
+        total = 0
+        for directory, _, files in os.walk(self.path):
+            total += sum(os.path.getsize(os.path.join(directory, name)) for name in files if name != "lock")
+        return total
+
+    def stats(self):
+        with self._lock:
+            return EmbeddingCacheStats(self._stats.hits, self._stats.misses, list(self._stats.lookup_seconds))
+
+    def close(self):
+        with self._lock:
+            stores, self._stores = list(self._stores.values()), {}
+        for store in stores:
+            store.close()
+
+
+def benchmark(path=None, chunks=5_000, vector_dbs=3, shared=0.7, batch_size=64):
+    """
+    Embed `vector_dbs` corpora of `chunks` chunks each, sharing `shared` of their chunks, through the stand-in
+    server with a float32 and a float16 cache, then time batched lookups in a fresh reader.
+    """
+    import random
+    import tempfile
+    from llama_stack_client import LlamaStackClient
+    import stand_in_server
+
+    rng = random.Random(3)
+    words = [f"w{i}" for i in range(5000)]
+    common = [" ".join(rng.choices(words, k=40)) for _ in range(int(chunks * shared))]
+    corpora = [common + [" ".join(rng.choices(words, k=40)) for _ in range(chunks - len(common))]
+               for _ in range(vector_dbs)]
+    model = "all-MiniLM-L6-v2"
+    with stand_in_server.StandInServer() as server, tempfile.TemporaryDirectory() as scratch:
+        client = LlamaStackClient(base_url=server.base_url)
+        compute = embedder(client, model)
+        for dtype in ("float32", "float16"):
+            root = os.path.join(path or scratch, dtype)
+            cache = EmbeddingCache(root, dtype=dtype)
+            before = server.embedded
+            start = time.perf_counter()
+            for corpus in corpora:
+                for index in range(0, len(corpus), batch_size):
+                    cache.embed(model, corpus[index:index + batch_size], compute)
+            elapsed = time.perf_counter() - start
+            print(f"{dtype}: {sum(map(len, corpora))} chunks in {elapsed:.1f}s, {server.embedded - before} embedded; "
+                  f"{cache.stats()}; {cache.entries(model)} entries, {cache.size_on_disk() / 2**20:.1f} MiB on disk")
+            cache.close()
+
+            reader = EmbeddingCache(root)
+            everything = [text for corpus in corpora for text in corpus]
+            for index in range(0, len(everything), batch_size):
+                reader.lookup(model, everything[index:index + batch_size])
+            print(f"  fresh reader, batches of {batch_size}: {reader.stats()}")
+            reader.close()
+
+
+if __name__ == "__main__":
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    benchmark()
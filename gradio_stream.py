@@ -0,0 +1,205 @@
+"""
+gradio_stream.py
+----------------
+Renders an agent turn stream into Gradio chat history for 24-llama-staack-chatbot-UX.py, coalescing text deltas into frames.
+Gradio post-processes, diffs and sends the whole conversation on every yield, so yielding once per token
+costs server CPU and websocket bandwidth in proportion to the chat length. Here text deltas are buffered
+and flushed at most every GRADIO_FLUSH_MS milliseconds or GRADIO_FLUSH_TOKENS tokens (50 ms / 16 tokens
+by default), with a final flush when the inference step completes.
+Run this file directly to benchmark bytes sent and server CPU per response, per token vs. coalesced.
+"""
+
+import inspect  # For Chatbot constructor compatibility in the benchmark
+import json  # For measuring update payload sizes
+import logging  # For silencing per-request logs during the benchmark
+import os  # For environment variable access
+import time  # For flush intervals and CPU timing
+
+from gradio import ChatMessage  # Chat message type used by gr.Chatbot(type="messages")
+
+DEFAULT_FLUSH_INTERVAL = float(os.environ.get("GRADIO_FLUSH_MS", "50")) / 1000
+DEFAULT_FLUSH_TOKENS = int(os.environ.get("GRADIO_FLUSH_TOKENS", "16"))
+
+
+class FrameCoalescer:
+    """
+    Buffers text deltas and says when they are due for a flush: once `max_tokens` deltas are pending,
+    or `interval` seconds after the oldest pending delta arrived (checked as deltas arrive).
+    FrameCoalescer(interval=0, max_tokens=1) flushes every delta, i.e. the uncoalesced behaviour.
+    """
+
+    def __init__(self, interval=DEFAULT_FLUSH_INTERVAL, max_tokens=DEFAULT_FLUSH_TOKENS, clock=time.monotonic):
+        self.interval = interval
+        self.max_tokens = max_tokens
+        self.clock = clock
+        self.flushes = 0
+        self._pending: list = []
+        self._first_at = None
+
+    @property
+    def pending(self):
+        return bool(self._pending)
+
+    def add(self, text):
+        """Buffer one delta; returns True when the buffer should be flushed now."""
+        if not self._pending:
+            self._first_at = self.clock()
+        self._pending.append(text)
+        return self.due()
+
+    def due(self):
+        return bool(self._pending) and (
+            len(self._pending) >= self.max_tokens or self.clock() - self._first_at >= self.interval
+        )
+
+    def flush(self):
+        """Return the buffered text joined into one string and empty the buffer."""
+        text = "".join(self._pending)
+        self._pending.clear()
+        self._first_at = None
+        self.flushes += 1
+        return text
+
+
+def render_turn(response_stream, history, coalescer=None):
+    """
+    Apply an `agent.create_turn(stream=True)` stream to the Gradio `history` list and yield `history`
+    whenever the UI should update: tool and shield results as they complete, streamed text once per frame.
+    """
+    coalescer = coalescer or FrameCoalescer()
+    # State to track if we are currently inside an inference block
+    in_inference_block = False
+
+    def flush_text():
+        # Pending text always belongs to the last assistant message
+        if coalescer.pending:
+            history[-1].content += coalescer.flush()
+            return True
+        return False
+
+    for chunk in response_stream:
+        try:
+            if not hasattr(chunk, "event") or not hasattr(chunk.event, "payload"):
+                continue
+
+            payload = chunk.event.payload
+            event_type = payload.event_type
+            step_type = getattr(payload, 'step_type', None)
+
+            # --- Event 1: A Tool Execution step has completed ---
+            if step_type == "tool_execution" and event_type == "step_complete":
+                flush_text()
+                in_inference_block = False
+                details = getattr(payload, 'step_details', None)
+                if details:
+                    for t in getattr(details, 'tool_calls', []):
+                        history.append(ChatMessage(
+                            role="assistant",
+                            content=f"Tool `{t.tool_name}` was used.",
+                            metadata={"title": f"⚙️ Used Tool: `{t.tool_name}`"}
+                        ))
+                        yield history
+
+            # --- Event 2: A Shield Call step has completed ---
+            elif step_type == "shield_call" and event_type == "step_complete":
+                flush_text()
+                in_inference_block = False
+                details = getattr(payload, 'step_details', None)
+                if details:
+                    if details.violation:
+                        history.append(ChatMessage(
+                            role="assistant",
+                            content=details.violation.user_message,
+                            metadata={"title": "🚨 Safety Violation - Please clear chat"}
+                        ))
+                    yield history
+
+            # --- Event 3: An Inference step is in progress (streaming text) ---
+            elif step_type == "inference" and event_type == "step_progress":
+                delta = getattr(payload, 'delta', None)
+                if delta and delta.type == "text":
+                    # If this is the first text chunk, create a new message bubble
+                    if not in_inference_block:
+                        in_inference_block = True
+                        history.append(ChatMessage(role="assistant", content=""))
+                    if coalescer.add(delta.text):
+                        flush_text()
+                        yield history
+
+            # --- Event 4: The Inference step has completed: show whatever is still buffered ---
+            elif step_type == "inference" and event_type == "step_complete":
+                if flush_text():
+                    yield history
+
+        except Exception as e:
+            print(f"Error processing stream chunk: {e}\nChunk: {chunk}")
+            continue
+
+    flush_text()
+    yield history
+
+
+def _ui_cost(updates, chatbot):
+    """
+    Replay what Gradio's queue does with each yielded history: post-process it, diff it against the
+    previous update, and JSON-encode the result. Returns (updates, bytes, cpu_seconds).
+    """
+    from gradio.utils import diff
+
+    previous = None
+    sent = 0
+    cpu = 0.0
+    count = 0
+    for history in updates:
+        start = time.process_time()
+        value = chatbot.postprocess(history)
+        value = value.model_dump() if hasattr(value, "model_dump") else value
+        message = value if previous is None else diff(previous, value)
+        sent += len(json.dumps(message, default=str))
+        previous = value
+        cpu += time.process_time() - start
+        count += 1
+    return count, sent, cpu
+
+
+def benchmark(prior_turns=20, reply_words=400, token_latency=0.002):
+    """
+    Stream one agent reply of `reply_words` tokens (from the stand-in server, `token_latency` s apart) into a
+    chat that already holds `prior_turns` exchanges, and compare per-token updates with coalesced ones:
+    number of UI updates, bytes Gradio would send, and CPU spent post-processing, diffing and encoding them.
+    """
+    import gradio as gr
+    from llama_stack_client import Agent, LlamaStackClient
+    import stand_in_server
+
+    reply = " ".join(f"word{i}" for i in range(reply_words))
+    earlier = []
+    for i in range(prior_turns):
+        earlier.append({"role": "user", "content": f"Question {i}: " + "lorem ipsum " * 20})
+        earlier.append({"role": "assistant", "content": f"Answer {i}: " + "dolor sit amet " * 60})
+    kwargs = {"type": "messages"} if "type" in inspect.signature(gr.Chatbot.__init__).parameters else {}
+    chatbot = gr.Chatbot(**kwargs)
+
+    modes = {
+        "per token": FrameCoalescer(interval=0, max_tokens=1),
+        "coalesced": FrameCoalescer(),
+    }
+    rows = []
+    with stand_in_server.StandInServer(token_latency=token_latency, responder=lambda messages: reply) as server:
+        client = LlamaStackClient(base_url=server.base_url)
+        agent = Agent(client, model="m", instructions="Answer at length.")
+        session_id = agent.create_session("benchmark")
+        for name, coalescer in modes.items():
+            history = earlier + [{"role": "user", "content": "Tell me everything."}]
+            stream = agent.create_turn(session_id=session_id, messages=[history[-1]], stream=True)
+            rows.append((name, *_ui_cost(render_turn(stream, history, coalescer), chatbot)))
+
+    print(f"{'mode':>10} | {'updates':>7} | {'KiB sent':>8} | {'CPU ms':>7}")
+    for name, count, sent, cpu in rows:
+        print(f"{name:>10} | {count:>7} | {sent / 1024:>8.1f} | {cpu * 1000:>7.1f}")
+    return rows
+
+
+if __name__ == "__main__":
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    benchmark()
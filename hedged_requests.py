@@ -0,0 +1,230 @@
+"""
+hedged_requests.py
+------------------
+Hedged streaming requests for 19-llama-stack-two-agent-with-different-providers.py, where the same question
+can be answered by a Together-hosted model or a local Ollama model.
+The request goes to the primary first. If no token has arrived by the hedge deadline (the p95 of the primary's
+recent time-to-first-token), a backup request is sent to the other provider; whichever stream completes first
+is kept and the other is closed, so the server stops generating it. A primary that fails before the deadline
+is hedged at once. `stats()` reports how often a backup was needed (the extra requests hedging cost) and who
+won; `compare()` measures the tail latency against sending every request to the primary alone.
+Run this file directly to benchmark hedging against a stand-in primary with a slow tail.
+"""
+
+import logging  # For silencing per-request logs during the benchmark
+import queue  # For worker events
+import threading  # For request workers and cancellation
+import time  # For deadlines and latency
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from shared_utils import percentile  # Shared nearest-rank percentile
+from stream_metrics import StreamAccumulator  # For collecting streamed answers
+
+DEFAULT_PERCENTILE = 95
+# Hedge deadline (seconds) used until the primary has MIN_SAMPLES first-token times
+DEFAULT_INITIAL_DEADLINE = 1.0
+MIN_SAMPLES = 8
+WINDOW_SIZE = 200
+
+
+@dataclass
+class HedgeOutcome:
+    result: Any = None  # StreamResult of the winning stream
+    winner: Optional[str] = None
+    hedged: bool = False  # A backup request was sent
+    deadline: float = 0.0
+    latency: float = 0.0
+    errors: dict = field(default_factory=dict)  # target -> error message
+
+
+@dataclass
+class HedgeStats:
+    requests: int = 0
+    hedged: int = 0
+    backup_wins: int = 0
+    failed: int = 0
+    latencies: list = field(default_factory=list)
+
+    @property
+    def extra_requests(self):
+        """Backup requests sent, as a share of all requests."""
+        return self.hedged / self.requests if self.requests else 0.0
+
+    def __str__(self):
+        return (f"{self.requests} requests, {self.hedged} hedged ({self.extra_requests:.0%} extra requests), "
+                f"backup won {self.backup_wins}, {self.failed} failed; latency p50 {percentile(self.latencies, 50):.2f}s"
+                f" / p95 {percentile(self.latencies, 95):.2f}s / p99 {percentile(self.latencies, 99):.2f}s")
+
+
+class Hedger:
+    """
+    `open_stream(target, request)` starts a streamed request (a chat completion or
+    `client.agents.turn.create(stream=True)`) on `target`, one of `primary` and `backup`.
+    `run(request)` sends it hedged and returns a HedgeOutcome.
+    """
+
+    def __init__(self, open_stream, primary, backup, deadline_percentile=DEFAULT_PERCENTILE,
+                 initial_deadline=DEFAULT_INITIAL_DEADLINE, window=WINDOW_SIZE):
+        self.open_stream = open_stream
+        self.primary = primary
+        self.backup = backup
+        self.deadline_percentile = deadline_percentile
+        self.initial_deadline = initial_deadline
+        self._ttft = deque(maxlen=window)  # Primary time-to-first-token samples
+        self._stats = HedgeStats()
+        self._lock = threading.Lock()
+
+    def deadline(self):
+        """Seconds to wait for the primary's first token before hedging."""
+        with self._lock:
+            samples = list(self._ttft)
+        if len(samples) < MIN_SAMPLES:
+            return self.initial_deadline
+        return percentile(samples, self.deadline_percentile)
+
+    def run(self, request):
+        started = time.perf_counter()
+        deadline = self.deadline()
+        events: queue.Queue = queue.Queue()
+        cancelled = {self.primary: threading.Event(), self.backup: threading.Event()}
+        outcome = HedgeOutcome(deadline=deadline)
+        self._launch(self.primary, request, cancelled[self.primary], events, started)
+        running = {self.primary}
+        first_token = False
+        timed_out = False  # The backup was sent because the deadline passed, not because the primary failed
+        while running:
+            waiting = None if outcome.hedged or first_token else max(started + deadline - time.perf_counter(), 0)
+            try:
+                kind, target, value = events.get(timeout=waiting)
+            except queue.Empty:
+                outcome.hedged = timed_out = True
+                self._launch(self.backup, request, cancelled[self.backup], events, time.perf_counter())
+                running.add(self.backup)
+                continue
+            if kind == "first":
+                if target == self.primary:
+                    first_token = True
+                    self._record_ttft(value)
+                continue
+            running.discard(target)
+            if kind == "done":
+                outcome.result, outcome.winner = value, target
+                break
+            outcome.errors[target] = value
+            if not outcome.hedged:
+                # The primary failed early: fail over now instead of waiting for the deadline
+                outcome.hedged = True
+                self._launch(self.backup, request, cancelled[self.backup], events, time.perf_counter())
+                running.add(self.backup)
+        for target in running:
+            cancelled[target].set()
+        if timed_out and not first_token and self.primary in running:
+            # The primary's first token took at least this long; keep the censored sample so hedging
+            # does not hide the primary's slow tail from the deadline (a primary that failed says nothing about it)
+            self._record_ttft(time.perf_counter() - started)
+        outcome.latency = time.perf_counter() - started
+        with self._lock:
+            self._stats.requests += 1
+            self._stats.hedged += outcome.hedged
+            self._stats.backup_wins += outcome.winner == self.backup
+            if outcome.winner is None:
+                self._stats.failed += 1
+            else:
+                self._stats.latencies.append(outcome.latency)
+        return outcome
+
+    def _record_ttft(self, seconds):
+        with self._lock:
+            self._ttft.append(seconds)
+
+    def _launch(self, target, request, cancelled, events, started):
+        threading.Thread(target=self._consume, args=(target, request, cancelled, events, started),
+                         name=f"hedge-{target}", daemon=True).start()
+
+    def _consume(self, target, request, cancelled, events, started):
+        try:
+            stream = self.open_stream(target, request)
+            accumulator = StreamAccumulator(started)
+            first = False
+            for chunk in stream:
+                if cancelled.is_set():
+                    stream.close()
+                    return
+                accumulator.observe(chunk)
+                if not first and accumulator.result().metrics.tokens:
+                    first = True
+                    events.put(("first", target, time.perf_counter() - started))
+            events.put(("done", target, accumulator.result()))
+        except Exception as e:
+            events.put(("error", target, f"{type(e).__name__}: {e}"))
+
+    def stats(self):
+        with self._lock:
+            return HedgeStats(self._stats.requests, self._stats.hedged, self._stats.backup_wins,
+                              self._stats.failed, list(self._stats.latencies))
+
+
+def compare(hedger, requests):
+    """
+    Send every request to the primary alone, then hedged, and return (primary-only latencies, HedgeStats).
+    The primary-only pass also warms the hedge deadline with real first-token times.
+    """
+    baseline = []
+    for request in requests:
+        start = time.perf_counter()
+        accumulator = StreamAccumulator(start)
+        for chunk in hedger.open_stream(hedger.primary, request):
+            accumulator.observe(chunk)
+        baseline.append(time.perf_counter() - start)
+        if accumulator.result().metrics.ttft is not None:
+            hedger._record_ttft(accumulator.result().metrics.ttft)
+    for request in requests:
+        hedger.run(request)
+    return baseline, hedger.stats()
+
+
+def format_comparison(baseline, stats):
+    lines = [f"primary only: latency p50 {percentile(baseline, 50):.2f}s / p95 {percentile(baseline, 95):.2f}s / "
+             f"p99 {percentile(baseline, 99):.2f}s", f"hedged:       {stats}"]
+    for p in (95, 99):
+        before, after = percentile(baseline, p), percentile(stats.latencies, p)
+        if before:
+            lines.append(f"p{p}: {before * 1000:.0f} ms -> {after * 1000:.0f} ms ({(after - before) / before:+.0%})")
+    return "\n".join(lines)
+
+
+def benchmark(requests=100, slow_share=0.04, slow=0.6, fast=0.03, backup=0.08):
+    """
+    Against the stand-in server, a primary model that usually starts in `fast` s but takes `slow` s for
+    `slow_share` of requests, and a backup model that always takes `backup` s.
+    """
+    import random
+    from llama_stack_client import LlamaStackClient
+    import stand_in_server
+
+    rng = random.Random(7)
+    model_latency = {
+        "primary": lambda: slow if rng.random() < slow_share else fast,
+        "backup": backup,
+    }
+    with stand_in_server.StandInServer(token_latency=0.001, model_latency=model_latency) as server:
+        client = LlamaStackClient(base_url=server.base_url)
+
+        def open_stream(target, question):
+            return client.inference.chat_completion(model_id=target, messages=[{"role": "user", "content": question}],
+                                                    stream=True)
+
+        hedger = Hedger(open_stream, "primary", "backup")
+        baseline, stats = compare(hedger, [f"Question {i}" for i in range(requests)])
+        time.sleep(0.1)  # Let cancelled streams reach the server
+        abandoned = server.abandoned_streams
+    print(format_comparison(baseline, stats))
+    print(f"losing streams closed early: {abandoned}")
+    return baseline, stats
+
+
+if __name__ == "__main__":
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    benchmark()
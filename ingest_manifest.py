@@ -0,0 +1,215 @@
+"""
+ingest_manifest.py
+------------------
+Incremental RAG ingestion for 12-llama-stack-tool-rag.py and 13-llama-stack-rag-enabled-agent.py.
+The manifest remembers, per vector DB and document_id, a hash of the document's content, the ETag and
+Last-Modified validators of URL sources and how many chunks were inserted. With a manifest, rag_ingest.RAGIngestor
+sends conditional GETs (a 304 skips the document without downloading it), skips documents whose content hash
+is unchanged, and re-embeds only new and modified ones. A document is recorded only once all its chunks were
+inserted, so failures are retried on the next run.
+This client's vector IO API cannot delete chunks, so the chunks of modified and removed documents are counted as
+stale. They would still be retrieved, so `needs_compaction()` is true as soon as there are any, and the vector DB
+should then be re-registered and filled again before it is queried. `report()` shows how many embeddings were avoided.
+"""
+
+import hashlib  # For content hashes
+import os  # For environment variable access
+import sqlite3  # For the manifest file
+import threading  # For sharing one connection between ingest workers
+import time  # For update timestamps
+from dataclasses import dataclass
+from typing import Optional
+
+# Where scripts 12 and 13 keep the manifest; set it to an empty string to ingest everything on every run
+INGEST_MANIFEST_PATH_ENV = "LLAMA_STACK_INGEST_MANIFEST"
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "llama-stack-examples", "ingest-manifest.sqlite")
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+@dataclass
+class ManifestEntry:
+    content_hash: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    chunks: int = 0
+
+
+@dataclass
+class ManifestReport:
+    added: int = 0
+    modified: int = 0
+    unchanged: int = 0  # Content hash matched after downloading
+    not_modified: int = 0  # Skipped by a 304 response without downloading
+    removed: int = 0
+    embeddings_avoided: int = 0  # Chunks of skipped documents that were not embedded again
+    embedded: int = 0
+    stale_chunks: int = 0  # Chunks of modified or removed documents still in the vector DB
+
+    def __str__(self):
+        return (f"{self.added} added, {self.modified} modified, {self.unchanged + self.not_modified} unchanged "
+                f"({self.not_modified} by 304), {self.removed} removed; {self.embedded} chunks embedded, "
+                f"{self.embeddings_avoided} embeddings avoided, {self.stale_chunks} stale chunks")
+
+
+class IngestManifest:
+    """
+    Per-document ingestion state for one vector DB on one server (`scope`, e.g. the base URL), persisted in `path`.
+    Pass it as RAGIngestor(manifest=...); call `finish(seen_document_ids)` after a full pass to drop removed documents.
+    """
+
+    def __init__(self, path, scope, vector_db_id):
+        self.scope = str(scope)
+        self.vector_db_id = vector_db_id
+        self._report = ManifestReport()
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "scope TEXT NOT NULL, vector_db_id TEXT NOT NULL, document_id TEXT NOT NULL, content_hash TEXT NOT NULL, "
+            "etag TEXT, last_modified TEXT, chunks INTEGER NOT NULL, updated REAL NOT NULL, "
+            "PRIMARY KEY (scope, vector_db_id, document_id));"
+            "CREATE TABLE IF NOT EXISTS stale (scope TEXT NOT NULL, vector_db_id TEXT NOT NULL, chunks INTEGER NOT NULL, "
+            "PRIMARY KEY (scope, vector_db_id));"
+        )
+        self._db.commit()
+
+    def get(self, document_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT content_hash, etag, last_modified, chunks FROM documents "
+                "WHERE scope = ? AND vector_db_id = ? AND document_id = ?",
+                (self.scope, self.vector_db_id, document_id)).fetchone()
+        return ManifestEntry(*row) if row else None
+
+    def conditional_headers(self, document_id):
+        """If-None-Match / If-Modified-Since headers for re-fetching a URL source."""
+        entry = self.get(document_id)
+        headers = {}
+        if entry is not None and entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry is not None and entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def not_modified(self, document_id):
+        """Count a document skipped by a 304 response."""
+        entry = self.get(document_id)
+        with self._lock:
+            self._report.not_modified += 1
+            self._report.embeddings_avoided += entry.chunks if entry else 0
+
+    def admit(self, document_id, digest, etag=None, last_modified=None):
+        """
+        Decide whether a downloaded document must be (re-)embedded. Unchanged documents are counted as skipped
+        and have their validators refreshed; returns True for new and modified documents.
+        """
+        entry = self.get(document_id)
+        if entry is None or entry.content_hash != digest:
+            return True
+        with self._lock:
+            self._report.unchanged += 1
+            self._report.embeddings_avoided += entry.chunks
+            if (etag, last_modified) != (entry.etag, entry.last_modified):
+                self._db.execute(
+                    "UPDATE documents SET etag = ?, last_modified = ? WHERE scope = ? AND vector_db_id = ? AND document_id = ?",
+                    (etag, last_modified, self.scope, self.vector_db_id, document_id))
+                self._db.commit()
+        return False
+
+    def record(self, document_id, digest, chunks, etag=None, last_modified=None):
+        """Remember a document once all of its chunks were inserted."""
+        previous = self.get(document_id)
+        with self._lock:
+            if previous is None:
+                self._report.added += 1
+            else:
+                self._report.modified += 1
+                self._add_stale(previous.chunks)
+            self._report.embedded += chunks
+            self._db.execute(
+                "INSERT OR REPLACE INTO documents (scope, vector_db_id, document_id, content_hash, etag, last_modified, "
+                "chunks, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.scope, self.vector_db_id, document_id, digest, etag, last_modified, chunks, time.time()))
+            self._db.commit()
+
+    def finish(self, seen_document_ids):
+        """Forget documents that were not part of this (complete) pass; returns their ids."""
+        seen = set(seen_document_ids)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT document_id, chunks FROM documents WHERE scope = ? AND vector_db_id = ?",
+                (self.scope, self.vector_db_id)).fetchall()
+            removed = [(document_id, chunks) for document_id, chunks in rows if document_id not in seen]
+            self._db.executemany(
+                "DELETE FROM documents WHERE scope = ? AND vector_db_id = ? AND document_id = ?",
+                [(self.scope, self.vector_db_id, document_id) for document_id, _ in removed])
+            self._add_stale(sum(chunks for _, chunks in removed))
+            self._report.removed += len(removed)
+            self._db.commit()
+        return [document_id for document_id, _ in removed]
+
+    def _add_stale(self, chunks):
+        if chunks:
+            self._db.execute(
+                "INSERT INTO stale (scope, vector_db_id, chunks) VALUES (?, ?, ?) "
+                "ON CONFLICT (scope, vector_db_id) DO UPDATE SET chunks = chunks + excluded.chunks",
+                (self.scope, self.vector_db_id, chunks))
+
+    def stale_chunks(self):
+        with self._lock:
+            row = self._db.execute("SELECT chunks FROM stale WHERE scope = ? AND vector_db_id = ?",
+                                   (self.scope, self.vector_db_id)).fetchone()
+        return row[0] if row else 0
+
+    def live_chunks(self):
+        with self._lock:
+            row = self._db.execute("SELECT COALESCE(SUM(chunks), 0) FROM documents WHERE scope = ? AND vector_db_id = ?",
+                                   (self.scope, self.vector_db_id)).fetchone()
+        return row[0]
+
+    def needs_compaction(self):
+        """True while the vector DB holds any stale chunks, which queries would otherwise still retrieve."""
+        return self.stale_chunks() > 0
+
+    def clear(self):
+        """Forget this vector DB, e.g. after it was (re-)registered empty."""
+        with self._lock:
+            for table in ("documents", "stale"):
+                self._db.execute(f"DELETE FROM {table} WHERE scope = ? AND vector_db_id = ?", (self.scope, self.vector_db_id))
+            self._db.commit()
+
+    def report(self):
+        with self._lock:
+            report = ManifestReport(**self._report.__dict__)
+        report.stale_chunks = self.stale_chunks()
+        return report
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def ensure_vector_db(client, registry, vector_db_id, manifest=None, rebuild=False, **register_kwargs):
+    """
+    Register `vector_db_id` unless the server already has it, instead of re-registering it on every run.
+    A vector DB that needs compaction (or `rebuild`) is unregistered and registered again empty. Whenever the vector DB
+    starts empty the manifest is cleared, so every document is embedded again. Returns True if it was (re-)registered.
+    Call it again after an ingestion pass that left stale chunks, so they are gone before the first query.
+    """
+    registry.invalidate("vector_dbs")
+    exists = registry.vector_db(vector_db_id) is not None
+    if exists and not rebuild and (manifest is None or not manifest.needs_compaction()):
+        return False
+    if exists:
+        client.vector_dbs.unregister(vector_db_id)
+    client.vector_dbs.register(vector_db_id=vector_db_id, **register_kwargs)
+    registry.invalidate("vector_dbs")
+    if manifest is not None:
+        manifest.clear()
+    return True
@@ -0,0 +1,473 @@
+"""
+intent_router.py
+----------------
+Routing strategies for 21-llama-stack-routing-specialized-agents.py.
+A local TF-IDF nearest-centroid classifier, trained from labeled example queries, answers confident cases
+in well under a millisecond; only low-confidence queries fall through to the LLM routing agent.
+Decisions are memoized per normalized query, and `stats()` reports how many queries skipped the LLM
+and the routing latency that saved. The confidence threshold defaults to ROUTING_CONFIDENCE (0.15).
+SpeculativeRouter starts the historically most likely specialist while the router is still deciding,
+keeps its answer when the router agrees and cancels it otherwise, tracking hit rate and wasted tokens.
+read_fields_until() parses a streamed JSON routing decision incrementally and stops as soon as the
+`intent` field is complete, without waiting for the model to finish writing its `reason`.
+Run this file directly to benchmark the tiered router against LLM-only routing and early intent parsing.
+"""
+
+import json  # For decoding streamed JSON strings
+import logging  # For silencing per-request logs during the benchmarks
+import math  # For IDF weights and vector norms
+import random  # For simulated LLM routing latency in the benchmark
+import os  # For environment variable access
+import re  # For tokenizing queries
+import threading  # For guarding the memo and counters
+import time  # For routing latency
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from shared_utils import percentile  # Nearest-rank percentile for routing stats
+from stream_metrics import drain  # Cancellable stream consumer for speculative answers
+
+# Minimum cosine margin between the best and second-best intent for a local decision
+DEFAULT_THRESHOLD = float(os.environ.get("ROUTING_CONFIDENCE", "0.15"))
+DEFAULT_MEMO_SIZE = 4096
+# Speculate only when the most frequent intent so far accounts for at least this share of routed queries
+DEFAULT_MIN_SHARE = float(os.environ.get("ROUTING_SPECULATION_SHARE", "0.5"))
+
+# Labeled training queries for the HR intents of script 21; add examples here when adding an intent
+HR_EXAMPLES = {
+    "policy": [
+        "How many vacation days do I have left this year?",
+        "What is the parental leave policy?",
+        "Does our health insurance cover dental and vision?",
+        "How much sick leave can I carry over?",
+        "Am I eligible for the 401k match?",
+        "What holidays does the company observe?",
+        "Can I work remotely under the current policy?",
+        "How do I request unpaid leave?",
+    ],
+    "feedback": [
+        "I want to give anonymous feedback about my team.",
+        "Can I share concerns about my manager confidentially?",
+        "I'd like to comment on team dynamics.",
+        "Where do I submit suggestions to improve the office?",
+        "I have feedback about the onboarding process.",
+        "The recent reorg has hurt morale and I want to say so.",
+        "Is the engagement survey anonymous?",
+        "I want to report a concern about how meetings are run.",
+    ],
+    "scheduling": [
+        "Book a 30-minute meeting with my manager on Friday.",
+        "Can you schedule a 1:1 with Sarah next week?",
+        "Set up a team sync tomorrow at 10am.",
+        "Find a time for the quarterly review with the leads.",
+        "Move my Thursday meeting to the afternoon.",
+        "Reschedule the interview to Monday morning.",
+        "Cancel the standup on Wednesday.",
+        "Add the design team to the planning call calendar invite.",
+    ],
+}
+
+STOPWORDS = frozenset(
+    "a an and are as at be can could do for from have how i i'd i'm in is it me my of on or our please "
+    "should so that the this to we what when with would you your".split()
+)
+
+
+def normalize(query):
+    """Lowercase, collapse whitespace and drop surrounding punctuation, so trivially different queries share a memo entry."""
+    return " ".join(query.lower().split()).strip(" .!?")
+
+
+def _features(text):
+    words = [w for w in re.findall(r"[a-z0-9']+", text.lower()) if w not in STOPWORDS]
+    return Counter(words + [f"{a} {b}" for a, b in zip(words, words[1:])])
+
+
+class LocalIntentClassifier:
+    """
+    Nearest-centroid classifier over TF-IDF vectors of unigrams and bigrams.
+    `examples` maps each intent to a list of example queries.
+    """
+
+    def __init__(self, examples):
+        documents = [(intent, _features(text)) for intent, texts in examples.items() for text in texts]
+        document_frequency = Counter(term for _, features in documents for term in features)
+        self.idf = {
+            term: math.log((1 + len(documents)) / (1 + count)) + 1 for term, count in document_frequency.items()
+        }
+        centroids = {intent: Counter() for intent in examples}
+        for intent, features in documents:
+            for term, weight in self._vector(features).items():
+                centroids[intent][term] += weight
+        self.centroids = {intent: self._unit(vector) for intent, vector in centroids.items()}
+
+    def _vector(self, features):
+        # Terms never seen in training carry no signal for any intent
+        return self._unit({term: count * self.idf[term] for term, count in features.items() if term in self.idf})
+
+    @staticmethod
+    def _unit(vector):
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        return {term: weight / norm for term, weight in vector.items()} if norm else {}
+
+    def scores(self, query):
+        """Cosine similarity of `query` to each intent centroid."""
+        vector = self._vector(_features(query))
+        return {
+            intent: sum(weight * centroid.get(term, 0.0) for term, weight in vector.items())
+            for intent, centroid in self.centroids.items()
+        }
+
+    def predict(self, query):
+        """(intent, confidence), where confidence is the margin between the best and second-best similarity."""
+        ranked = sorted(self.scores(query).items(), key=lambda item: item[1], reverse=True)
+        best_intent, best = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+        return best_intent, best - runner_up
+
+
+@dataclass
+class Route:
+    intent: str
+    reason: str
+    source: str  # "local", "llm" or "memo"
+    confidence: Optional[float] = None
+    latency: float = 0.0
+
+
+@dataclass
+class RouterStats:
+    total: int
+    local: int
+    memo: int
+    llm: int
+    fast_p50: float
+    fast_p95: float
+    llm_p50: float
+    llm_p95: float
+
+    @property
+    def skipped_share(self):
+        return (self.local + self.memo) / self.total if self.total else 0.0
+
+    @property
+    def saved_p50(self):
+        """Typical routing time saved per skipped query (LLM p50 minus fast-path p50)."""
+        return max(self.llm_p50 - self.fast_p50, 0.0) if self.llm else 0.0
+
+    @property
+    def saved_p95(self):
+        return max(self.llm_p95 - self.fast_p95, 0.0) if self.llm else 0.0
+
+    def __str__(self):
+        return (f"{self.total} queries: {self.skipped_share:.0%} skipped the LLM router "
+                f"({self.local} local, {self.memo} memoized, {self.llm} LLM); "
+                f"routing p50/p95 {self.fast_p50 * 1000:.2f}/{self.fast_p95 * 1000:.2f} ms without the LLM vs "
+                f"{self.llm_p50 * 1000:.0f}/{self.llm_p95 * 1000:.0f} ms with it, "
+                f"saving ~{self.saved_p50 * 1000:.0f} ms (p50) / {self.saved_p95 * 1000:.0f} ms (p95) per skipped query")
+
+
+class TieredRouter:
+    """
+    Routes with the local classifier first and `llm_route(query) -> (intent, reason)` only when the
+    classifier's confidence is below `threshold`. Every decision is memoized per normalized query (LRU).
+    """
+
+    def __init__(self, classifier, llm_route, threshold=DEFAULT_THRESHOLD, memo_size=DEFAULT_MEMO_SIZE):
+        self.classifier = classifier
+        self.llm_route = llm_route
+        self.threshold = threshold
+        self.memo_size = memo_size
+        self._memo: OrderedDict = OrderedDict()
+        self._latencies = {"local": [], "memo": [], "llm": []}
+        self._lock = threading.Lock()
+
+    def route(self, query):
+        start = time.perf_counter()
+        key = normalize(query)
+        with self._lock:
+            cached = self._memo.get(key)
+            if cached is not None:
+                self._memo.move_to_end(key)
+        if cached is not None:
+            route = Route(cached.intent, cached.reason, "memo", cached.confidence)
+        else:
+            intent, confidence = self.classifier.predict(query)
+            if confidence >= self.threshold:
+                route = Route(intent, f"local classifier (confidence {confidence:.2f})", "local", confidence)
+            else:
+                intent, reason = self.llm_route(query)
+                route = Route(intent, reason, "llm", confidence)
+            with self._lock:
+                self._memo[key] = route
+                while len(self._memo) > self.memo_size:
+                    self._memo.popitem(last=False)
+        route.latency = time.perf_counter() - start
+        with self._lock:
+            self._latencies[route.source].append(route.latency)
+        return route
+
+    def stats(self):
+        with self._lock:
+            fast = self._latencies["local"] + self._latencies["memo"]
+            llm = list(self._latencies["llm"])
+            local, memo = len(self._latencies["local"]), len(self._latencies["memo"])
+        return RouterStats(
+            total=local + memo + len(llm), local=local, memo=memo, llm=len(llm),
+            fast_p50=percentile(fast, 50), fast_p95=percentile(fast, 95),
+            llm_p50=percentile(llm, 50), llm_p95=percentile(llm, 95),
+        )
+
+
+class StreamingJSONFields:
+    """
+    Incremental scanner for a streamed JSON object. `feed(text)` returns the top-level string fields
+    completed by that piece of text as (key, value) pairs; nested values and non-string values are skipped.
+    """
+
+    def __init__(self):
+        self.fields = {}
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._raw: list = []
+        self._expect_key = False
+        self._key = None
+
+    def feed(self, text):
+        completed = []
+        for ch in text:
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        completed.extend(self._string_done(json.loads('"' + "".join(self._raw) + '"')))
+                    continue
+                self._raw.append(ch)
+            elif ch == '"':
+                self._in_string = True
+                self._raw = []
+            elif ch in "{[":
+                self._depth += 1
+                self._expect_key = self._depth == 1
+            elif ch in "}]":
+                self._depth -= 1
+            elif self._depth == 1 and ch == ":":
+                self._expect_key = False
+            elif self._depth == 1 and ch == ",":
+                self._expect_key = True
+                self._key = None
+        return completed
+
+    def _string_done(self, value):
+        if self._expect_key:
+            self._key = value
+            return []
+        if self._key is None:
+            return []
+        key, self._key = self._key, None
+        self.fields[key] = value
+        return [(key, value)]
+
+
+def read_fields_until(stream, field="intent"):
+    """
+    Read an agent turn stream whose reply is a JSON object (e.g. a `response_format` JSON schema) and return
+    the top-level string fields parsed so far as soon as `field` is complete, closing the stream so the rest
+    of the reply is not generated. Raises ValueError if the reply ends without `field`.
+    The saving depends on the model writing `field` early, so list it first in the schema.
+    """
+    parser = StreamingJSONFields()
+    for chunk in stream:
+        payload = getattr(chunk.event, "payload", None)
+        if payload is None or payload.event_type != "step_progress":
+            continue
+        delta = payload.delta
+        if getattr(delta, "type", None) == "text" and any(key == field for key, _ in parser.feed(delta.text)):
+            stream.close()
+            return dict(parser.fields)
+    raise ValueError(f"Routing reply ended without a complete {field!r} field")
+
+
+@dataclass
+class SpeculativeOutcome:
+    route: Route
+    answer: Any  # What answer() returned for the routed intent
+    speculated: Optional[str] = None  # The intent started speculatively, if any
+
+    @property
+    def hit(self):
+        return self.speculated is not None and self.speculated == self.route.intent
+
+
+@dataclass
+class SpeculationStats:
+    queries: int
+    speculations: int
+    hits: int
+    wasted_tokens: int
+    wasted_seconds: float
+    saved_seconds: float
+
+    @property
+    def hit_rate(self):
+        return self.hits / self.speculations if self.speculations else 0.0
+
+    def __str__(self):
+        return (f"{self.speculations}/{self.queries} queries speculated, hit rate {self.hit_rate:.0%}; "
+                f"hits saved {self.saved_seconds:.2f}s of routing wait, misses wasted {self.wasted_tokens} tokens "
+                f"({self.wasted_seconds:.2f}s of generation)")
+
+
+class SpeculativeRouter:
+    """
+    Runs `route(query) -> Route` and, at the same time, `answer(intent, query, cancelled, speculative)` for the
+    intent routed most often so far. When the router agrees the speculative answer is used as is; otherwise
+    `cancelled` is set, the speculative run is discarded and the routed specialist is asked as usual.
+    `answer` must return a StreamResult (see stream_metrics.drain()) so discarded tokens can be counted, and should run a
+    speculative turn in a throwaway session, since a discarded turn still lands in its session's history.
+    `accept(intent, query, answer)` is called for every hit before handle() returns, e.g. to adopt the throwaway
+    session as the main one, and `discard(intent, query, answer)` once a discarded speculation has stopped,
+    e.g. to delete its session. Speculation starts once the top intent reaches `min_share` of the routed queries.
+    """
+
+    def __init__(self, route, answer, min_share=DEFAULT_MIN_SHARE, max_workers=4, accept=None, discard=None):
+        self.route = route
+        self.answer = answer
+        self.accept = accept
+        self.discard = discard
+        self.min_share = min_share
+        self._history: Counter = Counter()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculative")
+        self._stats = SpeculationStats(0, 0, 0, 0, 0.0, 0.0)
+        self._lock = threading.Lock()
+
+    def guess(self):
+        """The intent to speculate on, or None while history is too thin or too evenly spread."""
+        with self._lock:
+            if not self._history:
+                return None
+            intent, count = self._history.most_common(1)[0]
+            return intent if count / sum(self._history.values()) >= self.min_share else None
+
+    def handle(self, query):
+        guess = self.guess()
+        speculation = None
+        if guess is not None:
+            cancelled = threading.Event()
+            speculation = self._executor.submit(self.answer, guess, query, cancelled, True)
+        route = self.route(query)
+        with self._lock:
+            self._history[route.intent] += 1
+            self._stats.queries += 1
+            self._stats.speculations += speculation is not None
+        if speculation is not None and guess == route.intent and speculation.exception() is None:
+            with self._lock:
+                self._stats.hits += 1
+                self._stats.saved_seconds += route.latency
+            if self.accept is not None:
+                self.accept(guess, query, speculation.result())
+            return SpeculativeOutcome(route, speculation.result(), guess)
+        if speculation is not None:
+            cancelled.set()
+            speculation.add_done_callback(lambda future: self._discarded(guess, query, future))
+        return SpeculativeOutcome(route, self.answer(route.intent, query, None, False), guess)
+
+    def _discarded(self, intent, query, future):
+        if future.exception() is not None:
+            return
+        answer = future.result()
+        with self._lock:
+            self._stats.wasted_tokens += answer.metrics.tokens
+            self._stats.wasted_seconds += answer.metrics.total
+        if self.discard is not None:
+            self.discard(intent, query, answer)
+
+    def stats(self):
+        with self._lock:
+            return SpeculationStats(**self._stats.__dict__)
+
+    def shutdown(self):
+        """Wait for discarded speculative runs (and their discard() calls) to wind down."""
+        self._executor.shutdown(wait=True)
+
+
+def benchmark(rounds=3, llm_latency=0.4, seed=0):
+    """
+    Route a labeled HR workload `rounds` times (repeats hit the memo) with a simulated LLM router whose
+    latency is log-normal around `llm_latency` seconds, and report accuracy, LLM share and latency saved.
+    """
+    rng = random.Random(seed)
+    workload = [
+        ("How many vacation days can I roll over into next year?", "policy"),
+        ("Is maternity leave paid?", "policy"),
+        ("Does the dental plan cover braces?", "policy"),
+        ("I'd like to give some feedback about team dynamics, can it stay anonymous?", "feedback"),
+        ("I have a suggestion about the onboarding process.", "feedback"),
+        ("Can my manager see my survey answers?", "feedback"),
+        ("Can you book a 30-minute 1:1 with my manager this Friday afternoon?", "scheduling"),
+        ("Reschedule tomorrow's team sync to 3pm.", "scheduling"),
+        ("Set up a call with HR about my benefits.", "policy"),
+        ("What's the process for raising a grievance?", "feedback"),
+    ]
+    labels = dict(workload)
+
+    def llm_route(query):
+        # Stands in for the routing agent: slow, but always right
+        time.sleep(llm_latency * rng.lognormvariate(0, 0.3))
+        return labels[query], "simulated LLM router"
+
+    router = TieredRouter(LocalIntentClassifier(HR_EXAMPLES), llm_route)
+    correct = 0
+    for _ in range(rounds):
+        for query, label in workload:
+            correct += router.route(query).intent == label
+    stats = router.stats()
+    print(stats)
+    print(f"accuracy {correct / stats.total:.0%}; LLM-only routing would have made {stats.total} LLM calls, "
+          f"the tiered router made {stats.llm}")
+    return stats
+
+
+def benchmark_early_routing(reason_words=60, token_latency=0.01, trials=5):
+    """
+    Time a streamed routing decision (intent first, then a `reason_words`-word reason, `token_latency` s per
+    token from the stand-in server) read to completion vs. cut off by read_fields_until().
+    """
+    from llama_stack_client import Agent, LlamaStackClient
+    import stand_in_server
+
+    reason = " ".join(["the query is about booking a meeting"] * (reason_words // 7 + 1)).split()[:reason_words]
+    reply = json.dumps({"intent": "scheduling", "reason": " ".join(reason)}, indent=1)
+    timings = {"full reply": [], "early intent": []}
+    with stand_in_server.StandInServer(token_latency=token_latency, responder=lambda messages: reply) as server:
+        client = LlamaStackClient(base_url=server.base_url)
+        agent = Agent(client, model="m", instructions="Classify the query.")
+        session_id = agent.create_session("benchmark")
+        for _ in range(trials):
+            for name in timings:
+                start = time.perf_counter()
+                stream = client.agents.turn.create(session_id=session_id, agent_id=agent.agent_id,
+                                                   messages=[{"role": "user", "content": "Book a 1:1"}], stream=True)
+                if name == "early intent":
+                    read_fields_until(stream, "intent")
+                else:
+                    for _ in stream:
+                        pass
+                timings[name].append(time.perf_counter() - start)
+
+    for name, values in timings.items():
+        print(f"{name:>12}: p50 {percentile(values, 50) * 1000:.0f} ms, p95 {percentile(values, 95) * 1000:.0f} ms")
+    return timings
+
+
+if __name__ == "__main__":
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    benchmark()
+    benchmark_early_routing()
@@ -0,0 +1,242 @@
+"""
+provider_router.py
+------------------
+Latency-adaptive provider selection for the hosted/local pair of 19-llama-stack-two-agent-with-different-providers.py
+(the `together` and `ollama` inference providers declared in run.yml).
+Every call is recorded against its provider and model: a rolling window of latencies gives p50/p95, plus the
+error rate and streamed tokens/sec. Each request goes to the candidate with the lowest expected latency
+(the p95 of recent calls, inflated by their error rate) among those at or above the requested quality tier. A small share of
+requests, and any candidate left untried for `explore_after` seconds, is sent elsewhere so that a provider
+that got faster is noticed. Windows are saved to a JSON file, so a later run starts from what this one learned.
+Run this file directly to watch the router follow injected latency changes on the stand-in server.
+"""
+
+import json  # For the state file
+import logging  # For silencing per-request logs during the benchmark
+import os  # For paths and atomic replacement
+import random  # For exploration
+import tempfile  # For atomic writes
+import threading  # For guarding the statistics
+import time  # For latency and sample ages
+from collections import deque
+from dataclasses import dataclass, field
+
+from shared_utils import percentile  # Shared nearest-rank percentile
+
+# Where the router keeps its statistics; set it to an empty string to keep them in memory only
+PROVIDER_ROUTER_PATH_ENV = "LLAMA_STACK_PROVIDER_ROUTER"
+DEFAULT_PATH = os.environ.get(
+    PROVIDER_ROUTER_PATH_ENV,
+    os.path.join(os.path.expanduser("~"), ".cache", "llama-stack-examples", "provider-router.json"),
+)
+WINDOW_SIZE = 100
+RECENT_SAMPLES = 20  # Routing looks at the newest samples only, so it follows changes quickly
+EXPLORE_RATE = 0.05
+EXPLORE_AFTER = 300.0  # Seconds after which an unused candidate is probed again
+MAX_SAMPLE_AGE = 24 * 3600.0  # Samples older than this are dropped when the state is loaded
+SAVE_EVERY = 10  # Calls between state saves
+
+
+@dataclass(frozen=True)
+class Candidate:
+    model: str
+    provider: str
+    tier: int = 1  # Quality tier; higher is better
+
+    @property
+    def key(self):
+        return f"{self.provider}/{self.model}"
+
+
+@dataclass
+class ProviderStats:
+    samples: deque = field(default_factory=lambda: deque(maxlen=WINDOW_SIZE))  # (when, seconds, ok, tokens/s)
+    last_used: float = 0.0
+
+    @property
+    def latencies(self):
+        return [seconds for _, seconds, ok, _ in self.samples if ok]
+
+    @property
+    def p50(self):
+        return percentile(self.latencies, 50)
+
+    @property
+    def p95(self):
+        return percentile(self.latencies, 95)
+
+    @property
+    def error_rate(self):
+        return sum(not ok for _, _, ok, _ in self.samples) / len(self.samples) if self.samples else 0.0
+
+    @property
+    def tokens_per_second(self):
+        return percentile([rate for _, _, ok, rate in self.samples if ok and rate], 50)
+
+    @property
+    def expected_latency(self):
+        """Recent p95 latency inflated by the recent error rate, since a failed call costs a retry elsewhere."""
+        if not self.samples:
+            return 0.0
+        recent = list(self.samples)[-RECENT_SAMPLES:]
+        latencies = [seconds for _, seconds, ok, _ in recent if ok]
+        if not latencies:
+            return float("inf")
+        error_rate = 1.0 - len(latencies) / len(recent)
+        return percentile(latencies, 95) / max(1.0 - error_rate, 0.05)
+
+    def __str__(self):
+        return (f"{len(self.samples)} calls, p50 {self.p50:.2f}s / p95 {self.p95:.2f}s, "
+                f"{self.error_rate:.0%} errors, {self.tokens_per_second:.1f} tok/s")
+
+
+class ProviderRouter:
+    """
+    `choose(min_tier)` returns the Candidate to use next; `record(candidate, seconds, ok, tokens_per_second)`
+    reports how the call went. `call(fn, min_tier)` does both around `fn(candidate)`, failing over to the next
+    candidate when `fn` raises.
+    """
+
+    def __init__(self, candidates, path=DEFAULT_PATH, explore_rate=EXPLORE_RATE, explore_after=EXPLORE_AFTER,
+                 rng=None):
+        self.candidates = list(candidates)
+        self.path = path
+        self.explore_rate = explore_rate
+        self.explore_after = explore_after
+        self.rng = rng or random.Random()
+        self._stats = {candidate.key: ProviderStats() for candidate in self.candidates}
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    def eligible(self, min_tier=0):
+        candidates = [candidate for candidate in self.candidates if candidate.tier >= min_tier]
+        if not candidates:
+            raise ValueError(f"No candidate meets quality tier {min_tier}")
+        return candidates
+
+    def ranked(self, min_tier=0):
+        """Eligible candidates, best first."""
+        with self._lock:
+            return sorted(self.eligible(min_tier), key=lambda c: (self._stats[c.key].expected_latency, -c.tier))
+
+    def choose(self, min_tier=0):
+        ranked = self.ranked(min_tier)
+        now = time.time()
+        with self._lock:
+            stale = [c for c in ranked[1:] if now - self._stats[c.key].last_used >= self.explore_after]
+        if stale:
+            return stale[0]
+        if len(ranked) > 1 and self.rng.random() < self.explore_rate:
+            return self.rng.choice(ranked[1:])
+        return ranked[0]
+
+    def record(self, candidate, seconds, ok=True, tokens_per_second=0.0):
+        now = time.time()
+        with self._lock:
+            stats = self._stats[candidate.key]
+            stats.samples.append((now, seconds, ok, tokens_per_second))
+            stats.last_used = now
+            self._unsaved += 1
+            save = self._unsaved >= SAVE_EVERY
+        if save:
+            self.save()
+
+    def call(self, fn, min_tier=0):
+        """
+        Run `fn(candidate)` on the chosen candidate and return (candidate, result). If it raises, the other
+        eligible candidates are tried best first; the last error is raised when all of them fail.
+        A result with StreamResult-style `.metrics` also records its tokens/sec.
+        """
+        first = self.choose(min_tier)
+        order = [first] + [c for c in self.ranked(min_tier) if c != first]
+        error = None
+        for candidate in order:
+            start = time.perf_counter()
+            try:
+                result = fn(candidate)
+            except Exception as e:
+                self.record(candidate, time.perf_counter() - start, ok=False)
+                error = e
+                continue
+            metrics = getattr(result, "metrics", None)
+            self.record(candidate, time.perf_counter() - start, True, getattr(metrics, "tokens_per_second", 0.0))
+            return candidate, result
+        raise error
+
+    def stats(self):
+        """candidate key -> ProviderStats snapshot."""
+        with self._lock:
+            return {key: ProviderStats(deque(s.samples, maxlen=WINDOW_SIZE), s.last_used) for key, s in self._stats.items()}
+
+    def report(self):
+        stats = self.stats()
+        return "\n".join(f"{c.key:>50} (tier {c.tier}): {stats[c.key]}" for c in self.candidates)
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            state = {key: {"samples": list(s.samples), "last_used": s.last_used} for key, s in self._stats.items()}
+            self._unsaved = 0
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temp file and rename so concurrent readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+    def _load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        oldest = time.time() - MAX_SAMPLE_AGE
+        for key, stats in self._stats.items():
+            saved = state.get(key) or {}
+            stats.samples.extend(tuple(sample) for sample in saved.get("samples", []) if sample[0] >= oldest)
+            stats.last_used = saved.get("last_used", 0.0)
+
+
+def benchmark(path="", rounds=3, requests=30):
+    """
+    Route chat completions between a "hosted" and a "local" stand-in model whose injected latency swaps
+    every round, and show which one the router picked and the latency it saw.
+    """
+    from llama_stack_client import LlamaStackClient
+    from stream_metrics import consume
+    import stand_in_server
+
+    hosted = Candidate("meta-llama/Llama-3.2-3B-Instruct-Turbo", "together", tier=2)
+    local = Candidate("llama3.2:1b", "ollama", tier=1)
+    with stand_in_server.StandInServer(token_latency=0.001) as server:
+        client = LlamaStackClient(base_url=server.base_url)
+        router = ProviderRouter([hosted, local], path=path, explore_rate=0.1, explore_after=60.0)
+
+        def ask(candidate):
+            return consume(client.inference.chat_completion(
+                model_id=candidate.model, messages=[{"role": "user", "content": "Hello there"}], stream=True))
+
+        for index in range(rounds):
+            slow, fast = (hosted, local) if index % 2 == 0 else (local, hosted)
+            server.model_latency.update({slow.model: 0.08, fast.model: 0.01})
+            picks, latencies = [], []
+            for _ in range(requests):
+                start = time.perf_counter()
+                candidate, _ = router.call(ask)
+                latencies.append(time.perf_counter() - start)
+                picks.append(candidate)
+            print(f"round {index + 1}: {slow.provider} slow; picked {fast.provider} {picks.count(fast)}/{requests} times, "
+                  f"latency p50 {percentile(latencies, 50) * 1000:.0f} ms / p95 {percentile(latencies, 95) * 1000:.0f} ms")
+        print(router.report())
+        print(f"tier 2 only: always {router.choose(min_tier=2).provider}")
+    return router
+
+
+if __name__ == "__main__":
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    benchmark()
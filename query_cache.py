@@ -0,0 +1,350 @@
+"""
+query_cache.py
+--------------
+Semantic cache for `client.tool_runtime.rag_tool.query` results, for 13-llama-stack-rag-enabled-agent.py whose
+users keep asking near-identical questions ("What is llama stack?", "what's Llama Stack").
+A query is first looked up by a hash of its normalized text (case, punctuation, whitespace and common
+contractions folded) together with its vector_db_ids and query_config; failing that, by the cosine similarity of
+its embedding to earlier queries with the same targets, above `threshold`. Writes through the same client
+(`vector_io.insert`, `rag_tool.insert`, registering or unregistering a vector DB) drop the entries that search
+that vector DB, and `ttl` bounds how long writes by other processes can go unnoticed. `stats()` reports the
+hit rate and the query latency saved.
+Run this file directly to benchmark it on a stream of paraphrased questions against the stand-in server.
+"""
+
+import hashlib  # For exact-match keys
+import json  # For canonical query_config encoding
+import logging  # For silencing per-request logs during the benchmark
+import os  # For environment variable access
+import re  # For query normalization
+import threading  # For guarding the entries
+import time  # For TTL and latency
+import unicodedata  # For query normalization
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional
+
+import numpy as np  # For similarity search over cached query embeddings (installed with faiss-cpu)
+
+from llama_stack_client import NOT_GIVEN  # Sentinel for omitted request parameters
+from response_cache import plain  # Same plain-data conversion as the chat completion cache
+
+# Setting this to 1 turns the cache on in script 13
+QUERY_CACHE_ENV = "LLAMA_STACK_QUERY_CACHE"
+DEFAULT_THRESHOLD = 0.9
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TTL = 600.0
+
+CONTRACTIONS = {
+    "what's": "what is", "whats": "what is", "who's": "who is", "where's": "where is", "how's": "how is",
+    "it's": "it is", "that's": "that is", "there's": "there is", "what're": "what are", "how're": "how are",
+    "can't": "cannot", "won't": "will not", "don't": "do not", "doesn't": "does not", "isn't": "is not",
+    "aren't": "are not", "i'm": "i am", "i've": "i have", "you're": "you are", "let's": "let us",
+}
+
+
+def normalize_query(text):
+    """Fold case, Unicode forms, apostrophes, common contractions, punctuation and whitespace."""
+    text = unicodedata.normalize("NFKC", text).lower().replace("’", "'")
+    words = [CONTRACTIONS.get(word, word) for word in text.split()]
+    return " ".join(re.sub(r"[^\w\s]", " ", " ".join(words)).split())
+
+
+def _scope(vector_db_ids, query_config):
+    config = json.dumps(plain(query_config), sort_keys=True, separators=(",", ":"))
+    return json.dumps([sorted(vector_db_ids), config])
+
+
+@dataclass
+class QueryCacheStats:
+    exact_hits: int = 0
+    similar_hits: int = 0
+    misses: int = 0
+    invalidated: int = 0  # Entries dropped because their vector DBs were written to
+    saved_seconds: float = 0.0  # Query latency avoided by hits
+    miss_seconds: float = 0.0  # Time spent in rag_tool.query on misses
+
+    @property
+    def hits(self):
+        return self.exact_hits + self.similar_hits
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __str__(self):
+        return (f"{self.hits} hits ({self.exact_hits} exact, {self.similar_hits} similar), {self.misses} misses "
+                f"({self.hit_rate:.0%} hit rate), {self.invalidated} invalidated; {self.saved_seconds:.2f}s of query "
+                f"latency saved")
+
+
+@dataclass
+class _Entry:
+    scope: str
+    vector_db_ids: frozenset
+    result: Any
+    seconds: float  # What the query cost when it missed
+    created: float
+    vector: Optional[np.ndarray] = None
+
+
+class QueryCache:
+    """
+    `get_exact(content, vector_db_ids, query_config)` and `get_similar(vector, vector_db_ids, query_config)` return
+    the matching entry or None; `put(...)` stores a result; `invalidate(vector_db_id)` drops the entries that search it.
+    `vector` is the unit-length embedding of the normalized query, or None for exact matching only.
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()  # key -> _Entry, least recently used first
+        self._generations: dict = {}  # vector DB id -> writes seen
+        self._stats = QueryCacheStats()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(content, vector_db_ids, query_config=None):
+        encoded = json.dumps([normalize_query(content), _scope(vector_db_ids, query_config)])
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    def generation(self, vector_db_ids):
+        """Snapshot to pass to put(), so a result fetched while its vector DB was written to is not cached."""
+        with self._lock:
+            return tuple(self._generations.get(vector_db_id, 0) for vector_db_id in sorted(vector_db_ids))
+
+    def get_exact(self, content, vector_db_ids, query_config=None):
+        key = self.key(content, vector_db_ids, query_config)
+        with self._lock:
+            entry = self._live(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def get_similar(self, vector, vector_db_ids, query_config=None):
+        scope = _scope(vector_db_ids, query_config)
+        with self._lock:
+            candidates = [(key, entry) for key, entry in list(self._entries.items())
+                          if entry.scope == scope and entry.vector is not None and self._live(key) is not None]
+            if not candidates:
+                return None
+            scores = np.stack([entry.vector for _, entry in candidates]) @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            key, entry = candidates[best]
+            self._entries.move_to_end(key)
+            return entry
+
+    def _live(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and time.time() - entry.created > self.ttl:
+            del self._entries[key]
+            return None
+        return entry
+
+    def put(self, content, vector_db_ids, query_config, result, seconds, vector=None, generation=None, created=None):
+        """Cache `result`; `created` (a time.time() value) dates an entry copied from another so it keeps that ttl."""
+        key = self.key(content, vector_db_ids, query_config)
+        with self._lock:
+            current = tuple(self._generations.get(vector_db_id, 0) for vector_db_id in sorted(vector_db_ids))
+            if generation is not None and generation != current:
+                return
+            self._entries[key] = _Entry(_scope(vector_db_ids, query_config), frozenset(vector_db_ids), result, seconds,
+                                        time.time() if created is None else created, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, vector_db_id):
+        """Drop every entry that searches `vector_db_id`; returns how many were dropped."""
+        with self._lock:
+            self._generations[vector_db_id] = self._generations.get(vector_db_id, 0) + 1
+            stale = [key for key, entry in self._entries.items() if vector_db_id in entry.vector_db_ids]
+            for key in stale:
+                del self._entries[key]
+            self._stats.invalidated += len(stale)
+        return len(stale)
+
+    def record(self, kind, seconds, saved=0.0):
+        with self._lock:
+            if kind == "exact":
+                self._stats.exact_hits += 1
+            elif kind == "similar":
+                self._stats.similar_hits += 1
+            else:
+                self._stats.misses += 1
+                self._stats.miss_seconds += seconds
+            self._stats.saved_seconds += max(saved, 0.0)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return QueryCacheStats(**self._stats.__dict__)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class CachedRAGTool:
+    """
+    Stand-in for `client.tool_runtime.rag_tool` that answers query() from a QueryCache and invalidates it on insert().
+    `embed(texts)` (e.g. embedding_cache.embedder) enables near-duplicate matching. Other attributes are delegated.
+    """
+
+    def __init__(self, rag_tool, cache, embed=None):
+        self._rag_tool = rag_tool
+        self.cache = cache
+        self.embed = embed
+
+    def __getattr__(self, name):
+        return getattr(self._rag_tool, name)
+
+    def query(self, *, content, vector_db_ids, query_config=NOT_GIVEN, **params):
+        if not isinstance(content, str) or params:
+            return self._rag_tool.query(content=content, vector_db_ids=vector_db_ids, query_config=query_config, **params)
+        start = time.perf_counter()
+        config = None if query_config is NOT_GIVEN else query_config
+        generation = self.cache.generation(vector_db_ids)
+        entry, kind, vector = self.cache.get_exact(content, vector_db_ids, config), "exact", None
+        if entry is None and self.embed is not None:
+            vector = np.asarray(self.embed([normalize_query(content)])[0], dtype=np.float32)
+            vector /= max(float(np.linalg.norm(vector)), 1e-12)
+            entry, kind = self.cache.get_similar(vector, vector_db_ids, config), "similar"
+        if entry is not None:
+            if kind == "similar":
+                # Remember this phrasing too, so asking it again is an exact hit without an embeddings request;
+                # it expires with the result it copies, so a chain of paraphrases cannot keep a result alive
+                self.cache.put(content, vector_db_ids, config, entry.result, entry.seconds, vector, generation,
+                               created=entry.created)
+            elapsed = time.perf_counter() - start
+            self.cache.record(kind, elapsed, saved=entry.seconds - elapsed)
+            return entry.result
+        queried = time.perf_counter()
+        result = self._rag_tool.query(content=content, vector_db_ids=vector_db_ids, query_config=query_config)
+        seconds = time.perf_counter() - queried
+        self.cache.put(content, vector_db_ids, config, result, seconds, vector, generation)
+        self.cache.record(None, seconds)
+        return result
+
+    def insert(self, *, vector_db_id, **params):
+        try:
+            return self._rag_tool.insert(vector_db_id=vector_db_id, **params)
+        finally:
+            self.cache.invalidate(vector_db_id)
+
+
+class _InvalidatingResource:
+    """Delegates to a client resource and invalidates the cache after the named write methods."""
+
+    def __init__(self, resource, cache, writes):
+        self._resource = resource
+        self._cache = cache
+        self._writes = writes
+
+    def __getattr__(self, name):
+        attribute = getattr(self._resource, name)
+        if name not in self._writes:
+            return attribute
+
+        def write(*args, **kwargs):
+            try:
+                return attribute(*args, **kwargs)
+            finally:
+                vector_db_id = kwargs.get("vector_db_id", args[0] if args else None)
+                if vector_db_id is not None:
+                    self._cache.invalidate(vector_db_id)
+        return write
+
+
+def enable_query_cache(client, cache=None, embed=None):
+    """
+    Route `client.tool_runtime.rag_tool.query` through a QueryCache and return the client. Vector IO inserts and
+    vector DB (un)registrations through the client invalidate it. Without an explicit `cache` this is a no-op unless
+    LLAMA_STACK_QUERY_CACHE is 1, so scripts can call it unconditionally.
+    """
+    if cache is None:
+        if os.environ.get(QUERY_CACHE_ENV) != "1":
+            return client
+        cache = QueryCache()
+    tool_runtime = client.tool_runtime
+    if isinstance(tool_runtime.rag_tool, CachedRAGTool):
+        tool_runtime.rag_tool.cache, tool_runtime.rag_tool.embed = cache, embed
+        client.vector_io._cache = client.vector_dbs._cache = cache
+        return client
+    tool_runtime.rag_tool = CachedRAGTool(tool_runtime.rag_tool, cache, embed)
+    client.vector_io = _InvalidatingResource(client.vector_io, cache, {"insert"})
+    client.vector_dbs = _InvalidatingResource(client.vector_dbs, cache, {"register", "unregister"})
+    return client
+
+
+def benchmark(questions=300, repeat_share=0.7, latency=0.02, threshold=0.88):
+    """
+    Ask `questions` RAG queries against the stand-in server (`latency` s per request), where `repeat_share` of them
+    rephrase an earlier question: without a cache, with exact matching only, and with near-duplicate matching too
+    (which costs an embeddings request whenever the exact lookup misses). An insert halfway through each pass
+    invalidates the cache. The stand-in's toy embeddings need a lower `threshold` than all-MiniLM-L6-v2 would.
+    """
+    import random
+    from llama_stack_client import LlamaStackClient
+    from embedding_cache import embedder
+    from shared_utils import percentile
+    import stand_in_server
+
+    rng = random.Random(5)
+    vocabulary = ["llama", "stack", "agent", "vector", "shield", "safety", "telemetry", "eval", "inference", "tool",
+                  "memory", "provider", "router", "stream", "server", "client"]
+    # Spelled differently but normalized to the same text, or one word longer (a near duplicate)
+    forms = ["What is {}?", "what's {}", "  WHAT IS {} ?", "What is {}, please?", "So what is {}?"]
+    topics, stream = [], []
+    for _ in range(questions):
+        if not topics or rng.random() >= repeat_share:
+            topics.append(" ".join(rng.sample(vocabulary, 2)) + f" {len(topics)}x")
+            stream.append(forms[0].format(topics[-1]))
+        else:
+            stream.append(rng.choice(forms).format(rng.choice(topics)))
+
+    with stand_in_server.StandInServer(latency=latency) as server:
+        client = LlamaStackClient(base_url=server.base_url)
+        client.vector_io.insert(vector_db_id="kb", chunks=[
+            {"content": f"{topic} is part of the stack", "metadata": {"document_id": topic}} for topic in topics])
+
+        def ask(label):
+            latencies = []
+            for index, question in enumerate(stream):
+                if index == len(stream) // 2:
+                    client.vector_io.insert(vector_db_id="kb", chunks=[
+                        {"content": "a new page", "metadata": {"document_id": "new"}}])
+                start = time.perf_counter()
+                client.tool_runtime.rag_tool.query(content=question, vector_db_ids=["kb"])
+                latencies.append(time.perf_counter() - start)
+            print(f"{label}: {sum(latencies):.2f}s total, latency p50 {percentile(latencies, 50) * 1000:.1f} ms / "
+                  f"p95 {percentile(latencies, 95) * 1000:.1f} ms")
+
+        ask("no cache        ")
+        exact = QueryCache(threshold=threshold)
+        enable_query_cache(client, exact)
+        ask("exact only      ")
+        print(f"  {exact.stats()}")
+        similar = QueryCache(threshold=threshold)
+        enable_query_cache(client, similar, embed=embedder(client, "all-MiniLM-L6-v2"))
+        ask("exact + similar ")
+        print(f"  {similar.stats()}")
+        # The same with an in-process embedding model instead of an embeddings request per lookup
+        local = QueryCache(threshold=threshold)
+        enable_query_cache(client, local, embed=lambda texts: [stand_in_server.embed(text) for text in texts])
+        ask("local embedder  ")
+        print(f"  {local.stats()}")
+    return exact.stats(), similar.stats(), local.stats()
+
+
+if __name__ == "__main__":
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    benchmark()
@@ -0,0 +1,431 @@
+"""
+rag_ingest.py
+-------------
+Concurrent RAG ingestion for 13-llama-stack-rag-enabled-agent.py and larger corpora (tens of thousands of URLs
+and files), replacing one blocking `rag_tool.insert` call that fetches, chunks and embeds everything in turn.
+Documents are fetched by a pool of workers over one pooled HTTP client (see client_pool), read in pieces and
+chunked as they stream in, and the chunks are sent to `client.vector_io.insert` in batches of `batch_size`,
+where the server embeds them. Sources are read lazily and the queues between stages are bounded, so memory
+stays flat however large the corpus is: a slow vector store blocks chunking, which blocks fetching, which
+blocks reading sources (backpressure). Progress (documents/s and chunks/s) is reported while it runs.
+With an ingest_manifest.IngestManifest, unchanged documents are skipped (by a 304 or by content hash) and each
+document's chunks are held until its hash is known, so memory is bounded by the largest document per fetcher.
+With an embedding_cache.EmbeddingCache, chunks are sent with their embeddings, computed only for chunk texts
+the cache has not seen before. With a vector_index.VectorIndex, inserted chunks are also added to it (replacing
+earlier chunks of the same document), so queries can be answered locally.
+Run this file directly to benchmark against a stand-in file server.
+"""
+
+import hashlib  # For content hashes while streaming
+import logging  # For silencing per-request logs during the benchmark
+import os  # For local file sources
+import queue  # For the bounded queues between stages
+import threading  # For fetch and insert workers
+import time  # For throughput and progress reports
+from dataclasses import dataclass, field
+from typing import Optional
+
+from client_pool import build_http_client  # Pooled keep-alive HTTP client for fetching documents
+from context_window import estimate_tokens  # Same four-characters-per-token estimate as elsewhere
+from embedding_cache import embedder  # Embeddings API call for cache misses
+
+DEFAULT_CHUNK_TOKENS = 256
+DEFAULT_OVERLAP_TOKENS = 0
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_FETCH_WORKERS = 8
+DEFAULT_INSERT_WORKERS = 2
+DEFAULT_QUEUE_SIZE = 512  # Chunks buffered between chunking and inserting
+DEFAULT_PROGRESS_INTERVAL = 5.0  # Seconds between progress reports
+READ_SIZE = 64 * 1024  # Bytes read from a source at a time
+FLUSH_INTERVAL = 0.2  # Seconds an insert worker waits to fill a batch before sending a partial one
+
+_STOP = object()
+
+
+@dataclass
+class Source:
+    """A document to ingest: `location` is an http(s) URL or a file path; `text` is inline content instead."""
+    document_id: str
+    location: Optional[str] = None
+    text: Optional[str] = None
+    metadata: dict = field(default_factory=dict)
+
+
+def sources_from_documents(documents):
+    """Sources for RAGDocuments (or dicts with the same fields) as built by scripts 12 and 13."""
+    for document in documents:
+        get = document.get if isinstance(document, dict) else lambda name: getattr(document, name, None)
+        content = get("content")
+        remote = isinstance(content, str) and content.startswith(("http://", "https://", "file://"))
+        yield Source(str(get("document_id")), location=content if remote else None,
+                     text=None if remote else content, metadata=dict(get("metadata") or {}))
+
+
+def sources_from_file(path):
+    """Sources for a file listing one URL or file path per line; the line itself is the document id."""
+    with open(path, encoding="utf-8") as lines:
+        for line in lines:
+            location = line.strip()
+            if location and not location.startswith("#"):
+                yield Source(location, location=location)
+
+
+class StreamingChunker:
+    """
+    Splits text fed in arbitrary pieces into chunks of about `chunk_tokens` tokens, cut at whitespace, with the
+    last `overlap_tokens` tokens of each chunk repeated at the start of the next. Only one chunk is buffered.
+    """
+
+    def __init__(self, chunk_tokens=DEFAULT_CHUNK_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS):
+        if overlap_tokens * 2 > chunk_tokens:
+            raise ValueError("overlap_tokens must be at most half of chunk_tokens")
+        self.size = chunk_tokens * 4
+        self.overlap = overlap_tokens * 4
+        self._buffer = ""
+
+    def feed(self, text):
+        """Yield the chunks completed by `text`."""
+        self._buffer += text
+        while len(self._buffer) > self.size:
+            cut = self._buffer.rfind(" ", self.size // 2, self.size)
+            cut = cut if cut > 0 else self.size
+            chunk, rest = self._buffer[:cut].strip(), self._buffer[cut:]
+            tail = ""
+            if self.overlap:
+                start = chunk.find(" ", max(len(chunk) - self.overlap, 0))
+                tail = chunk[start + 1:] + " " if start >= 0 else ""
+            self._buffer = tail + rest.lstrip()
+            if chunk:
+                yield chunk
+
+    def close(self):
+        """Yield whatever is left as the final chunk."""
+        chunk, self._buffer = self._buffer.strip(), ""
+        if chunk:
+            yield chunk
+
+
+@dataclass
+class IngestStats:
+    documents: int = 0
+    failed: int = 0
+    skipped: int = 0  # Unchanged according to the manifest
+    chunks: int = 0
+    batches: int = 0
+    failed_chunks: int = 0  # In batches the vector store rejected
+    bytes: int = 0
+    elapsed: float = 0.0
+    max_queue_depth: int = 0
+    errors: list = field(default_factory=list)  # (document_id, message)
+
+    @property
+    def documents_per_second(self):
+        return self.documents / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def chunks_per_second(self):
+        return self.chunks / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (f"{self.documents} documents ({self.failed} failed, {self.skipped} unchanged), {self.chunks} chunks in {self.batches} batches "
+                f"({self.failed_chunks} failed), "
+                f"{self.bytes / 1e6:.1f} MB in {self.elapsed:.1f}s: {self.documents_per_second:.1f} docs/s, "
+                f"{self.chunks_per_second:.1f} chunks/s, chunk queue peak {self.max_queue_depth}")
+
+
+class RAGIngestor:
+    """
+    `run(sources)` ingests an iterable of Sources into `vector_db_id` and returns IngestStats.
+    `progress(stats)` is called every `progress_interval` seconds while it runs (None to stay quiet).
+    With `manifest` (ingest_manifest.IngestManifest) only new and modified documents are embedded, and after a
+    complete pass documents missing from `sources` are dropped from the manifest.
+    With `embedding_cache`, chunks are embedded client-side with `embedding_model` (the vector DB's model) and
+    cached vectors are reused. With `local_index` (vector_index.VectorIndex) inserted chunks are mirrored into it.
+    A document_id that occurs twice in one run is ingested once; the repeats are reported as failed.
+    """
+
+    def __init__(self, client, vector_db_id, chunk_size_in_tokens=DEFAULT_CHUNK_TOKENS,
+                 overlap_in_tokens=DEFAULT_OVERLAP_TOKENS, batch_size=DEFAULT_BATCH_SIZE,
+                 fetch_workers=DEFAULT_FETCH_WORKERS, insert_workers=DEFAULT_INSERT_WORKERS,
+                 queue_size=DEFAULT_QUEUE_SIZE, progress=print, progress_interval=DEFAULT_PROGRESS_INTERVAL,
+                 manifest=None, embedding_cache=None, embedding_model=None, local_index=None):
+        if (embedding_cache is not None or local_index is not None) and not embedding_model:
+            raise ValueError("embedding_cache and local_index need the vector DB's embedding_model")
+        self.client = client
+        self.vector_db_id = vector_db_id
+        self.chunk_size_in_tokens = chunk_size_in_tokens
+        self.overlap_in_tokens = overlap_in_tokens
+        self.batch_size = batch_size
+        self.fetch_workers = fetch_workers
+        self.insert_workers = insert_workers
+        self.queue_size = queue_size
+        self.progress = progress
+        self.progress_interval = progress_interval
+        self.manifest = manifest
+        self.embedding_cache = embedding_cache
+        self.embedding_model = embedding_model
+        self.local_index = local_index
+        # document id -> [chunks not yet inserted, failed, (hash, etag, last modified), chunks]
+        self._documents: dict = {}
+        self._seen: set = set()
+        self._stats = IngestStats()
+        self._lock = threading.Lock()
+
+    def run(self, sources, complete=True):
+        """Ingest `sources`; `complete=False` marks a partial pass, after which the manifest forgets nothing."""
+        self._stats = IngestStats()
+        self._documents, self._seen = {}, set()
+        started = time.perf_counter()
+        pending: queue.Queue = queue.Queue(maxsize=self.fetch_workers * 2)
+        chunks: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        done = threading.Event()
+        with build_http_client(pool_size=self.fetch_workers) as http:
+            fetchers = [threading.Thread(target=self._fetch, args=(http, pending, chunks), name=f"fetch-{i}", daemon=True)
+                        for i in range(self.fetch_workers)]
+            inserters = [threading.Thread(target=self._insert, args=(chunks,), name=f"insert-{i}", daemon=True)
+                         for i in range(self.insert_workers)]
+            for worker in fetchers + inserters:
+                worker.start()
+            if self.progress is not None:
+                threading.Thread(target=self._report, args=(done, started), daemon=True).start()
+            try:
+                for source in sources:
+                    if source.document_id in self._seen:
+                        # Two documents under one id would share (and overwrite) its chunks and manifest entry
+                        with self._lock:
+                            self._stats.failed += 1
+                            self._stats.errors.append((source.document_id, "Duplicate document_id; ingested once"))
+                        continue
+                    self._seen.add(source.document_id)
+                    pending.put(source)  # Blocks while every fetcher is busy
+            except BaseException:
+                complete = False
+                raise
+            finally:
+                for _ in fetchers:
+                    pending.put(_STOP)
+                for worker in fetchers:
+                    worker.join()
+                for _ in inserters:
+                    chunks.put(_STOP)
+                for worker in inserters:
+                    worker.join()
+                done.set()
+                if self.manifest is not None and complete:
+                    removed = self.manifest.finish(self._seen)
+                    if self.local_index is not None:
+                        self.local_index.remove_documents(removed)
+        with self._lock:
+            self._stats.elapsed = time.perf_counter() - started
+        return self.stats()
+
+    def _fetch(self, http, pending, chunks):
+        while True:
+            source = pending.get()
+            if source is _STOP:
+                return
+            # Without a manifest chunks stream straight out; with one they wait until the hash is known
+            held = [] if self.manifest is not None else None
+            if held is None:
+                self._replace_local(source.document_id)
+            emit = held.append if held is not None else lambda chunk: self._put(chunks, chunk)
+            validators = {}
+            digest = hashlib.sha256()
+            count = size = 0
+            try:
+                chunker = StreamingChunker(self.chunk_size_in_tokens, self.overlap_in_tokens)
+                for piece in self._read(http, source, validators):
+                    size += len(piece)
+                    digest.update(piece.encode())
+                    for text in chunker.feed(piece):
+                        emit(self._chunk(source, text, count))
+                        count += 1
+                for text in chunker.close():
+                    emit(self._chunk(source, text, count))
+                    count += 1
+            except Exception as e:
+                with self._lock:
+                    self._stats.failed += 1
+                    self._stats.errors.append((source.document_id, f"{type(e).__name__}: {e}"))
+                continue
+            with self._lock:
+                self._stats.documents += 1
+                self._stats.bytes += size
+            if held is None:
+                continue
+            etag, last_modified = validators.get("etag"), validators.get("last-modified")
+            if validators.get("not_modified"):
+                self.manifest.not_modified(source.document_id)
+                unchanged = True
+            else:
+                unchanged = not self.manifest.admit(source.document_id, digest.hexdigest(), etag, last_modified)
+            if unchanged:
+                with self._lock:
+                    self._stats.skipped += 1
+                continue
+            state = (digest.hexdigest(), etag, last_modified)
+            self._replace_local(source.document_id)
+            if not held:
+                self.manifest.record(source.document_id, state[0], 0, etag, last_modified)
+                continue
+            with self._lock:
+                self._documents[source.document_id] = [len(held), False, state, len(held)]
+            for chunk in held:
+                self._put(chunks, chunk)
+
+    def _read(self, http, source, validators):
+        """
+        Yield the text of `source` in pieces. URL responses leave their ETag and Last-Modified in `validators`,
+        and a 304 to the manifest's conditional request sets validators["not_modified"] and yields nothing.
+        """
+        if source.text is not None:
+            yield source.text
+            return
+        location = source.location
+        if location.startswith(("http://", "https://")):
+            headers = self.manifest.conditional_headers(source.document_id) if self.manifest is not None else {}
+            with http.stream("GET", location, headers=headers) as response:
+                if response.status_code == 304:
+                    validators["not_modified"] = True
+                    return
+                response.raise_for_status()
+                validators.update({name: response.headers[name] for name in ("etag", "last-modified")
+                                   if name in response.headers})
+                yield from response.iter_text(READ_SIZE)
+            return
+        path = location[len("file://"):] if location.startswith("file://") else location
+        with open(os.path.expanduser(path), encoding="utf-8", errors="replace") as f:
+            while piece := f.read(READ_SIZE):
+                yield piece
+
+    def _chunk(self, source, text, index):
+        metadata = {**source.metadata, "document_id": source.document_id, "chunk_index": index,
+                    "token_count": estimate_tokens(text)}
+        return {"content": text, "metadata": metadata}
+
+    def _put(self, chunks, chunk):
+        chunks.put(chunk)  # Blocks while the inserters are behind
+        with self._lock:
+            self._stats.max_queue_depth = max(self._stats.max_queue_depth, chunks.qsize())
+
+    def _insert(self, chunks):
+        stopping = False
+        while not stopping:
+            item = chunks.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            while len(batch) < self.batch_size:
+                try:
+                    item = chunks.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            # Nothing below may end this loop: fetchers would block forever on a full queue with no inserter left
+            ids = ", ".join(sorted({chunk["metadata"]["document_id"] for chunk in batch}))
+            try:
+                self.insert(batch)
+                error = None
+            except Exception as e:
+                error = f"Insert failed: {type(e).__name__}: {e}"
+            with self._lock:
+                if error is None:
+                    self._stats.chunks += len(batch)
+                    self._stats.batches += 1
+                else:
+                    self._stats.failed_chunks += len(batch)
+                    self._stats.errors.append((ids, error))
+            try:
+                self._inserted(batch, failed=error is not None)
+            except Exception as e:
+                with self._lock:
+                    self._stats.errors.append((ids, f"Recording inserted chunks failed: {type(e).__name__}: {e}"))
+
+    def _inserted(self, batch, failed=False):
+        """Record documents in the manifest once their last chunk is in; a failed batch leaves them for the next run."""
+        if self.manifest is None:
+            return
+        finished = []
+        with self._lock:
+            for chunk in batch:
+                document_id = chunk["metadata"]["document_id"]
+                state = self._documents[document_id]
+                state[0] -= 1
+                state[1] = state[1] or failed
+                if state[0] == 0:
+                    del self._documents[document_id]
+                    if not state[1]:
+                        finished.append((document_id, state[3], state[2]))
+        for document_id, count, (digest, etag, last_modified) in finished:
+            # One document failing to record must not stop the others finished by this batch
+            try:
+                self.manifest.record(document_id, digest, count, etag, last_modified)
+            except Exception as e:
+                with self._lock:
+                    self._stats.errors.append((document_id, f"Recording inserted chunks failed: {type(e).__name__}: {e}"))
+
+    def _replace_local(self, document_id):
+        """Drop a document's old chunks from the local index before its new ones are inserted."""
+        if self.local_index is not None:
+            self.local_index.remove_documents([document_id])
+
+    def insert(self, batch):
+        """Send one batch of chunks; the server computes their embeddings unless the embedding cache supplies them."""
+        vectors = None
+        texts = [chunk["content"] for chunk in batch]
+        if self.embedding_cache is not None:
+            vectors = self.embedding_cache.embed(self.embedding_model, texts, embedder(self.client, self.embedding_model))
+        elif self.local_index is not None:
+            vectors = embedder(self.client, self.embedding_model)(texts)
+        if vectors is not None:
+            batch = [{**chunk, "embedding": [float(value) for value in vector]} for chunk, vector in zip(batch, vectors)]
+        self.client.vector_io.insert(vector_db_id=self.vector_db_id, chunks=batch)
+        if self.local_index is not None:
+            self.local_index.add(vectors, [{"content": chunk["content"], "metadata": chunk["metadata"]} for chunk in batch])
+
+    def _report(self, done, started):
+        while not done.wait(self.progress_interval):
+            with self._lock:
+                self._stats.elapsed = time.perf_counter() - started
+            self.progress(self.stats())
+
+    def stats(self):
+        with self._lock:
+            return IngestStats(**{**self._stats.__dict__, "errors": list(self._stats.errors)})
+
+
+def benchmark(documents=200, size=20_000, latency=0.01, fetch_workers=8, batch_size=64):
+    """
+    Ingest `documents` files of `size` characters from the stand-in file server (`latency` s per request):
+    one rag_tool.insert-style pass that fetches, chunks and inserts each document in turn, then RAGIngestor.
+    """
+    from llama_stack_client import LlamaStackClient
+    import stand_in_server
+
+    words = " ".join(f"word{i}" for i in range(size // 6))
+    files = {f"docs/{i}.md": f"Document {i}. {words}"[:size] for i in range(documents)}
+    with stand_in_server.StandInServer(latency=latency, files=files) as server:
+        client = LlamaStackClient(base_url=server.base_url)
+        client.vector_dbs.register(vector_db_id="bench", embedding_model="all-MiniLM-L6-v2", embedding_dimension=384)
+        sources = [Source(path, location=server.file_url(path)) for path in files]
+
+        serial = RAGIngestor(client, "bench", batch_size=10_000, fetch_workers=1, insert_workers=1, progress=None)
+        start = time.perf_counter()
+        for source in sources:
+            serial.run([source])
+        serial_elapsed = time.perf_counter() - start
+
+        ingestor = RAGIngestor(client, "bench", batch_size=batch_size, fetch_workers=fetch_workers, progress=None)
+        stats = ingestor.run(iter(sources))
+    print(f"one document at a time: {documents / serial_elapsed:.1f} docs/s")
+    print(f"pipelined:              {stats}")
+    return serial_elapsed, stats
+
+
+if __name__ == "__main__":
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    benchmark()
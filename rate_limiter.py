@@ -0,0 +1,398 @@
+"""
+rate_limiter.py
+---------------
+A process-wide request scheduler in front of every client made by client_pool.get_client, so that
+22-style fan-outs and 17/18-style evaluation loops running in one process share the provider's limits
+instead of colliding on 429s.
+Each model request (chat completions, agent turns, ...) is charged to token buckets for its provider and
+model, tracking both requests/min and (estimated) tokens/min; limits come from LLAMA_STACK_RATE_LIMITS, e.g.
+"together=600/200000,llama3.2:1b=60/" (requests per minute / tokens per minute, either may be left empty).
+Requests waiting for a bucket are served by priority lane, so interactive chat goes ahead of batch work
+started under `with lane("batch"):`. A 429 response pauses the provider's bucket for the Retry-After
+period (or a short jittered backoff), so every queued request for that provider waits it out; retrying the
+refused request is left to the client's own `max_retries`, whose retry is scheduled like any other request.
+`metrics()` and `prometheus()` report queue waits, queue depths, 429s and pause time per lane.
+Run this file directly to benchmark a rate-limited stand-in server with and without the scheduler.
+"""
+
+import contextlib  # For the lane() context manager
+import contextvars  # For the current priority lane
+import email.utils  # For HTTP-date Retry-After values
+import heapq  # For priority-ordered waiters
+import itertools  # For waiter sequence numbers
+import json  # For reading request and response bodies
+import logging  # For silencing per-request logs during the benchmark
+import os  # For environment variable access
+import re  # For agent turn paths
+import threading  # For the scheduler condition variable
+import time  # For bucket refills and waits
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Optional
+
+from context_window import estimate_tokens  # Token estimate for tokens/min budgets
+from shared_utils import backoff_delays, percentile  # Jittered exponential backoff and nearest-rank percentile
+
+RATE_LIMITS_ENV = "LLAMA_STACK_RATE_LIMITS"
+# Priority lanes, highest first
+LANES = ("interactive", "batch")
+# Tokens reserved for the reply when a request does not set max_tokens
+DEFAULT_COMPLETION_TOKENS = 256
+# Seconds of traffic a full bucket may send at once; providers meter per minute
+DEFAULT_BURST_SECONDS = 60.0
+# Longest pause a single 429 can put on a provider
+MAX_PAUSE = 60.0
+
+AGENT_TURN_PATH = re.compile(r"^/v1/agents/([^/]+)/session/[^/]+/turn$")
+
+_lane = contextvars.ContextVar("llama_stack_lane", default=LANES[0])
+
+
+@contextlib.contextmanager
+def lane(name):
+    """Send the requests made inside the block (on this thread or task) in priority lane `name`."""
+    if name not in LANES:
+        raise ValueError(f"Unknown lane '{name}'; expected one of {', '.join(LANES)}")
+    token = _lane.set(name)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+@dataclass
+class Limit:
+    rpm: Optional[float] = None  # Requests per minute; None is unlimited
+    tpm: Optional[float] = None  # Tokens per minute; None is unlimited
+
+
+def parse_limits(spec):
+    """Parse "key=rpm/tpm,..." (keys are provider or model ids) into {key: Limit}."""
+    limits = {}
+    for entry in filter(None, (part.strip() for part in (spec or "").split(","))):
+        key, _, value = entry.rpartition("=")
+        if not key:
+            raise ValueError(f"Rate limit '{entry}' is not of the form key=rpm/tpm")
+        rpm, _, tpm = value.partition("/")
+        limits[key.strip()] = Limit(float(rpm) if rpm.strip() else None, float(tpm) if tpm.strip() else None)
+    return limits
+
+
+def retry_after(headers):
+    """Seconds to wait according to Retry-After (seconds or an HTTP date) or retry-after-ms, or None."""
+    milliseconds = headers.get("retry-after-ms")
+    if milliseconds:
+        with contextlib.suppress(ValueError):
+            return max(float(milliseconds) / 1000, 0.0)
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class TokenBucket:
+    """Continuously refilled request and token allowances for one Limit, plus a pause set by 429s."""
+
+    def __init__(self, limit, burst_seconds=DEFAULT_BURST_SECONDS, clock=time.monotonic):
+        self.limit = limit
+        self.clock = clock
+        self.request_capacity = max(limit.rpm * burst_seconds / 60, 1.0) if limit.rpm else None
+        self.token_capacity = max(limit.tpm * burst_seconds / 60, 1.0) if limit.tpm else None
+        self.requests = self.request_capacity
+        self.tokens = self.token_capacity
+        self.paused_until = 0.0
+        self.updated = clock()
+
+    def _refill(self, now):
+        elapsed, self.updated = now - self.updated, now
+        if self.request_capacity:
+            self.requests = min(self.request_capacity, self.requests + elapsed * self.limit.rpm / 60)
+        if self.token_capacity:
+            self.tokens = min(self.token_capacity, self.tokens + elapsed * self.limit.tpm / 60)
+
+    def delay(self, tokens):
+        """Seconds until a request of `tokens` tokens fits, 0 if it fits now."""
+        now = self.clock()
+        self._refill(now)
+        wait = max(self.paused_until - now, 0.0)
+        if self.request_capacity and self.requests < 1:
+            wait = max(wait, (1 - self.requests) * 60 / self.limit.rpm)
+        if self.token_capacity:
+            # A request larger than the whole bucket waits for a full bucket rather than forever
+            needed = min(tokens, self.token_capacity)
+            if self.tokens < needed:
+                wait = max(wait, (needed - self.tokens) * 60 / self.limit.tpm)
+        return wait
+
+    def take(self, tokens):
+        if self.request_capacity:
+            self.requests -= 1
+        if self.token_capacity:
+            self.tokens -= min(tokens, self.token_capacity)
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, self.clock() + seconds)
+
+
+@dataclass
+class LaneMetrics:
+    requests: int = 0
+    throttled: int = 0  # 429 responses received
+    paused: float = 0.0  # Seconds of provider pauses set by those 429s
+    queued: int = 0  # Waiting for a bucket right now
+    max_queued: int = 0
+    wait_total: float = 0.0
+    waits: deque = field(default_factory=lambda: deque(maxlen=4096))  # Recent queue waits in seconds
+
+    def wait(self, p):
+        return percentile(list(self.waits), p)
+
+    def copy(self):
+        return LaneMetrics(self.requests, self.throttled, self.paused, self.queued, self.max_queued,
+                           self.wait_total, deque(self.waits, maxlen=self.waits.maxlen))
+
+    def __str__(self):
+        return (f"{self.requests} requests, queue wait p50 {self.wait(50) * 1000:.1f} ms / "
+                f"p95 {self.wait(95) * 1000:.1f} ms, {self.queued} queued now / {self.max_queued} max, "
+                f"{self.throttled} throttled, {self.paused:.2f}s paused")
+
+
+class RequestScheduler:
+    """
+    `send(request, send_fn)` schedules one httpx request: it waits for the buckets of the request's
+    provider and model, in lane priority order, then calls `send_fn(request)`; a 429 pauses the provider.
+    `limits` maps provider or model ids to Limits. `providers` maps model ids to provider ids; models listed
+    by the server (GET /v1/models through a scheduled client) are added automatically, and agent turns are
+    charged to the model their agent was created with.
+    """
+
+    def __init__(self, limits=None, providers=None, burst_seconds=DEFAULT_BURST_SECONDS, clock=time.monotonic):
+        self.limits = dict(limits or {})
+        self.providers = dict(providers or {})
+        self.burst_seconds = burst_seconds
+        self.clock = clock
+        self._agents: dict = {}  # agent id -> model id
+        self._buckets: dict = {}  # provider or model id -> TokenBucket
+        self._waiting: dict = {}  # provider -> heap of (lane rank, sequence), one queue per shared provider bucket
+        self._sequence = itertools.count()
+        self._metrics = {name: LaneMetrics() for name in LANES}
+        self._cond = threading.Condition()
+
+    def classify(self, request):
+        """(provider, model, estimated tokens) for an httpx request; model is None for non-model requests."""
+        try:
+            body = json.loads(request.content or b"{}")
+        except (ValueError, UnicodeDecodeError, AttributeError):
+            body = {}
+        if not isinstance(body, dict):
+            body = {}
+        model = body.get("model_id") or body.get("model")
+        turn = AGENT_TURN_PATH.match(request.url.path)
+        if turn:
+            model = self._agents.get(turn.group(1), model)
+        if not model:
+            return None, None, 0
+        prompt = body.get("messages") or body.get("contents") or body.get("content") or ""
+        sampling = body.get("sampling_params") or {}
+        completion = sampling.get("max_tokens") or body.get("max_tokens") or DEFAULT_COMPLETION_TOKENS
+        return self.providers.get(model, model), model, estimate_tokens(json.dumps(prompt)) + completion
+
+    def _buckets_for(self, provider, model):
+        # The provider bucket always exists so that a 429 pauses everything sent to that provider
+        keys = [provider] + ([model] if model != provider and model in self.limits else [])
+        buckets = []
+        for key in keys:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.limits.get(key, Limit()), self.burst_seconds, self.clock)
+            buckets.append(bucket)
+        return buckets
+
+    def acquire(self, provider, model, tokens, lane_name=None):
+        """Block until the request fits its buckets and it is the highest-priority waiter; return the wait."""
+        lane_name = lane_name or _lane.get()
+        metrics = self._metrics[lane_name]
+        started = self.clock()
+        with self._cond:
+            metrics.requests += 1
+            if model is None:
+                return 0.0
+            buckets = self._buckets_for(provider, model)
+            # Queued per provider, not per model: every model of a provider draws from the same provider bucket,
+            # so an interactive request for one model must also go ahead of batch requests for another
+            waiting = self._waiting.setdefault(provider, [])
+            ticket = (LANES.index(lane_name), next(self._sequence))
+            heapq.heappush(waiting, ticket)
+            metrics.queued += 1
+            metrics.max_queued = max(metrics.max_queued, metrics.queued)
+            while True:
+                if waiting[0] == ticket:
+                    delay = max(bucket.delay(tokens) for bucket in buckets)
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                else:
+                    self._cond.wait()
+            heapq.heappop(waiting)
+            for bucket in buckets:
+                bucket.take(tokens)
+            metrics.queued -= 1
+            waited = self.clock() - started
+            metrics.waits.append(waited)
+            metrics.wait_total += waited
+            # The next waiter in line may fit now
+            self._cond.notify_all()
+        return waited
+
+    def send(self, request, send_fn):
+        provider, model, tokens = self.classify(request)
+        lane_name = _lane.get()
+        self.acquire(provider, model, tokens, lane_name)
+        response = send_fn(request)
+        if response.status_code != 429:
+            self._learn(request, response)
+            return response
+        # The client retries the 429 itself (LlamaStackClient's max_retries) and the retry comes back through
+        # acquire(); retrying here as well would multiply the attempts. Pausing the provider's bucket makes
+        # the retry and every other queued request for that provider wait out the limit.
+        delay = min(retry_after(response.headers) or next(backoff_delays(initial=0.5)), MAX_PAUSE)
+        with self._cond:
+            metrics = self._metrics[lane_name]
+            metrics.throttled += 1
+            if model is not None:
+                self._buckets_for(provider, model)[0].pause(delay)
+                metrics.paused += delay
+                self._cond.notify_all()
+        return response
+
+    def _learn(self, request, response):
+        """Pick up model -> provider and agent -> model mappings from registry and agent responses."""
+        path = request.url.path
+        if response.status_code != 200 or not (path == "/v1/models" and request.method == "GET"
+                                               or path == "/v1/agents" and request.method == "POST"):
+            return
+        try:
+            payload = json.loads(response.read())
+        except ValueError:
+            return
+        with self._cond:
+            if path == "/v1/models":
+                for model in payload.get("data", []):
+                    self.providers.setdefault(model.get("identifier"), model.get("provider_id"))
+            else:
+                config = json.loads(request.content or b"{}").get("agent_config", {})
+                if payload.get("agent_id") and config.get("model"):
+                    self._agents[payload["agent_id"]] = config["model"]
+
+    def metrics(self):
+        """Per-lane LaneMetrics snapshots."""
+        with self._cond:
+            return {name: metrics.copy() for name, metrics in self._metrics.items()}
+
+    def prometheus(self):
+        """The metrics in Prometheus text exposition format."""
+        lines = [
+            "# HELP llama_stack_queue_wait_seconds Time requests waited for a rate-limit bucket.",
+            "# TYPE llama_stack_queue_wait_seconds summary",
+        ]
+        snapshot = self.metrics()
+        for name, metrics in snapshot.items():
+            for quantile in (0.5, 0.95, 0.99):
+                lines.append(f'llama_stack_queue_wait_seconds{{lane="{name}",quantile="{quantile}"}} '
+                             f"{metrics.wait(quantile * 100):.6f}")
+            lines.append(f'llama_stack_queue_wait_seconds_sum{{lane="{name}"}} {metrics.wait_total:.6f}')
+            lines.append(f'llama_stack_queue_wait_seconds_count{{lane="{name}"}} {metrics.requests}')
+        for metric, kind, help_text, attribute in (
+            ("llama_stack_queue_depth", "gauge", "Requests waiting for a rate-limit bucket.", "queued"),
+            ("llama_stack_throttled_total", "counter", "429 responses received.", "throttled"),
+            ("llama_stack_paused_seconds_total", "counter", "Seconds providers were paused after a 429.", "paused"),
+        ):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+            lines += [f'{metric}{{lane="{name}"}} {getattr(metrics, attribute)}' for name, metrics in snapshot.items()]
+        return "\n".join(lines) + "\n"
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """The process-wide scheduler, created on first use with limits from LLAMA_STACK_RATE_LIMITS."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler(parse_limits(os.environ.get(RATE_LIMITS_ENV, "")))
+        return _scheduler
+
+
+def set_scheduler(scheduler):
+    """Replace the process-wide scheduler used by clients created afterwards."""
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = scheduler
+
+
+def benchmark(batch_requests=60, interactive_requests=10, rate=40.0, workers=8):
+    """
+    Run a batch fan-out of `batch_requests` chat completions on `workers` threads alongside a trickle of
+    interactive ones against a stand-in server that allows `rate` requests/s, first with the client's own
+    429 retries only and then through a RequestScheduler limited to just under that rate (the client still
+    retries, but its retries wait in the scheduler's queue).
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from client_pool import build_http_client
+    from llama_stack_client import LlamaStackClient, RateLimitError
+    import stand_in_server
+
+    failures = []
+
+    def run(client):
+        def chat(lane_name):
+            with lane(lane_name):
+                start = time.perf_counter()
+                try:
+                    client.inference.chat_completion(model_id="m", messages=[{"role": "user", "content": "Hello"}])
+                except RateLimitError:
+                    failures.append(lane_name)
+                return time.perf_counter() - start
+
+        with ThreadPoolExecutor(workers) as pool:
+            batch = [pool.submit(chat, "batch") for _ in range(batch_requests)]
+            interactive = []
+            for _ in range(interactive_requests):
+                time.sleep(batch_requests / rate / interactive_requests / 2)
+                interactive.append(chat("interactive"))
+            batch = [future.result() for future in batch]
+        return interactive, batch
+
+    results = {}
+    for name in ("unscheduled", "scheduled"):
+        failures.clear()
+        scheduler = RequestScheduler({"m": Limit(rpm=rate * 60 * 0.95)}, burst_seconds=0) if name == "scheduled" else None
+        with stand_in_server.StandInServer(rate_limit=rate) as server:
+            client = LlamaStackClient(base_url=server.base_url,
+                                      http_client=build_http_client(workers + 1, False, scheduler=scheduler))
+            interactive, batch = run(client)
+            results[name] = (interactive, batch, server.throttled, len(failures))
+        print(f"{name:>11}: interactive p50 {percentile(interactive, 50) * 1000:.0f} ms / "
+              f"p95 {percentile(interactive, 95) * 1000:.0f} ms, batch p95 {percentile(batch, 95) * 1000:.0f} ms, "
+              f"{server.throttled} requests refused with 429, {len(failures)} failed after the client's retries")
+        if scheduler is not None:
+            for lane_name, metrics in scheduler.metrics().items():
+                print(f"{lane_name:>24}: {metrics}")
+    return results
+
+
+if __name__ == "__main__":
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("llama_stack_client").setLevel(logging.WARNING)
+    benchmark()
@@ -0,0 +1,156 @@
+"""
+registry_cache.py
+-----------------
+TTL-cached lookups of the server's registries: models, tools, shields and vector DBs.
+Each list is fetched once, indexed by identifier (and by model_type / toolgroup_id) for O(1) lookups,
+and saved to a JSON file so that later processes start without the round trip while the entry is fresh.
+Call `invalidate()` after anything that changes server state, such as `client.shields.register`
+or `client.vector_dbs.register`.
+"""
+
+import json  # For the on-disk cache file
+import os  # For paths and atomic replacement
+import tempfile  # For atomic writes
+import threading  # For guarding the in-memory indexes
+import time  # For TTL bookkeeping
+from collections import defaultdict
+
+from llama_stack_client.types import Model, Shield, Tool  # Registry item models
+from llama_stack_client.types.vector_db_list_response import VectorDBListResponseItem  # Vector DB item model
+
+DEFAULT_PATH = os.environ.get(
+    "LLAMA_STACK_REGISTRY_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "llama-stack-examples", "registry.json"),
+)
+DEFAULT_TTL = 15 * 60
+
+# kind -> (list call on the client, item model, secondary index field)
+KINDS = {
+    "models": (lambda client: client.models.list(), Model, "model_type"),
+    "tools": (lambda client: client.tools.list(), Tool, "toolgroup_id"),
+    "shields": (lambda client: client.shields.list(), Shield, None),
+    "vector_dbs": (lambda client: client.vector_dbs.list(), VectorDBListResponseItem, None),
+}
+
+
+class _Index:
+    """One fetched registry list plus its lookup tables."""
+
+    def __init__(self, items, fetched_at, group_field):
+        self.items = items
+        self.fetched_at = fetched_at
+        self.by_id = {item.identifier: item for item in items}
+        self.by_group = defaultdict(list)
+        if group_field:
+            for item in items:
+                self.by_group[getattr(item, group_field, None)].append(item)
+
+
+class RegistryCache:
+    """
+    Cached view of a client's registries.
+    `namespace` separates entries for different servers in the shared cache file (defaults to the client's base URL);
+    `path=None` keeps the cache in memory only.
+    """
+
+    def __init__(self, client, path=DEFAULT_PATH, ttl=DEFAULT_TTL, namespace=None):
+        self.client = client
+        self.path = path
+        self.ttl = ttl
+        self.namespace = namespace or str(getattr(client, "base_url", "default")).rstrip("/")
+        self.fetches = 0
+        self._indexes: dict = {}
+        self._lock = threading.Lock()
+
+    # --- lookups ---
+
+    def models(self):
+        return self._index("models").items
+
+    def model(self, identifier):
+        return self._index("models").by_id.get(identifier)
+
+    def models_by_type(self, model_type):
+        return self._index("models").by_group.get(model_type, [])
+
+    def embedding_dimension(self, identifier):
+        model = self.model(identifier)
+        dimension = model.metadata.get("embedding_dimension") if model is not None else None
+        return int(dimension) if dimension is not None else None
+
+    def tools(self):
+        return self._index("tools").items
+
+    def tool(self, identifier):
+        return self._index("tools").by_id.get(identifier)
+
+    def tools_by_group(self, toolgroup_id):
+        return self._index("tools").by_group.get(toolgroup_id, [])
+
+    def shields(self):
+        return self._index("shields").items
+
+    def shield(self, identifier):
+        return self._index("shields").by_id.get(identifier)
+
+    def vector_dbs(self):
+        return self._index("vector_dbs").items
+
+    def vector_db(self, identifier):
+        return self._index("vector_dbs").by_id.get(identifier)
+
+    # --- cache management ---
+
+    def invalidate(self, *kinds):
+        """Forget the given kinds (all kinds when none are given), in memory and on disk."""
+        kinds = kinds or tuple(KINDS)
+        with self._lock:
+            for kind in kinds:
+                self._indexes.pop(kind, None)
+            if self.path:
+                stored = self._load_file()
+                entry = stored.get(self.namespace, {})
+                for kind in kinds:
+                    entry.pop(kind, None)
+                self._save_file(stored)
+
+    def _index(self, kind):
+        now = time.time()
+        with self._lock:
+            index = self._indexes.get(kind)
+            if index is not None and now - index.fetched_at <= self.ttl:
+                return index
+            list_call, item_model, group_field = KINDS[kind]
+            stored = self._load_file() if self.path else {}
+            entry = stored.get(self.namespace, {}).get(kind)
+            if entry is not None and now - entry["fetched_at"] <= self.ttl:
+                items = [item_model.construct(**raw) for raw in entry["items"]]
+                fetched_at = entry["fetched_at"]
+            else:
+                items = list(list_call(self.client))
+                fetched_at = now
+                self.fetches += 1
+                if self.path:
+                    stored.setdefault(self.namespace, {})[kind] = {
+                        "fetched_at": fetched_at,
+                        "items": [item.to_dict() for item in items],
+                    }
+                    self._save_file(stored)
+            index = self._indexes[kind] = _Index(items, fetched_at, group_field)
+            return index
+
+    def _load_file(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_file(self, stored):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temp file and rename so concurrent readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(stored, f)
+        os.replace(tmp_path, self.path)
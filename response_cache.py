@@ -0,0 +1,255 @@
+"""
+response_cache.py
+-----------------
+Opt-in two-tier cache for `client.inference.chat_completion` responses.
+Requests are keyed on a canonical hash of model_id, messages, sampling_params and response_format
+(plus any tool settings); the first tier is an in-memory LRU, the second a SQLite file with TTL and
+size-based eviction, so identical requests across runs and regression jobs are answered locally.
+Streaming requests are served from the same entries and replayed as synthetic stream chunks,
+so `InferenceEventLogger` works unchanged on cached responses.
+"""
+
+import hashlib  # For canonical request hashes
+import json  # For canonical encoding and storage
+import os  # For environment variable access
+import re  # For splitting cached text into replay chunks
+import sqlite3  # For the persistent tier
+import threading  # For guarding both tiers
+import time  # For TTL bookkeeping
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from llama_stack_client import NOT_GIVEN  # Sentinel for omitted request parameters
+from llama_stack_client.types import ChatCompletionResponseStreamChunk  # Stream chunk model
+from llama_stack_client.types.shared import ChatCompletionResponse  # Non-streaming response model
+
+# Setting this to a file path turns the cache on in the example scripts
+CACHE_PATH_ENV = "LLAMA_STACK_RESPONSE_CACHE"
+DEFAULT_MEMORY_ENTRIES = 256
+DEFAULT_TTL = 7 * 24 * 3600
+DEFAULT_MAX_BYTES = 64 * 2**20
+
+
+def plain(value):
+    """Turn request parameters (pydantic models, tuples, NOT_GIVEN) into plain JSON-able data."""
+    if value is NOT_GIVEN:
+        return None
+    if hasattr(value, "model_dump"):
+        return plain(value.model_dump(exclude_none=True))
+    if isinstance(value, dict):
+        return {k: plain(v) for k, v in value.items() if v is not NOT_GIVEN}
+    if isinstance(value, (list, tuple)):
+        return [plain(v) for v in value]
+    return value
+
+
+def cache_key(model_id, messages, sampling_params=None, response_format=None, **params):
+    """
+    Canonical hash of a chat_completion request. Key order, tuples vs lists and omitted parameters
+    do not change the hash; `stream` is ignored so streaming and non-streaming calls share entries.
+    """
+    params.pop("stream", None)
+    request = {
+        "model_id": model_id,
+        "messages": plain(messages),
+        "sampling_params": plain(sampling_params),
+        "response_format": plain(response_format),
+        **{k: plain(v) for k, v in params.items() if v is not NOT_GIVEN and v is not None},
+    }
+    encoded = json.dumps(request, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+@dataclass
+class CacheStats:
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hits(self):
+        return self.memory_hits + self.disk_hits
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class ResponseCache:
+    """
+    In-memory LRU in front of an optional SQLite tier.
+    `memory_entries` bounds the LRU; `ttl` (seconds) and `max_bytes` bound the SQLite file.
+    Entries are JSON-encoded ChatCompletionResponse dicts.
+    """
+
+    def __init__(self, path=None, memory_entries=DEFAULT_MEMORY_ENTRIES, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.memory_entries = memory_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        self._memory: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            self._db.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created, value = entry
+                if now - created <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.stats.memory_hits += 1
+                    return value
+                del self._memory[key]
+                self.stats.evictions += 1
+            if self._db is not None:
+                row = self._db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value, created = json.loads(row[0]), row[1]
+                    if now - created <= self.ttl:
+                        self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                        self._db.commit()
+                        self._remember(key, created, value)
+                        self.stats.disk_hits += 1
+                        return value
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+                    self.stats.evictions += 1
+            self.stats.misses += 1
+            return None
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, value)
+            if self._db is not None:
+                encoded = json.dumps(value)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                    (key, encoded, len(encoded), now, now),
+                )
+                self._evict_disk(now)
+                self._db.commit()
+
+    def _remember(self, key, created, value):
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self.stats.evictions += 1
+
+    def _evict_disk(self, now):
+        expired = self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,)).rowcount
+        self.stats.evictions += max(expired, 0)
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop least recently used entries until the file is back under budget
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.stats.evictions += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def replay_stream(response):
+    """Yield synthetic ChatCompletionResponseStreamChunks (start, word-sized progress, complete) for a cached response."""
+    message = response["completion_message"]
+    content = message.get("content") or ""
+    yield ChatCompletionResponseStreamChunk.construct(event={"event_type": "start", "delta": {"type": "text", "text": ""}})
+    for piece in re.findall(r"\S+\s*|\s+", content if isinstance(content, str) else ""):
+        yield ChatCompletionResponseStreamChunk.construct(event={"event_type": "progress", "delta": {"type": "text", "text": piece}})
+    yield ChatCompletionResponseStreamChunk.construct(event={
+        "event_type": "complete",
+        "delta": {"type": "text", "text": ""},
+        "stop_reason": message.get("stop_reason", "end_of_turn"),
+    })
+
+
+class CachedInference:
+    """
+    Stand-in for `client.inference` that answers chat_completion from a ResponseCache.
+    Every other attribute is delegated to the wrapped inference resource.
+    """
+
+    def __init__(self, inference, cache):
+        self._inference = inference
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self._inference, name)
+
+    def chat_completion(self, *, model_id, messages, stream=False, **params):
+        key = cache_key(model_id, messages, **params)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return replay_stream(cached) if stream else ChatCompletionResponse.construct(**cached)
+        if not stream:
+            response = self._inference.chat_completion(model_id=model_id, messages=messages, **params)
+            self.cache.put(key, response.to_dict())
+            return response
+        return self._record_stream(key, self._inference.chat_completion(
+            model_id=model_id, messages=messages, stream=True, **params))
+
+    def _record_stream(self, key, chunks):
+        """Pass live chunks through and cache the assembled reply once the stream completes with plain text."""
+        pieces = []
+        text_only = True
+        stop_reason = None
+        for chunk in chunks:
+            event = chunk.event
+            if event.delta.type == "text":
+                pieces.append(event.delta.text)
+            else:
+                text_only = False
+            if event.event_type == "complete":
+                stop_reason = event.stop_reason
+            yield chunk
+        if text_only and stop_reason is not None:
+            self.cache.put(key, {"completion_message": {
+                "role": "assistant", "content": "".join(pieces), "stop_reason": stop_reason, "tool_calls": [],
+            }})
+
+
+def enable_response_cache(client, cache=None):
+    """
+    Route `client.inference.chat_completion` through a ResponseCache and return the client.
+    Without an explicit `cache` this is a no-op unless LLAMA_STACK_RESPONSE_CACHE names a SQLite file,
+    so scripts can call it unconditionally. Clients from client_pool are shared, so the cache applies
+    to every caller of that client.
+    """
+    if cache is None:
+        path = os.environ.get(CACHE_PATH_ENV)
+        if not path:
+            return client
+        cache = ResponseCache(path)
+    if isinstance(client.inference, CachedInference):
+        client.inference.cache = cache
+    else:
+        client.inference = CachedInference(client.inference, cache)
+    return client
@@ -0,0 +1,238 @@
+"""
+server_readiness.py
+-------------------
+Readiness checks for a Llama Stack server started in the background (see 04-llama-stack-full-app.py).
+Polls the health endpoint with exponential backoff and jitter, wakes up early when the server log
+prints its "ready" line, fails fast when the server process exits, and reports time-to-ready.
+`prewarm()` sends a one-token chat request to each model so the first real request is not a cold one.
+Run this file directly to compare time-to-ready against the original fixed one-second poll.
+"""
+
+import logging  # For silencing per-request logs during the benchmark
+import os  # For benchmark log paths
+import random  # For simulated startup delays in the benchmark
+import re  # For matching the ready line
+import socket  # For picking a free port in the benchmark
+import statistics  # For benchmark percentiles
+import tempfile  # For benchmark log files
+import threading  # For the log watcher
+import time  # For timing and backoff
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional
+
+import requests  # For health checks
+
+from shared_utils import backoff_delays  # Jittered exponential backoff between health checks
+
+# Lines uvicorn prints once the Llama Stack server is accepting requests
+READY_PATTERN = re.compile(r"Uvicorn running on|Application startup complete")
+
+
+class LogWatcher:
+    """
+    Tails a log file in a daemon thread and sets `ready` when a line matches `pattern`.
+    The file may not exist yet when the watcher starts.
+    """
+
+    def __init__(self, path, pattern=READY_PATTERN, poll_interval=0.02):
+        self.path = path
+        self.pattern = re.compile(pattern) if isinstance(pattern, str) else pattern
+        self.poll_interval = poll_interval
+        self.ready = threading.Event()
+        self.ready_at: Optional[float] = None
+        self.line: Optional[str] = None
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _run(self):
+        position = 0
+        partial = ""
+        while not self._stopped.is_set():
+            try:
+                with open(self.path) as f:
+                    f.seek(position)
+                    chunk = f.read()
+                    position = f.tell()
+            except OSError:
+                chunk = ""
+            lines = (partial + chunk).split("\n")
+            partial = lines.pop()
+            for line in lines:
+                if self.pattern.search(line):
+                    self.ready_at = time.monotonic()
+                    self.line = line
+                    self.ready.set()
+                    return
+            self._stopped.wait(self.poll_interval)
+
+
+@dataclass
+class ReadinessReport:
+    ready: bool
+    time_to_ready: float
+    attempts: int
+    reason: str = ""
+    log_line: Optional[str] = None
+    prewarm: dict = field(default_factory=dict)
+
+    def __str__(self):
+        if not self.ready:
+            return f"Server not ready after {self.time_to_ready:.2f}s ({self.attempts} health checks): {self.reason}"
+        text = f"Server ready in {self.time_to_ready:.2f}s ({self.attempts} health checks)"
+        for model_id, outcome in self.prewarm.items():
+            if isinstance(outcome, Exception):
+                text += f"\n  pre-warming {model_id} failed: {outcome}"
+            else:
+                text += f"\n  pre-warmed {model_id} in {outcome:.2f}s"
+        return text
+
+
+def wait_until_ready(health_url, timeout=60.0, log_path=None, process=None, started_at=None,
+                     delays=None, probe_timeout=2.0):
+    """
+    Block until `health_url` answers 200, and return a ReadinessReport.
+    Between probes it sleeps for the next backoff delay, cut short as soon as `log_path` shows the ready line.
+    Any non-200 answer is treated like a refused connection, so nothing spins.
+    Gives up after `timeout` seconds, or straight away if `process` (a Popen) has exited.
+    `started_at` (a time.monotonic() value, e.g. taken just before launching the server) is the zero
+    point for time_to_ready; it defaults to now.
+    """
+    started_at = time.monotonic() if started_at is None else started_at
+    deadline = time.monotonic() + timeout
+    delays = delays or backoff_delays()
+    watcher = LogWatcher(log_path).start() if log_path else None
+    attempts = 0
+    reason = "timed out"
+    try:
+        with requests.Session() as session:
+            while True:
+                attempts += 1
+                try:
+                    if session.get(health_url, timeout=probe_timeout).status_code == 200:
+                        return ReadinessReport(True, time.monotonic() - started_at, attempts,
+                                               log_line=watcher.line if watcher else None)
+                except requests.RequestException:
+                    pass
+                if process is not None and process.poll() is not None:
+                    reason = f"server process exited with code {process.returncode}"
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                delay = min(next(delays), remaining)
+                if watcher is not None and not watcher.ready.is_set():
+                    # Sleep on the log instead of the clock: the ready line ends the wait early,
+                    # and the backoff restarts from its shortest delay
+                    if watcher.ready.wait(delay):
+                        delays = backoff_delays()
+                else:
+                    time.sleep(delay)
+    finally:
+        if watcher is not None:
+            watcher.stop()
+    return ReadinessReport(False, time.monotonic() - started_at, attempts, reason=reason)
+
+
+def prewarm(client, model_ids, max_tokens=1):
+    """
+    Send a tiny chat request to each model in parallel so weights and provider connections are loaded
+    before real traffic. Returns {model_id: seconds}; failures are reported as the exception instead.
+    """
+    def warm(model_id):
+        start = time.perf_counter()
+        try:
+            client.inference.chat_completion(
+                model_id=model_id,
+                messages=[{"role": "user", "content": "Hi"}],
+                sampling_params={"max_tokens": max_tokens},
+            )
+        except Exception as e:
+            return model_id, e
+        return model_id, time.perf_counter() - start
+
+    if not model_ids:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(model_ids)) as executor:
+        return dict(executor.map(warm, model_ids))
+
+
+
+def _fixed_interval_wait(health_url, timeout=60.0, interval=1.0):
+    """The original loop from script 04 (probe, then sleep a fixed interval), kept as the benchmark baseline."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(health_url, timeout=interval).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(interval)
+    return False
+
+
+def benchmark(trials=20, max_startup=3.0, seed=0):
+    """
+    Compare time-to-ready of the fixed 1 s poll and wait_until_ready against a stand-in server
+    that starts after a random delay of up to `max_startup` seconds and logs a uvicorn-style ready line.
+    Reports how long each strategy takes beyond the moment the server was actually up.
+    """
+    import stand_in_server
+
+    log_dir = tempfile.mkdtemp()
+    rng = random.Random(seed)
+    overshoot = {"fixed 1s poll": [], "backoff + log watch": []}
+    for trial in range(trials):
+        startup = rng.uniform(0.1, max_startup)
+        for strategy, name in enumerate(overshoot):
+            with socket.socket() as s:
+                s.bind(("127.0.0.1", 0))
+                port = s.getsockname()[1]
+            log_path = os.path.join(log_dir, f"{trial}-{strategy}.log")
+            up = {}
+
+            def launch():
+                time.sleep(startup)
+                # Binding starts the listen backlog, so only create the server once "startup" is over
+                up["server"] = stand_in_server.StandInServer(port=port).start()
+                up["at"] = time.monotonic()
+                with open(log_path, "a") as log:
+                    log.write(f"INFO:     Uvicorn running on http://127.0.0.1:{port}\n")
+
+            launcher = threading.Thread(target=launch)
+            launcher.start()
+            health_url = f"http://127.0.0.1:{port}/v1/health"
+            if name == "fixed 1s poll":
+                _fixed_interval_wait(health_url)
+            else:
+                wait_until_ready(health_url, log_path=log_path)
+            ready_at = time.monotonic()
+            launcher.join()
+            up["server"].stop()
+            overshoot[name].append(ready_at - up["at"])
+
+    print(f"{'strategy':>20} | {'p50 ms':>8} | {'p95 ms':>8} | {'max ms':>8}")
+    for name, values in overshoot.items():
+        values = sorted(values)
+        p95 = values[min(len(values) - 1, int(0.95 * len(values)))]
+        print(f"{name:>20} | {statistics.median(values) * 1000:>8.1f} | {p95 * 1000:>8.1f} | {values[-1] * 1000:>8.1f}")
+    return overshoot
+
+
+if __name__ == "__main__":
+    logging.getLogger("urllib3").setLevel(logging.WARNING)
+    benchmark()
@@ -0,0 +1,188 @@
+"""
+session_registry.py
+-------------------
+Bounded registry of agent sessions for multi-user apps such as 24-llama-staack-chatbot-UX.py.
+Each user key (the Gradio session hash) maps to one Llama Stack agent session. The registry caps the number
+of live sessions (evicting the least recently used idle one), evicts sessions idle for longer than a timeout,
+limits how many turns one user can have in flight, and deletes evicted sessions on the server as well,
+so memory and server-side state stay bounded however many users come and go.
+`stats()` reports live sessions and eviction counts for monitoring.
+"""
+
+import contextlib  # For the acquire() context manager
+import logging  # For reporting failed remote deletes
+import threading  # For guarding the registry
+import time  # For idle tracking
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Optional
+
+DEFAULT_MAX_SESSIONS = 256
+DEFAULT_IDLE_TIMEOUT = 30 * 60
+DEFAULT_MAX_IN_FLIGHT = 1
+
+logger = logging.getLogger(__name__)
+
+
+class SessionLimitError(RuntimeError):
+    """Raised by acquire() when a user already has `max_in_flight` turns running."""
+
+
+@dataclass
+class _Entry:
+    session_id: Optional[str] = None
+    last_used: float = 0.0
+    in_flight: int = 0
+    closing: bool = False
+    ready: threading.Event = field(default_factory=threading.Event)
+
+
+@dataclass
+class RegistryStats:
+    live: int = 0
+    in_flight: int = 0
+    created: int = 0
+    evicted_lru: int = 0
+    evicted_idle: int = 0
+    closed: int = 0
+    rejected: int = 0
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+class SessionRegistry:
+    """
+    Agent sessions keyed by user, bounded by `max_sessions` (LRU) and `idle_timeout` seconds.
+    Use `with registry.acquire(key) as session_id:` around each turn; sessions are created on first use.
+    Sessions with a turn in flight are never evicted, so the live count can briefly exceed `max_sessions`
+    when every session is busy.
+    """
+
+    def __init__(self, agent, max_sessions=DEFAULT_MAX_SESSIONS, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT, clock=time.monotonic):
+        self.agent = agent
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_in_flight = max_in_flight
+        self.clock = clock
+        self._entries: OrderedDict = OrderedDict()
+        self._stats = RegistryStats()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def acquire(self, key):
+        """Reserve `key`'s session for one turn and yield its session id."""
+        with self._lock:
+            now = self.clock()
+            evicted = self._evict_idle(now)
+            entry = self._entries.get(key)
+            creator = entry is None
+            rejected = not creator and entry.in_flight >= self.max_in_flight
+            if rejected:
+                self._stats.rejected += 1
+            else:
+                if creator:
+                    entry = self._entries[key] = _Entry()
+                entry.in_flight += 1
+                self._touch(key, entry, now)
+                if creator:
+                    evicted += self._evict_lru()
+        self._delete_remote(evicted)
+        if rejected:
+            raise SessionLimitError(f"{entry.in_flight} turn(s) already in flight for this user")
+
+        try:
+            if creator:
+                # Created outside the lock so one slow create_session does not hold up other users
+                try:
+                    entry.session_id = self.agent.create_session(f"session-{key}")
+                    with self._lock:
+                        self._stats.created += 1
+                finally:
+                    entry.ready.set()
+            else:
+                entry.ready.wait()
+            if entry.session_id is None:
+                raise RuntimeError("Session creation failed")
+            yield entry.session_id
+        finally:
+            with self._lock:
+                entry.in_flight -= 1
+                closed = entry.closing and entry.in_flight == 0
+                if self._entries.get(key) is entry:
+                    if entry.session_id is None and entry.in_flight == 0:
+                        del self._entries[key]
+                    else:
+                        self._touch(key, entry, self.clock())
+            if closed:
+                # close() was called during this turn; the session is deleted now that nothing uses it
+                self._delete_remote([entry])
+
+    def close(self, key):
+        """
+        Forget `key`'s session (e.g. when the user clears the chat or closes the tab).
+        The next acquire(key) starts a new session; a session with a turn in flight is marked closing and
+        deleted on the server once that turn releases it.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return
+            self._stats.closed += 1
+            if entry.in_flight:
+                entry.closing = True
+                return
+        self._delete_remote([entry])
+
+    def sweep(self):
+        """Evict sessions idle for longer than idle_timeout; call periodically so idle users are reclaimed promptly."""
+        with self._lock:
+            evicted = self._evict_idle(self.clock())
+        self._delete_remote(evicted)
+        return len(evicted)
+
+    def stats(self):
+        with self._lock:
+            stats = RegistryStats(**self._stats.as_dict())
+            stats.live = len(self._entries)
+            stats.in_flight = sum(entry.in_flight for entry in self._entries.values())
+        return stats
+
+    def _touch(self, key, entry, now):
+        # Keeps _entries ordered by last_used, oldest first
+        entry.last_used = now
+        self._entries.move_to_end(key)
+
+    def _evict_idle(self, now):
+        evicted = []
+        for key, entry in list(self._entries.items()):
+            # Entries are in LRU order, so the first recent one ends the scan
+            if now - entry.last_used < self.idle_timeout:
+                break
+            if entry.in_flight == 0:
+                evicted.append(self._entries.pop(key))
+                self._stats.evicted_idle += 1
+        return evicted
+
+    def _evict_lru(self):
+        evicted = []
+        for key in list(self._entries):
+            if len(self._entries) <= self.max_sessions:
+                break
+            if self._entries[key].in_flight == 0:
+                evicted.append(self._entries.pop(key))
+                self._stats.evicted_lru += 1
+        return evicted
+
+    def _delete_remote(self, entries):
+        for entry in entries:
+            if entry.session_id is None:
+                continue
+            try:
+                self.agent.client.agents.session.delete(entry.session_id, agent_id=self.agent.agent_id)
+            except Exception as e:
+                logger.warning("Could not delete agent session %s: %s", entry.session_id, e)
+            # Agent keeps every session id it ever created; drop evicted ones so that list stays bounded too
+            if entry.session_id in self.agent.sessions:
+                self.agent.sessions.remove(entry.session_id)
@@ -0,0 +1,29 @@
+"""
+shared_utils.py
+---------------
+Small dependency-free helpers shared by the helper modules: the nearest-rank `percentile` used by every
+benchmark and stats report, and the jittered exponential `backoff_delays` used for retries and readiness polls.
+Keeping them here lets a module use them without importing the HR router or the server launcher.
+"""
+
+import math  # For nearest-rank indices
+import random  # For backoff jitter
+
+
+def percentile(values, p):
+    """Nearest-rank percentile `p` (0-100) of `values`; 0.0 when empty."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))]
+
+
+def backoff_delays(initial=0.05, maximum=1.0, factor=2.0, jitter=0.5):
+    """
+    Endless exponential backoff delays: initial, initial*factor, ... capped at `maximum`.
+    Each delay is randomly shortened by up to `jitter` (a fraction) so concurrent waiters do not probe in lockstep.
+    """
+    delay = initial
+    while True:
+        yield delay * (1 - jitter * random.random())
+        delay = min(delay * factor, maximum)
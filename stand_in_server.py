@@ -0,0 +1,478 @@
+"""
+stand_in_server.py
+------------------
+A tiny local stand-in for the Llama Stack HTTP API, used by the benchmarks and tests so that
+client-side behaviour (pooling, caching, routing, fan-out) can be exercised offline.
+It answers health, registry (models, tools, shields, vector DBs), chat completion and agent session/turn requests with canned echo replies,
+stores chunks sent to vector IO and searches them for rag_tool.query, computes toy bag-of-words embeddings (so similar
+texts get similar vectors), and serves `files` under /files/ with ETag and Last-Modified validators,
+after an optional per-request delay (`latency`) and per-streamed-token delay (`token_latency`).
+`model_latency` adds a further delay per model, fixed or drawn from a function, to mimic slow or jittery providers.
+With `rate_limit`, model requests beyond that many per second are refused with 429 and a Retry-After header.
+"""
+
+import contextlib  # For the spawn() context manager
+import email.utils  # For Last-Modified dates
+import hashlib  # For file ETags
+import io  # For discarding output to clients that hung up
+import json  # For encoding responses
+import re  # For splitting replies into streamed tokens
+import threading  # For running the server in the background
+import time  # For injected latency
+import subprocess  # For running the server in a separate process
+import sys  # For locating the Python interpreter
+import uuid  # For agent, session and turn ids
+import urllib.parse  # For query strings
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import cast
+
+DEFAULT_MODELS = [
+    {"identifier": "meta-llama/Llama-3.2-3B-Instruct-Turbo", "provider_id": "together", "model_type": "llm", "metadata": {}},
+    {"identifier": "llama3.2:1b", "provider_id": "ollama", "model_type": "llm", "metadata": {}},
+    {"identifier": "all-MiniLM-L6-v2", "provider_id": "ollama", "model_type": "embedding",
+     "metadata": {"embedding_dimension": 384}},
+]
+
+DEFAULT_TOOLS = [
+    {"identifier": "web_search", "toolgroup_id": "builtin::websearch", "provider_id": "tavily-search",
+     "description": "Search the web", "parameters": []},
+    {"identifier": "knowledge_search", "toolgroup_id": "builtin::rag", "provider_id": "rag-runtime",
+     "description": "Search the knowledge base", "parameters": []},
+]
+
+AGENT_TURN_PATH = re.compile(r"^/v1/agents/([^/]+)/session/([^/]+)/turn$")
+AGENT_SESSION_PATH = re.compile(r"^/v1/agents/([^/]+)/session$")
+
+
+def _message_text(message):
+    content = message.get("content", "")
+    if isinstance(content, list):
+        return "".join(item.get("text", "") for item in content if isinstance(item, dict))
+    return str(content)
+
+
+def embed(text, dimension=384):
+    """Deterministic unit-length embedding from hashed lowercase words; texts sharing words point the same way."""
+    vector = [0.0] * dimension
+    for word in re.findall(r"\w+", text.lower()):
+        digest = hashlib.blake2b(word.encode(), digest_size=8).digest()
+        vector[int.from_bytes(digest[:4], "little") % dimension] += 1.0 if digest[4] & 1 else -1.0
+    norm = sum(value * value for value in vector) ** 0.5 or 1.0
+    return [value / norm for value in vector]
+
+
+def _tokens(text):
+    """Split text into word-sized tokens that join back to the original string."""
+    return re.findall(r"\S+\s*|\s+", text) or [""]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so that clients can keep connections alive between requests
+    protocol_version = "HTTP/1.1"
+    # Send headers and body in one write; avoids Nagle/delayed-ACK stalls on reused connections
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark and test output quiet
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_sse(self, events, token_latency):
+        """Stream `events` as server-sent events over chunked transfer encoding."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i, event in enumerate(events):
+                if i and token_latency:
+                    time.sleep(token_latency)
+                data = f"data: {json.dumps(event)}\n\n".encode()
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client closed the stream early (e.g. a cancelled speculative turn); drop whatever is
+            # still buffered so the handler's own flush and close do not fail again
+            cast(_StandInHTTPServer, self.server).abandoned_streams += 1
+            self.wfile = io.BytesIO()
+            self.close_connection = True
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        server = cast(_StandInHTTPServer, self.server)
+        server.record_request(self.path)
+        time.sleep(server.latency)
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        if url.path == "/v1/health":
+            self._send_json({"status": "OK"})
+        elif url.path == "/v1/models":
+            self._send_json({"data": [
+                {"type": "model", "provider_resource_id": m["identifier"], **m} for m in server.models
+            ]})
+        elif url.path == "/v1/tools":
+            groups = query.get("toolgroup_id")
+            self._send_json({"data": [
+                {"type": "tool", **t} for t in server.tools if not groups or t["toolgroup_id"] in groups
+            ]})
+        elif url.path == "/v1/shields":
+            self._send_json({"data": list(server.shields.values())})
+        elif url.path == "/v1/vector-dbs":
+            self._send_json({"data": list(server.vector_dbs.values())})
+        elif url.path.startswith("/files/"):
+            self._send_file(server, urllib.parse.unquote(url.path[len("/files/"):]))
+        else:
+            self._send_json({"detail": "Not Found"}, status=404)
+
+    def _send_file(self, server, path):
+        with server._lock:
+            entry = server.files.get(path)
+        if entry is None:
+            self._send_json({"detail": "Not Found"}, status=404)
+            return
+        body, etag, modified = entry
+        since = self.headers.get("If-Modified-Since")
+        if self.headers.get("If-None-Match") == etag or (
+                "If-None-Match" not in self.headers and since and email.utils.parsedate_to_datetime(since).timestamp() >= int(modified)):
+            server.not_modified += 1
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", email.utils.formatdate(modified, usegmt=True))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_DELETE(self):
+        server = cast(_StandInHTTPServer, self.server)
+        server.record_request(self.path)
+        time.sleep(server.latency)
+        if self.path.startswith("/v1/vector-dbs/"):
+            vector_db_id = urllib.parse.unquote(self.path[len("/v1/vector-dbs/"):])
+            with server._lock:
+                server.vector_dbs.pop(vector_db_id, None)
+                server.chunks.pop(vector_db_id, None)
+        self._send_json({})
+
+    def do_POST(self):
+        server = cast(_StandInHTTPServer, self.server)
+        server.record_request(self.path)
+        body = self._read_json()
+        turn_match = AGENT_TURN_PATH.match(self.path)
+        session_match = AGENT_SESSION_PATH.match(self.path)
+        if turn_match or self.path == "/v1/inference/chat-completion":
+            retry_after = server.throttle()
+            if retry_after:
+                self.send_response(429)
+                self.send_header("Retry-After", f"{retry_after:.3f}")
+                refusal = b'{"detail": "Rate limit exceeded"}'
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(refusal)))
+                self.end_headers()
+                self.wfile.write(refusal)
+                return
+        time.sleep(server.latency)
+        if turn_match or self.path == "/v1/inference/chat-completion":
+            model = server.agents.get(turn_match.group(1), {}).get("model") if turn_match else body.get("model_id")
+            time.sleep(server.model_delay(model))
+        if self.path == "/v1/inference/chat-completion":
+            reply = server.reply(body.get("messages") or [{}])
+            if body.get("stream"):
+                self._send_sse(_chat_completion_events(reply), server.token_latency)
+            else:
+                self._send_json({"completion_message": _completion_message(reply)})
+        elif self.path == "/v1/agents":
+            agent_id = str(uuid.uuid4())
+            server.agents[agent_id] = body.get("agent_config", {})
+            self._send_json({"agent_id": agent_id})
+        elif self.path == "/v1/shields":
+            shield = {"identifier": body["shield_id"], "provider_id": body.get("provider_id") or "llama-guard",
+                      "provider_resource_id": body.get("provider_shield_id"), "type": "shield", "params": {}}
+            server.shields[shield["identifier"]] = shield
+            self._send_json(shield)
+        elif self.path == "/v1/vector-dbs":
+            vector_db = {"identifier": body["vector_db_id"], "provider_id": body.get("provider_id") or "faiss",
+                         "provider_resource_id": body["vector_db_id"], "type": "vector_db",
+                         "embedding_model": body.get("embedding_model"),
+                         "embedding_dimension": body.get("embedding_dimension", 384)}
+            server.vector_dbs[vector_db["identifier"]] = vector_db
+            self._send_json(vector_db)
+        elif self.path == "/v1/inference/embeddings":
+            contents = [content if isinstance(content, str) else _message_text({"content": [content]})
+                        for content in body.get("contents", [])]
+            dimension = server.embedding_dimension(body.get("model_id"))
+            with server._lock:
+                server.embedded += len(contents)
+            self._send_json({"embeddings": [embed(content, dimension) for content in contents]})
+        elif self.path == "/v1/tool-runtime/rag-tool/query":
+            self._send_json(server.rag_query(_message_text({"content": body.get("content", "")}),
+                                             body.get("vector_db_ids", []), (body.get("query_config") or {}).get("max_chunks", 5)))
+        elif self.path == "/v1/vector-io/insert":
+            chunks = body.get("chunks", [])
+            with server._lock:
+                # Chunks sent without an embedding are embedded by the server
+                server.embedded += sum("embedding" not in chunk for chunk in chunks)
+                server.chunks.setdefault(body["vector_db_id"], []).extend(chunks)
+            self._send_json({})
+        elif session_match:
+            if session_match.group(1) in server.agents:
+                self._send_json({"session_id": str(uuid.uuid4())})
+            else:
+                self._send_json({"detail": f"Agent {session_match.group(1)} not found"}, status=404)
+        elif turn_match:
+            agent_id, session_id = turn_match.groups()
+            messages = body.get("messages") or [{}]
+            reply = server.reply(messages)
+            self._send_sse(_agent_turn_events(session_id, messages, reply), server.token_latency)
+        else:
+            self._send_json({"detail": "Not Found"}, status=404)
+
+
+def _completion_message(text):
+    return {"role": "assistant", "content": text, "stop_reason": "end_of_turn", "tool_calls": []}
+
+
+def _chat_completion_events(reply):
+    yield {"event": {"event_type": "start", "delta": {"type": "text", "text": ""}}}
+    for token in _tokens(reply):
+        yield {"event": {"event_type": "progress", "delta": {"type": "text", "text": token}}}
+    yield {"event": {"event_type": "complete", "delta": {"type": "text", "text": ""}, "stop_reason": "end_of_turn"}}
+
+
+def _agent_turn_events(session_id, messages, reply):
+    turn_id = str(uuid.uuid4())
+    step_id = str(uuid.uuid4())
+    now = datetime.now(timezone.utc).isoformat()
+    message = _completion_message(reply)
+
+    def event(payload):
+        return {"event": {"payload": payload}}
+
+    yield event({"event_type": "turn_start", "turn_id": turn_id})
+    yield event({"event_type": "step_start", "step_type": "inference", "step_id": step_id})
+    for token in _tokens(reply):
+        yield event({"event_type": "step_progress", "step_type": "inference", "step_id": step_id,
+                     "delta": {"type": "text", "text": token}})
+    step = {"step_type": "inference", "step_id": step_id, "turn_id": turn_id, "model_response": message}
+    yield event({"event_type": "step_complete", "step_type": "inference", "step_id": step_id, "step_details": step})
+    yield event({"event_type": "turn_complete", "turn": {
+        "turn_id": turn_id, "session_id": session_id, "input_messages": messages, "steps": [step],
+        "output_message": message, "started_at": now, "completed_at": now,
+    }})
+
+
+class _StandInHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, latency, token_latency, models, responder, port=0, rate_limit=None, model_latency=None):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.latency = latency
+        self.token_latency = token_latency
+        self.model_latency = dict(model_latency or {})
+        self.rate_limit = rate_limit
+        self.throttled = 0
+        self._allowance = 1.0
+        self._allowance_at = time.monotonic()
+        self.models = list(models)
+        self.responder = responder
+        self.agents: dict = {}
+        self.tools = list(DEFAULT_TOOLS)
+        self.shields: dict = {}
+        self.vector_dbs: dict = {}
+        self.chunks: dict = {}  # vector DB id -> inserted chunks
+        self.files: dict = {}  # path -> (body, ETag, modification time)
+        self.not_modified = 0
+        self.embedded = 0
+        self.request_count = 0
+        self.abandoned_streams = 0
+        self.paths: list = []
+        self._lock = threading.Lock()
+
+    def record_request(self, path):
+        with self._lock:
+            self.request_count += 1
+            self.paths.append(path)
+
+    def put_file(self, path, text):
+        body = text.encode()
+        with self._lock:
+            self.files[path] = (body, f'"{hashlib.sha256(body).hexdigest()[:16]}"', time.time())
+
+    def embedding_dimension(self, model):
+        for entry in self.models:
+            if entry["identifier"] == model:
+                return entry.get("metadata", {}).get("embedding_dimension", 384)
+        return 384
+
+    def rag_query(self, content, vector_db_ids, max_chunks):
+        """Best chunks of the given vector DBs by embedding similarity, formatted like the rag-runtime provider."""
+        query = embed(content)
+        with self._lock:
+            chunks = [chunk for vector_db_id in vector_db_ids for chunk in self.chunks.get(vector_db_id, [])]
+        scored = sorted(((sum(a * b for a, b in zip(query, chunk.get("embedding") or embed(str(chunk["content"])))), chunk)
+                         for chunk in chunks), key=lambda pair: -pair[0])[:max_chunks]
+        items = [{"type": "text", "text": f"knowledge_search tool found {len(scored)} chunks:\n"}]
+        items += [{"type": "text", "text": f"Result {number}:\nContent: {chunk['content']}\n"}
+                  for number, (_, chunk) in enumerate(scored, start=1)]
+        return {"content": items, "metadata": {"document_ids": [chunk["metadata"].get("document_id") for _, chunk in scored]}}
+
+    def model_delay(self, model):
+        delay = self.model_latency.get(model, 0.0)
+        return delay() if callable(delay) else delay
+
+    def throttle(self):
+        """Seconds the caller must wait if the model request rate is exceeded, else 0 (one-request token bucket)."""
+        if not self.rate_limit:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(1.0, self._allowance + (now - self._allowance_at) * self.rate_limit)
+            self._allowance_at = now
+            if self._allowance >= 1.0:
+                self._allowance -= 1.0
+                return 0.0
+            self.throttled += 1
+            return (1.0 - self._allowance) / self.rate_limit
+
+    def reply(self, messages):
+        if self.responder is not None:
+            return self.responder(messages)
+        return f"Echo: {_message_text(messages[-1])}"
+
+
+class StandInServer:
+    """
+    Runs the stand-in API on 127.0.0.1 in a daemon thread.
+    Use as a context manager; `base_url` is available once started.
+    `responder(messages) -> str` can replace the default echo reply; `port=0` picks a free port.
+    `rate_limit` caps chat completions and agent turns per second, answering the excess with 429.
+    `model_latency` maps model ids to extra seconds per request (or to functions returning them).
+    `files` maps paths to text served at `file_url(path)`; change them with put_file() and remove_file().
+    """
+
+    def __init__(self, latency=0.0, token_latency=0.0, models=None, responder=None, port=0, rate_limit=None,
+                 model_latency=None, files=None):
+        self._httpd = _StandInHTTPServer(latency, token_latency, models or DEFAULT_MODELS, responder, port, rate_limit,
+                                         model_latency)
+        for path, text in (files or {}).items():
+            self._httpd.put_file(path, text)
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def request_count(self):
+        return self._httpd.request_count
+
+    @property
+    def abandoned_streams(self):
+        """Streams the client closed before the last event was sent."""
+        return self._httpd.abandoned_streams
+
+    def file_url(self, path):
+        return f"{self.base_url}/files/{urllib.parse.quote(path)}"
+
+    def put_file(self, path, text):
+        self._httpd.put_file(path, text)
+
+    def remove_file(self, path):
+        with self._httpd._lock:
+            self._httpd.files.pop(path, None)
+
+    @property
+    def chunks(self):
+        """Vector DB id -> chunks inserted through vector IO."""
+        return self._httpd.chunks
+
+    @property
+    def not_modified(self):
+        """File requests answered 304 Not Modified."""
+        return self._httpd.not_modified
+
+    @property
+    def embedded(self):
+        """Texts embedded so far, through inference embeddings or for chunks inserted without an embedding."""
+        return self._httpd.embedded
+
+    @property
+    def model_latency(self):
+        """Mutable model id -> extra seconds (or function) map, so tests can change a provider's speed mid-run."""
+        return self._httpd.model_latency
+
+    @property
+    def throttled(self):
+        """Model requests refused with 429 because of `rate_limit`."""
+        return self._httpd.throttled
+
+    @property
+    def paths(self):
+        """Request paths received so far, in arrival order."""
+        return list(self._httpd.paths)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+@contextlib.contextmanager
+def spawn(latency=0.0, token_latency=0.0):
+    """
+    Run the stand-in server in a child process and yield its base URL.
+    Benchmarks use this so that server-side CPU is not charged to the client being measured.
+    """
+    process = subprocess.Popen(
+        [sys.executable, __file__, "--latency", str(latency), "--token-latency", str(token_latency)],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        yield process.stdout.readline().strip()
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the local stand-in Llama Stack server.")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="seconds between streamed tokens")
+    args = parser.parse_args()
+    server = StandInServer(latency=args.latency, token_latency=args.token_latency).start()
+    print(server.base_url, flush=True)
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
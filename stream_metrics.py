@@ -0,0 +1,163 @@
+"""
+stream_metrics.py
+-----------------
+Reusable consumer for `client.inference.chat_completion(stream=True)` and `agent.create_turn(stream=True)`.
+Text deltas are collected in a list and joined once at the end, and their arrival times give
+time-to-first-token (TTFT), an inter-token latency histogram and tokens per second.
+`consume()` returns a StreamResult holding the text, the metrics and (for agent turns) the completed turn,
+while still printing the stream through InferenceEventLogger / AgentEventLogger if one is given;
+`drain()` does the same silently for an agent turn and can be cancelled part-way.
+Each streamed text delta is counted as one token, which is how the providers used in these examples stream.
+"""
+
+import statistics  # For latency percentiles
+import time  # For chunk arrival times
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+# Upper bounds (seconds) of the inter-token latency histogram buckets; the last bucket is open-ended
+HISTOGRAM_BOUNDS = (0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+
+@dataclass
+class StreamMetrics:
+    ttft: Optional[float]
+    total: float
+    tokens: int
+    inter_token: list = field(default_factory=list)
+
+    @property
+    def tokens_per_second(self):
+        """Decode rate: tokens after the first divided by the time from first to last token."""
+        generation = sum(self.inter_token)
+        return len(self.inter_token) / generation if generation > 0 else 0.0
+
+    def percentile(self, p):
+        """Inter-token latency at percentile `p` (0-100), in seconds."""
+        if not self.inter_token:
+            return 0.0
+        if len(self.inter_token) == 1:
+            return self.inter_token[0]
+        return statistics.quantiles(self.inter_token, n=100, method="inclusive")[min(max(int(p), 1), 99) - 1]
+
+    def histogram(self, bounds=HISTOGRAM_BOUNDS):
+        """[(upper_bound, count)] of inter-token gaps; the last entry has upper_bound None (everything larger)."""
+        counts = [0] * (len(bounds) + 1)
+        for gap in self.inter_token:
+            index = next((i for i, bound in enumerate(bounds) if gap <= bound), len(bounds))
+            counts[index] += 1
+        return list(zip(list(bounds) + [None], counts))
+
+    def format_histogram(self, width=30):
+        rows = []
+        peak = max((count for _, count in self.histogram()), default=0) or 1
+        for bound, count in self.histogram():
+            label = f"<= {bound * 1000:.0f} ms" if bound is not None else f"> {HISTOGRAM_BOUNDS[-1] * 1000:.0f} ms"
+            rows.append(f"{label:>10} | {'#' * round(width * count / peak):<{width}} {count}")
+        return "\n".join(rows)
+
+    def __str__(self):
+        ttft = f"{self.ttft * 1000:.0f} ms" if self.ttft is not None else "n/a"
+        return (f"TTFT {ttft}, {self.tokens} tokens in {self.total:.2f}s, {self.tokens_per_second:.1f} tok/s, "
+                f"inter-token p50 {self.percentile(50) * 1000:.0f} ms / p95 {self.percentile(95) * 1000:.0f} ms")
+
+
+@dataclass
+class StreamResult:
+    text: str
+    metrics: StreamMetrics
+    stop_reason: Optional[str] = None
+    turn: Any = None
+    session_id: Optional[str] = None  # Agent session the turn ran in, when the caller records it
+
+
+class StreamAccumulator:
+    """
+    Observes stream chunks as they pass through and records text deltas with their arrival times.
+    `started_at` (a time.perf_counter() value) should be taken just before the streaming call is made,
+    so TTFT includes the request itself; it defaults to when the accumulator is created.
+    """
+
+    def __init__(self, started_at=None):
+        self.started_at = time.perf_counter() if started_at is None else started_at
+        self.stop_reason = None
+        self.turn = None
+        self._pieces: list = []
+        self._arrivals: list = []
+        self._finished_at = None
+
+    def observe(self, chunk):
+        event = chunk.event
+        payload = getattr(event, "payload", None)
+        if payload is not None:
+            # Agent turn stream: text arrives as inference step_progress deltas
+            if payload.event_type == "step_progress":
+                self._add_delta(payload.delta)
+            elif payload.event_type == "turn_complete":
+                self.turn = payload.turn
+                self.stop_reason = getattr(payload.turn.output_message, "stop_reason", None)
+        else:
+            self._add_delta(event.delta)
+            if event.event_type == "complete":
+                self.stop_reason = event.stop_reason
+        self._finished_at = time.perf_counter()
+
+    def _add_delta(self, delta):
+        if getattr(delta, "type", None) == "text" and delta.text:
+            self._pieces.append(delta.text)
+            self._arrivals.append(time.perf_counter())
+
+    def wrap(self, stream):
+        """Yield the chunks of `stream` unchanged, observing each one."""
+        for chunk in stream:
+            self.observe(chunk)
+            yield chunk
+
+    async def awrap(self, stream):
+        """Async version of wrap() for AsyncLlamaStackClient / AsyncAgent streams."""
+        async for chunk in stream:
+            self.observe(chunk)
+            yield chunk
+
+    def result(self):
+        arrivals = self._arrivals
+        finished_at = self._finished_at or time.perf_counter()
+        metrics = StreamMetrics(
+            ttft=arrivals[0] - self.started_at if arrivals else None,
+            total=finished_at - self.started_at,
+            tokens=len(arrivals),
+            inter_token=[later - earlier for earlier, later in zip(arrivals, arrivals[1:])],
+        )
+        return StreamResult("".join(self._pieces), metrics, self.stop_reason, self.turn)
+
+
+def consume(stream, logger=None, started_at=None):
+    """
+    Drain `stream` and return a StreamResult.
+    With `logger` (an InferenceEventLogger or AgentEventLogger instance) each log is printed as it arrives,
+    exactly as the example scripts do without this module.
+    """
+    accumulator = StreamAccumulator(started_at)
+    chunks = accumulator.wrap(stream)
+    if logger is None:
+        for _ in chunks:
+            pass
+    else:
+        for log in logger.log(chunks):
+            log.print()
+    return accumulator.result()
+
+
+def drain(stream, cancelled=None, started_at=None):
+    """
+    Consume an agent turn stream into a StreamResult, stopping early and closing the stream once
+    `cancelled` (a threading.Event) is set. Close works on `client.agents.turn.create(stream=True)`
+    streams, which release the connection so the server stops generating.
+    """
+    accumulator = StreamAccumulator(started_at)
+    for chunk in stream:
+        if cancelled is not None and cancelled.is_set():
+            stream.close()
+            break
+        accumulator.observe(chunk)
+    return accumulator.result()
@@ -0,0 +1,1379 @@
+"""
+test_llama_stack_helpers.py
+---------------------------
+Offline tests for the shared helper modules used by the example scripts.
+Network-facing helpers are exercised against the local stand-in server.
+"""
+import importlib.util
+import pytest
+
+from stand_in_server import StandInServer
+
+requires_client = pytest.mark.skipif(
+    importlib.util.find_spec("llama_stack_client") is None or importlib.util.find_spec("httpx") is None,
+    reason="llama_stack_client not installed",
+)
+
+
+@pytest.fixture
+def stand_in():
+    with StandInServer() as server:
+        yield server
+
+
+# --- client_pool ---
+
+@requires_client
+def test_client_pool_reuses_connections(stand_in):
+    import client_pool
+
+    with client_pool.build_http_client(pool_size=2, http2=False) as http_client:
+        for _ in range(5):
+            assert http_client.get(f"{stand_in.base_url}/v1/health").status_code == 200
+        stats = client_pool.pool_stats(http_client)
+    assert stats.requests == 5
+    assert stats.connections_opened == 1
+    assert stats.reused == 4
+    assert stats.idle == 1
+
+
+@requires_client
+def test_get_client_is_shared_per_config(stand_in):
+    import client_pool
+
+    try:
+        first = client_pool.get_client(stand_in.base_url, provider_data={"k": "v"}, pool_size=3)
+        again = client_pool.get_client(stand_in.base_url + "/", provider_data={"k": "v"}, pool_size=3)
+        other = client_pool.get_client(stand_in.base_url, provider_data={"k": "other"}, pool_size=3)
+        assert first is again
+        assert first is not other
+        slow = client_pool.get_client(stand_in.base_url, provider_data={"k": "v"}, pool_size=3, timeout=120.0,
+                                      default_headers={"X-A": "1", "X-B": "2"})
+        assert slow is not first and slow.timeout == 120.0
+        assert client_pool.get_client(stand_in.base_url, provider_data={"k": "v"}, pool_size=3, timeout=120.0,
+                                      default_headers={"X-B": "2", "X-A": "1"}) is slow
+        assert client_pool.get_client(stand_in.base_url, provider_data={"k": "v"}, pool_size=3,
+                                      keepalive_expiry=5.0) is not first
+        models = first.models.list()
+        assert any(m.model_type == "embedding" for m in models)
+        assert client_pool.pool_stats(first).requests == 1
+    finally:
+        client_pool.close_all()
+
+
+# --- async_fanout ---
+
+@requires_client
+def test_fan_out_yields_in_completion_order_with_bound_and_timeout():
+    import asyncio
+    import async_fanout
+
+    running = {"now": 0, "max": 0}
+
+    def job(delay):
+        async def run():
+            running["now"] += 1
+            running["max"] = max(running["max"], running["now"])
+            try:
+                await asyncio.sleep(delay)
+                return delay
+            finally:
+                running["now"] -= 1
+        return run
+
+    async def collect():
+        jobs = [("slow", job(0.2)), ("fast", job(0.01)), ("stuck", job(5)), ("mid", job(0.05))]
+        return [r async for r in async_fanout.fan_out(jobs, concurrency=2, timeout=0.5)]
+
+    results = asyncio.run(collect())
+    assert [r.key for r in results] == ["fast", "slow", "mid", "stuck"]
+    assert isinstance(results[-1].error, asyncio.TimeoutError)
+    assert running["max"] == 2
+
+
+@requires_client
+def test_fan_out_reports_jobs_that_raise_cancelled_error_themselves():
+    import asyncio
+    import async_fanout
+
+    async def bad():
+        inner = asyncio.create_task(asyncio.sleep(1))
+        inner.cancel()
+        await inner  # Raises CancelledError in the job, not because the job was cancelled
+
+    async def ok():
+        return "b"
+
+    async def collect():
+        return [r async for r in async_fanout.fan_out([("a", bad), ("b", ok)])]
+
+    results = asyncio.run(asyncio.wait_for(collect(), 5))
+    assert sorted(r.key for r in results) == ["a", "b"]
+    assert isinstance(next(r for r in results if r.key == "a").error, asyncio.CancelledError)
+
+
+@requires_client
+def test_fan_out_cancels_pending_jobs_when_closed():
+    import asyncio
+    import async_fanout
+
+    cancelled = []
+
+    def job(delay, key):
+        async def run():
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                cancelled.append(key)
+                raise
+        return run
+
+    async def first_only():
+        results = async_fanout.fan_out([(k, job(d, k)) for k, d in [("a", 0.01), ("b", 1), ("c", 1)]])
+        async for result in results:
+            await results.aclose()
+            return result
+
+    assert asyncio.run(first_only()).key == "a"
+    assert sorted(cancelled) == ["b", "c"]
+
+
+@requires_client
+def test_localize_alerts_against_stand_in(stand_in):
+    import asyncio
+    import async_fanout
+    import client_pool
+
+    async def run():
+        clients = client_pool.get_async_clients(stand_in.base_url, connections=4, shard_size=2)
+        assert len(clients) == 2
+        try:
+            configs = {"fr": "French", "de": "German", "es": "Spanish"}
+            return [r async for r in async_fanout.localize_alerts(clients, configs, "alert", timeout=5)]
+        finally:
+            await asyncio.gather(*(c.close() for c in clients))
+
+    results = asyncio.run(run())
+    assert sorted(r.key for r in results) == ["de", "es", "fr"]
+    assert all(r.ok and r.value == "Echo: alert" for r in results)
+
+
+# --- response_cache ---
+
+@requires_client
+def test_cache_key_is_canonical():
+    from response_cache import cache_key
+
+    messages = [{"role": "user", "content": "hi"}]
+    sampling = {"strategy": {"type": "greedy"}, "max_tokens": 10}
+    reordered = {"max_tokens": 10, "strategy": {"type": "greedy"}}
+    assert cache_key("m", messages, sampling) == cache_key("m", tuple(messages), reordered, stream=True)
+    assert cache_key("m", messages, sampling) != cache_key("m", messages, sampling, response_format={"type": "json_schema"})
+
+
+@requires_client
+def test_response_cache_tiers_ttl_and_size_eviction(tmp_path):
+    from response_cache import ResponseCache
+
+    path = str(tmp_path / "cache.db")
+    cache = ResponseCache(path, memory_entries=1)
+    cache.put("a", {"v": 1})
+    cache.put("b", {"v": 2})  # Pushes "a" out of the LRU, but it stays on disk
+    assert cache.get("a") == {"v": 1}
+    assert cache.stats.disk_hits == 1 and cache.stats.evictions >= 1
+    assert cache.get("a") == {"v": 1}
+    assert cache.stats.memory_hits == 1
+    assert cache.get("missing") is None and cache.stats.misses == 1
+    cache.close()
+
+    reopened = ResponseCache(path, ttl=0)
+    assert reopened.get("b") is None  # Expired on disk
+    reopened.close()
+
+    small = ResponseCache(str(tmp_path / "small.db"), memory_entries=0, max_bytes=30)
+    small.put("x", {"text": "0123456789"})
+    small.put("y", {"text": "0123456789"})
+    assert small.get("x") is None and small.get("y") is not None
+    small.close()
+
+
+@requires_client
+def test_cached_chat_completion_replays_streams(stand_in, tmp_path):
+    from llama_stack_client import InferenceEventLogger, LlamaStackClient
+    from response_cache import ResponseCache, enable_response_cache
+
+    client = enable_response_cache(LlamaStackClient(base_url=stand_in.base_url), ResponseCache(str(tmp_path / "c.db")))
+    messages = [{"role": "user", "content": "tell me a joke"}]
+
+    live = [log.content for log in InferenceEventLogger().log(
+        client.inference.chat_completion(model_id="m", messages=messages, stream=True))]
+    calls = stand_in.request_count
+    replayed = [log.content for log in InferenceEventLogger().log(
+        client.inference.chat_completion(model_id="m", messages=messages, stream=True))]
+    response = client.inference.chat_completion(model_id="m", messages=messages)
+
+    assert stand_in.request_count == calls
+    assert "".join(replayed) == "".join(live)
+    assert response.completion_message.content == "Echo: tell me a joke"
+    assert client.inference.cache.stats.hits == 2
+
+
+# --- registry_cache ---
+
+@requires_client
+def test_registry_cache_indexes_persists_and_invalidates(stand_in, tmp_path):
+    from llama_stack_client import LlamaStackClient
+    from registry_cache import RegistryCache
+
+    client = LlamaStackClient(base_url=stand_in.base_url)
+    path = str(tmp_path / "registry.json")
+    registry = RegistryCache(client, path=path)
+    assert [m.identifier for m in registry.models_by_type("embedding")] == ["all-MiniLM-L6-v2"]
+    assert registry.embedding_dimension("all-MiniLM-L6-v2") == 384
+    assert registry.model("llama3.2:1b").provider_id == "ollama"
+    assert [t.identifier for t in registry.tools_by_group("builtin::rag")] == ["knowledge_search"]
+    assert registry.shield("guard") is None
+    assert registry.fetches == 3
+
+    # A second process reads the file instead of calling the server
+    calls = stand_in.request_count
+    later = RegistryCache(client, path=path)
+    assert later.model("llama3.2:1b").model_type == "llm"
+    assert later.tool("web_search").toolgroup_id == "builtin::websearch"
+    assert later.fetches == 0 and stand_in.request_count == calls
+
+    client.shields.register(shield_id="guard", provider_shield_id="meta-llama/Llama-Guard-3-8B")
+    later.invalidate("shields")
+    assert RegistryCache(client, path=path).shield("guard").provider_resource_id == "meta-llama/Llama-Guard-3-8B"
+
+    expired = RegistryCache(client, path=path, ttl=-1)
+    expired.models()
+    assert expired.fetches == 1
+
+
+# --- server_readiness ---
+
+def test_wait_until_ready_wakes_on_log_line_and_stops_on_exit(tmp_path):
+    import socket
+    import subprocess
+    import sys
+    import threading
+    import time
+    from server_readiness import wait_until_ready
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    log_path = tmp_path / "server.log"
+    servers = []
+
+    def launch():
+        time.sleep(0.3)
+        servers.append(StandInServer(port=port).start())
+        log_path.write_text("INFO:     Uvicorn running on http://127.0.0.1\n")
+
+    launcher = threading.Thread(target=launch)
+    launcher.start()
+    # A long backoff would overshoot by seconds; the log line must cut it short
+    report = wait_until_ready(f"http://127.0.0.1:{port}/v1/health", timeout=10, log_path=str(log_path),
+                              delays=iter([0.05] + [5.0] * 10))
+    launcher.join()
+    try:
+        assert report.ready and "Uvicorn" in report.log_line
+        assert report.time_to_ready < 2
+        # A non-200 answer backs off instead of spinning
+        failing = wait_until_ready(f"http://127.0.0.1:{port}/v1/missing", timeout=0.5)
+        assert not failing.ready and failing.attempts < 10
+    finally:
+        servers[0].stop()
+
+    exited = subprocess.Popen([sys.executable, "-c", "pass"])
+    exited.wait()
+    report = wait_until_ready(f"http://127.0.0.1:{port}/v1/health", timeout=10, process=exited)
+    assert not report.ready and "exited" in report.reason and report.time_to_ready < 1
+
+
+@requires_client
+def test_prewarm_reports_per_model_timings(stand_in):
+    from llama_stack_client import LlamaStackClient
+    from server_readiness import prewarm
+
+    timings = prewarm(LlamaStackClient(base_url=stand_in.base_url), ["a", "b"])
+    assert sorted(timings) == ["a", "b"] and all(isinstance(t, float) for t in timings.values())
+    assert stand_in.paths.count("/v1/inference/chat-completion") == 2
+
+
+# --- warm_library_client ---
+
+@requires_client
+def test_warm_server_serves_json_and_streams_over_unix_socket(tmp_path):
+    import threading
+    from llama_stack_client import InferenceEventLogger
+    from warm_library_client import EventLoopDispatcher, WarmStackServer, get_warm_client, is_alive
+
+    class EchoDispatcher(EventLoopDispatcher):
+        """Answers like the library routes would, without needing llama_stack installed."""
+
+        async def call(self, method, path, params, body, headers):
+            if path == "/v1/models":
+                return {"data": [{"identifier": "m", "provider_id": "p", "provider_resource_id": "m",
+                                  "type": "model", "model_type": "llm", "metadata": {}}]}
+            if path != "/v1/inference/chat-completion":
+                raise ValueError(f"no route for {path}")
+            words = body["messages"][-1]["content"].split()
+
+            async def chunks():
+                for word in words:
+                    yield {"event": {"event_type": "progress", "delta": {"type": "text", "text": word + " "}}}
+                yield {"event": {"event_type": "complete", "delta": {"type": "text", "text": ""}}}
+            return chunks()
+
+    socket_path = str(tmp_path / "warm.sock")
+    server = WarmStackServer(socket_path, EchoDispatcher(), idle_timeout=0.2)
+    thread = threading.Thread(target=server.serve_until_idle)
+    thread.start()
+    client = get_warm_client(socket_path=socket_path, start=False)
+    assert [m.identifier for m in client.models.list()] == ["m"]
+    stream = client.inference.chat_completion(model_id="m", messages=[{"role": "user", "content": "a b c"}], stream=True)
+    assert "".join(log.content for log in InferenceEventLogger().log(stream) if log.content) == "a b c "
+    with pytest.raises(Exception, match="no route"):
+        client.tools.list()
+
+    # Idle for longer than idle_timeout: the daemon stops and removes its socket
+    thread.join(timeout=5)
+    assert not thread.is_alive() and not is_alive(socket_path)
+    with pytest.raises(ConnectionError):
+        get_warm_client(socket_path=socket_path, start=False)
+
+
+@requires_client
+def test_warm_daemon_files_stay_private(tmp_path, monkeypatch):
+    import os
+    import socket
+    import stat
+    from warm_library_client import (
+        EventLoopDispatcher, WarmStackServer, _start_daemon, default_socket_path, get_warm_client,
+    )
+
+    monkeypatch.delenv("LLAMA_STACK_WARM_SOCKET", raising=False)
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    socket_path = default_socket_path("together")
+    assert os.path.dirname(socket_path) == str(tmp_path / "llama-stack")
+    assert stat.S_IMODE(os.stat(os.path.dirname(socket_path)).st_mode) == 0o700
+
+    class NoopDispatcher(EventLoopDispatcher):
+        async def call(self, method, path, params, body, headers):
+            return {}
+
+    with pytest.raises(TypeError):
+        EventLoopDispatcher()  # call() is abstract
+    server = WarmStackServer(socket_path, NoopDispatcher())
+    try:
+        assert stat.S_IMODE(os.stat(socket_path).st_mode) & 0o077 == 0
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+
+    # A lock file swapped for a symlink is not followed
+    target = tmp_path / "victim"
+    target.write_text("keep")
+    os.symlink(target, socket_path + ".lock")
+    with pytest.raises(OSError):
+        _start_daemon("together", socket_path, timeout=1)
+    assert target.read_text() == "keep"
+
+    # A socket owned by someone else is never sent provider_data
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as listener:
+        other = str(tmp_path / "other.sock")
+        listener.bind(other)
+        listener.listen()
+        monkeypatch.setattr(os, "getuid", lambda: os.stat(other).st_uid + 1)
+        with pytest.raises(PermissionError):
+            get_warm_client(socket_path=other, start=False)
+
+
+# --- context_window ---
+
+def test_conversation_window_counts_once_and_evicts_oldest_turns():
+    from context_window import MESSAGE_OVERHEAD, ConversationWindow
+
+    counted = []
+
+    def counter(text):
+        counted.append(text)
+        return len(text.split())
+
+    window = ConversationWindow("be brief", budget=50, counter=counter)
+    for i in range(10):
+        window.add_user(f"question {i} " + "word " * 5)
+        window.add_assistant(f"answer {i} " + "word " * 5)
+        assert window.tokens <= 50
+        window.messages()
+        window.report()
+    assert len(counted) == 21  # System prompt plus each message, once
+
+    messages = window.messages()
+    assert messages[0] == {"role": "system", "content": "be brief"}
+    assert messages[-1]["content"].startswith("answer 9")
+    assert messages[1]["content"].startswith("question 8")
+    report = window.report()
+    assert report.evicted_turns == 8 and not report.summarized
+    assert report.history_tokens == 2 + MESSAGE_OVERHEAD + 20 * (7 + MESSAGE_OVERHEAD)
+    assert report.saved_tokens == report.history_tokens - report.prompt_tokens > 0
+
+
+def test_conversation_window_summarizes_evicted_turns():
+    from context_window import ConversationWindow
+
+    calls = []
+
+    def summarizer(evicted, previous):
+        calls.append(([m["content"] for m in evicted], previous))
+        return "summary"
+
+    window = ConversationWindow("sys", budget=30, counter=lambda text: len(text.split()), summarizer=summarizer)
+    for i in range(4):
+        window.add_user(f"q{i} a b c d")
+        window.add_assistant(f"r{i} a b c d")
+    assert [m["content"] for m in window.messages()][:2] == ["sys", "summary"]
+    assert calls[0] == (["q0 a b c d", "r0 a b c d"], None)
+    assert calls[-1][1] == "summary"
+    assert window.tokens <= 30 and window.report().summarized
+
+
+# --- stream_metrics ---
+
+@requires_client
+def test_consume_chat_and_agent_streams_with_metrics():
+    import time
+    from llama_stack_client import Agent, AgentEventLogger, InferenceEventLogger, LlamaStackClient
+    from stream_metrics import consume
+
+    with StandInServer(token_latency=0.01) as server:
+        client = LlamaStackClient(base_url=server.base_url)
+        messages = [{"role": "user", "content": "one two three four"}]
+        started_at = time.perf_counter()
+        stream = client.inference.chat_completion(model_id="m", messages=messages, stream=True)
+        result = consume(stream, logger=InferenceEventLogger(), started_at=started_at)
+        assert result.text == "Echo: one two three four"
+        assert result.stop_reason == "end_of_turn"
+        metrics = result.metrics
+        assert metrics.tokens == 5 and len(metrics.inter_token) == 4
+        assert 0 < metrics.ttft <= metrics.total
+        assert all(gap >= 0.009 for gap in metrics.inter_token)
+        assert 0 < metrics.tokens_per_second < 110
+        assert sum(count for _, count in metrics.histogram()) == 4
+        assert "tok/s" in str(metrics) and "ms" in metrics.format_histogram()
+
+        agent = Agent(client, model="m", instructions="be brief")
+        session_id = agent.create_session("s")
+        turn = agent.create_turn(session_id=session_id, messages=[{"role": "user", "content": "hi there"}], stream=True)
+        result = consume(turn, logger=AgentEventLogger())
+        assert result.text == "Echo: hi there"
+        assert result.turn.output_message.content == result.text
+        assert result.metrics.tokens == 3
+
+
+# --- gradio_stream ---
+
+def test_frame_coalescer_flushes_on_token_count_and_interval():
+    pytest.importorskip("gradio")
+    from gradio_stream import FrameCoalescer
+
+    now = [0.0]
+    coalescer = FrameCoalescer(interval=0.05, max_tokens=3, clock=lambda: now[0])
+    assert not coalescer.add("a") and not coalescer.add("b")
+    assert coalescer.add("c") and coalescer.flush() == "abc"
+    assert not coalescer.add("d")
+    now[0] = 0.06
+    assert coalescer.add("e") and coalescer.flush() == "de"
+    assert not coalescer.pending and coalescer.flushes == 2
+
+
+@requires_client
+def test_render_turn_coalesces_updates_and_flushes_at_step_complete():
+    pytest.importorskip("gradio")
+    from llama_stack_client import Agent, LlamaStackClient
+    from gradio_stream import FrameCoalescer, render_turn
+
+    reply = " ".join(f"w{i}" for i in range(10))
+    with StandInServer(responder=lambda messages: reply) as server:
+        agent = Agent(LlamaStackClient(base_url=server.base_url), model="m", instructions="")
+        session_id = agent.create_session("s")
+        texts = {}
+        for tokens in (1, 4):
+            history = [{"role": "user", "content": "go"}]
+            stream = agent.create_turn(session_id=session_id, messages=[history[0]], stream=True)
+            updates = [history[-1].content for history in render_turn(stream, history, FrameCoalescer(interval=60, max_tokens=tokens))]
+            texts[tokens] = updates
+            assert history[-1].content == reply
+    assert len(texts[1]) == 11  # One update per token, plus the final one
+    assert texts[4][:2] == ["w0 w1 w2 w3 ", "w0 w1 w2 w3 w4 w5 w6 w7 "]
+    assert texts[4][2] == reply  # The rest arrives with step_complete
+
+
+# --- session_registry ---
+
+@requires_client
+def test_session_registry_bounds_sessions_and_limits_in_flight(stand_in):
+    from llama_stack_client import Agent, LlamaStackClient
+    from session_registry import SessionLimitError, SessionRegistry
+
+    now = [0.0]
+    agent = Agent(LlamaStackClient(base_url=stand_in.base_url), model="m", instructions="")
+    registry = SessionRegistry(agent, max_sessions=2, idle_timeout=100, clock=lambda: now[0])
+
+    with registry.acquire("alice") as alice:
+        with pytest.raises(SessionLimitError):
+            with registry.acquire("alice"):
+                pass
+        with registry.acquire("bob"):
+            pass
+        now[0] = 1
+        with registry.acquire("carol"):
+            pass  # Over the cap: bob is the least recently used idle session (alice is busy)
+    with registry.acquire("alice") as again:
+        assert again == alice
+    stats = registry.stats()
+    assert (stats.live, stats.created, stats.evicted_lru, stats.rejected) == (2, 3, 1, 1)
+
+    now[0] = 200
+    assert registry.sweep() == 2
+    stats = registry.stats()
+    assert stats.live == 0 and stats.evicted_idle == 2 and stats.in_flight == 0
+    deletes = [p for p in stand_in.paths if p.startswith(f"/v1/agents/{agent.agent_id}/session/")]
+    assert len(deletes) == 3 and agent.sessions == []
+    with registry.acquire("alice") as fresh:
+        assert fresh != alice
+    registry.close("alice")
+    assert registry.stats().closed == 1
+
+    # Closing during a turn: the turn keeps its session, which is deleted once the turn ends
+    with registry.acquire("dave") as dave:
+        registry.close("dave")
+        assert registry.stats().live == 0
+        assert f"/v1/agents/{agent.agent_id}/session/{dave}" not in stand_in.paths
+        with registry.acquire("dave") as replacement:
+            assert replacement != dave
+    assert f"/v1/agents/{agent.agent_id}/session/{dave}" in stand_in.paths
+    assert dave not in agent.sessions and registry.stats().closed == 2
+
+
+# --- intent_router ---
+
+def test_tiered_router_uses_local_classifier_when_confident_and_memoizes():
+    import time
+    from intent_router import HR_EXAMPLES, LocalIntentClassifier, TieredRouter
+
+    llm_calls = []
+
+    def llm_route(query):
+        llm_calls.append(query)
+        time.sleep(0.01)
+        return "policy", "llm"
+
+    router = TieredRouter(LocalIntentClassifier(HR_EXAMPLES), llm_route, threshold=0.15)
+    assert router.route("Can you book a 30-minute 1:1 with my manager this Friday?").source == "local"
+    assert router.route("Is maternity leave paid?").intent == "policy"
+    assert router.route("What's the weather like?").source == "llm"  # No overlap with any intent
+    assert router.route("  what's the WEATHER like ").source == "memo"
+    assert llm_calls == ["What's the weather like?"]
+
+    stats = router.stats()
+    assert (stats.total, stats.local, stats.memo, stats.llm) == (4, 2, 1, 1)
+    assert stats.skipped_share == 0.75 and stats.saved_p50 > 0
+
+
+@requires_client
+def test_speculative_router_keeps_hits_and_cancels_misses():
+    import time
+    from llama_stack_client import Agent, LlamaStackClient
+    from intent_router import Route, SpeculativeRouter
+    from stream_metrics import drain
+
+    reply = " ".join(f"w{i}" for i in range(200))
+    with StandInServer(token_latency=0.005, responder=lambda messages: reply) as server:
+        client = LlamaStackClient(base_url=server.base_url)
+        agent = Agent(client, model="m", instructions="")
+        sessions = {True: agent.create_session("speculative"), False: agent.create_session("main")}
+        asked = []
+
+        def route(query):
+            time.sleep(0.05)
+            return Route(query, "test", "llm", latency=0.05)  # The query names its own intent
+
+        def answer(intent, query, cancelled, speculative):
+            asked.append((intent, speculative))
+            stream = client.agents.turn.create(
+                session_id=sessions[speculative], agent_id=agent.agent_id,
+                messages=[{"role": "user", "content": query}], stream=True,
+            )
+            return drain(stream, cancelled)
+
+        accepted, discarded = [], []
+        speculator = SpeculativeRouter(route, answer, min_share=0.5,
+                                       accept=lambda intent, query, result: accepted.append((intent, result.text)),
+                                       discard=lambda intent, query, result: discarded.append((intent, query)))
+        first = speculator.handle("policy")  # No history yet, so nothing to speculate on
+        hit = speculator.handle("policy")
+        miss = speculator.handle("scheduling")
+        speculator.shutdown()
+
+        assert first.speculated is None and hit.hit and not miss.hit
+        assert hit.answer.text == reply and miss.answer.text == reply
+        assert asked == [("policy", False), ("policy", True), ("policy", True), ("scheduling", False)]
+        assert accepted == [("policy", reply)]  # Handed on before handle() returned, nothing regenerated
+        assert discarded == [("policy", "scheduling")]
+        stats = speculator.stats()
+        assert (stats.queries, stats.speculations, stats.hits) == (3, 2, 1)
+        assert 0 < stats.wasted_tokens < 200 and stats.saved_seconds == 0.05
+        assert speculator.guess() == "policy"
+
+
+def test_streaming_json_fields_reports_top_level_strings_as_they_complete():
+    from intent_router import StreamingJSONFields
+
+    parser = StreamingJSONFields()
+    text = '{"meta": {"intent": "nested"}, "n": 3, "intent": "sch\\"ed", "tags": ["a"], "reason": "x, {y}"}'
+    completed = []
+    for i in range(0, len(text), 3):
+        completed.extend(parser.feed(text[i:i + 3]))
+    assert completed == [("intent", 'sch"ed'), ("reason", "x, {y}")]
+
+
+@requires_client
+def test_read_fields_until_stops_the_stream_once_the_intent_is_known():
+    import json
+    import time
+    from llama_stack_client import Agent, LlamaStackClient
+    from intent_router import read_fields_until
+
+    reply = json.dumps({"intent": "scheduling", "reason": " ".join(["because"] * 100)})
+    with StandInServer(token_latency=0.01, responder=lambda messages: reply) as server:
+        client = LlamaStackClient(base_url=server.base_url)
+        agent = Agent(client, model="m", instructions="")
+        session_id = agent.create_session("routing")
+        start = time.perf_counter()
+        stream = client.agents.turn.create(session_id=session_id, agent_id=agent.agent_id,
+                                           messages=[{"role": "user", "content": "Book a 1:1"}], stream=True)
+        assert read_fields_until(stream, "intent") == {"intent": "scheduling"}
+        assert time.perf_counter() - start < 0.5  # The full reply takes over a second to stream
+
+        stream = client.agents.turn.create(session_id=session_id, agent_id=agent.agent_id,
+                                           messages=[{"role": "user", "content": "Book a 1:1"}], stream=True)
+        with pytest.raises(ValueError):
+            read_fields_until(stream, "priority")
+        deadline = time.monotonic() + 2
+        while server.abandoned_streams < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert server.abandoned_streams == 1
+
+
+# --- batch_router ---
+
+def test_batch_router_uses_a_session_per_query_and_bounds_queues():
+    import contextlib
+    import threading
+    import time
+    from types import SimpleNamespace
+    from batch_router import BatchRouter
+
+    lock = threading.Lock()
+    active, peak, opened, closed = [0], [0], [], []
+
+    def answer(intent, query, session_id):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.02)
+        with lock:
+            active[0] -= 1
+        return f"{session_id}: {query}"
+
+    @contextlib.contextmanager
+    def session(intent):
+        with lock:
+            session_id = f"{intent}-{len(opened)}"
+            opened.append(session_id)
+        yield session_id
+        closed.append(session_id)
+
+    queries = [f"policy {i}" for i in range(20)] + ["billing 1"]
+    batch = BatchRouter(lambda q: SimpleNamespace(intent=q.split()[0]), answer, session,
+                        ["policy", "scheduling"], workers={"policy": 3, "scheduling": 1}, queue_size=2)
+    results = list(batch.run(iter(queries)))
+
+    assert sorted(r.query for r in results) == sorted(queries)
+    assert [r.error for r in results if r.error] == ["No handler for category 'billing'"]
+    assert len(set(opened)) == 20 and sorted(closed) == sorted(opened)  # Every query gets its own session
+    assert sorted(r.answer.split(":")[0] for r in results if r.answer) == sorted(opened)
+    assert peak[0] == 3
+    stats = batch.stats()
+    assert (stats.completed, stats.failed, stats.sessions) == (20, 1, 20)
+    assert stats.max_queue_depth["policy"] <= 2 and stats.queue_depth == {"policy": 0, "scheduling": 0}
+    assert stats.throughput > 0 and stats.latency(95, "policy") >= stats.latency(50, "policy") > 0
+
+
+# --- chain_pipeline ---
+
+def test_chain_pipeline_overlaps_stages_and_streams_jsonl(tmp_path):
+    import json
+    import threading
+    import time
+    from chain_pipeline import ChainPipeline, Stage, read_jsonl
+
+    lock = threading.Lock()
+    running = set()
+    overlapped = []
+
+    def call(stage, prompt):
+        with lock:
+            running.add(stage.name)
+            overlapped.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.discard(stage.name)
+        if "doc 3" in prompt and stage.name == "upper":
+            raise RuntimeError("boom")
+        return prompt.upper() if stage.name == "upper" else f"<{prompt}>"
+
+    source = tmp_path / "docs.jsonl"
+    source.write_text("".join(json.dumps({"id": f"d{i}", "text": f"doc {i}"}) + "\n" for i in range(8)))
+    output = tmp_path / "out.jsonl"
+    pipeline = ChainPipeline([Stage("wrap", "w:{input}", workers=2), Stage("upper", "u:{input}", workers=2)],
+                             call, queue_size=1)
+    items = {item.id: item for item in pipeline.run(read_jsonl(source), jsonl_path=output)}
+
+    assert items["d0"].result == "U:<W:DOC 0>"
+    assert items["d3"].error == "RuntimeError: boom" and items["d3"].failed_stage == "upper"
+    assert max(overlapped) == 2  # Both stages were busy at the same time
+    written = [json.loads(line) for line in output.read_text().splitlines()]
+    assert sorted(record["id"] for record in written) == sorted(items)
+    stats = pipeline.stats()
+    assert (stats.completed, stats.failed) == (7, 1)
+    assert stats.stages["upper"].processed == 7 and stats.stages["upper"].failed == 1
+    assert stats.stages["upper"].max_queue_depth <= 1
+
+
+def test_chain_checkpoints_resume_from_the_first_changed_stage(tmp_path):
+    from chain_checkpoints import ChainCheckpoints
+    from chain_pipeline import ChainPipeline, Stage
+
+    calls = []
+    fail = {"shout"}
+
+    def call(stage, prompt):
+        calls.append(stage.name)
+        if stage.name in fail:
+            raise RuntimeError("provider down")
+        return f"[{prompt}]"
+
+    def run(stages):
+        checkpoints = ChainCheckpoints(str(tmp_path / "checkpoints.sqlite"), "m", "be brief")
+        calls.clear()
+        items = list(ChainPipeline(stages, call, checkpoints=checkpoints).run([("a", "doc a"), ("b", "doc b")]))
+        report = checkpoints.report()
+        checkpoints.close()
+        return items, report
+
+    stages = [Stage("wrap", "w:{input}", 1), Stage("echo", "e:{input}", 1), Stage("shout", "s:{input}", 1)]
+    items, report = run(stages)
+    assert all(item.failed_stage == "shout" for item in items) and report.saved_calls == 0
+
+    fail.clear()  # Rerun after the failure: only the failed stage calls the LLM
+    items, report = run(stages)
+    assert sorted(calls) == ["shout", "shout"]
+    assert all(item.checkpointed == ["wrap", "echo"] and item.result.startswith("[s:") for item in items)
+    assert report.saved_calls == 4 and report.saved_tokens > 0 and report.stages == {"wrap": 2, "echo": 2}
+
+    stages[1] = Stage("echo", "E:{input}", 1)  # Changing a middle prompt recomputes it and everything after it
+    items, report = run(stages)
+    assert sorted(calls) == ["echo", "echo", "shout", "shout"] and report.saved_calls == 2
+
+
+def test_chain_checkpoints_are_opt_in_and_store_text_only(tmp_path, monkeypatch):
+    from chain_checkpoints import CHECKPOINT_PATH_ENV, DEFAULT_PATH, ChainCheckpoints, checkpoint_path
+    from chain_pipeline import Stage
+
+    monkeypatch.delenv(CHECKPOINT_PATH_ENV, raising=False)
+    assert checkpoint_path() is None
+    monkeypatch.setenv(CHECKPOINT_PATH_ENV, "1")
+    assert checkpoint_path() == DEFAULT_PATH
+
+    checkpoints = ChainCheckpoints(str(tmp_path / "checkpoints.sqlite"), "m")
+    stage = Stage("parse", "p:{input}", 1)
+    with pytest.raises(TypeError):
+        checkpoints.put(stage, "doc", {"not": "text"})
+    assert checkpoints.get(stage, "doc") is None and checkpoints.report().stored == 0
+    checkpoints.close()
+
+
+# --- agent_pool ---
+
+@requires_client
+def test_agent_pool_reuses_agents_and_sessions_and_survives_server_restarts(tmp_path):
+    import json
+    from llama_stack_client import LlamaStackClient
+    from agent_pool import AgentPool
+
+    path = str(tmp_path / "agents.json")
+    config = {"model": "m", "instructions": "Translate into French.",
+              "sampling_params": {"strategy": {"type": "top_p", "temperature": 0.5, "top_p": 0.85}}}
+    with StandInServer() as server:
+        client = LlamaStackClient(base_url=server.base_url)
+        pool = AgentPool(client, path=path, warm_sessions=1, max_session_turns=2)
+        agent = pool.agent(**config)
+        assert pool.agent(**dict(reversed(list(config.items())))) is agent  # Key order does not matter
+        sessions = []
+        for _ in range(3):
+            with pool.session(**config) as (borrowed, session_id):
+                assert borrowed is agent
+                sessions.append(session_id)
+        assert sessions[0] == sessions[1] != sessions[2]  # Retired after two turns
+        with pool.temporary_session(agent) as session_id:
+            assert session_id not in sessions
+        assert session_id not in agent.sessions
+        stats = pool.stats()
+        assert (stats.agents_created, stats.sessions_created, stats.sessions_reused, stats.sessions_retired) == (1, 3, 1, 2)
+
+        # An adopted session replaces the named one, which is deleted
+        main = pool.named_session(agent, "main")
+        kept = pool.create_session(agent, "speculative")
+        pool.adopt_session(agent, "main", kept)
+        assert pool.named_session(agent, "main") == kept and main not in agent.sessions
+        pool.retire_session(agent, kept)
+        assert pool.stats().sessions_retired == 4
+
+        # A new process adopts the saved agent id instead of creating another agent
+        creates = server.paths.count("/v1/agents")
+        adopted = AgentPool(LlamaStackClient(base_url=server.base_url), path=path)
+        assert adopted.agent(**config).agent_id == agent.agent_id
+        adopted.named_session(adopted.agent(**config), "main")
+        assert server.paths.count("/v1/agents") == creates and adopted.stats().agents_adopted == 1
+        port = int(server.base_url.rsplit(":", 1)[1])
+
+    # After a server restart the saved id is unknown: the pool notices on the first session and recreates the agent
+    with StandInServer(port=port) as restarted:
+        pool = AgentPool(LlamaStackClient(base_url=restarted.base_url), path=path)
+        fresh = pool.agent(**config)
+        assert pool.named_session(fresh, "main") == pool.named_session(fresh, "main")
+        assert fresh.agent_id != agent.agent_id
+        stats = pool.stats()
+        assert (stats.agents_adopted, stats.agents_stale, stats.agents_created) == (1, 1, 1)
+    with open(path) as f:
+        assert list(json.load(f).values()) == [fresh.agent_id]
+
+
+def test_agent_pool_keys_client_tools_by_their_definition():
+    from agent_pool import config_key
+
+    def lookup(employee_id: str) -> str:
+        """Look up an employee.
+        :param employee_id: the employee's id
+        """
+        return employee_id
+
+    first = config_key("http://x", {"model": "m", "tools": [lookup]})
+    assert config_key("http://x", {"model": "m", "tools": [lookup]}) == first
+
+    def lookup(employee_id: str, year: int = 2025) -> str:  # noqa: F811 - same name, new parameter
+        """Look up an employee.
+        :param employee_id: the employee's id
+        :param year: the year to report on
+        """
+        return employee_id
+
+    assert config_key("http://x", {"model": "m", "tools": [lookup]}) != first
+
+
+# --- rate_limiter ---
+
+def test_request_scheduler_serves_interactive_lane_before_batch():
+    import threading
+    import time
+    import rate_limiter
+
+    scheduler = rate_limiter.RequestScheduler({"m": rate_limiter.Limit(rpm=1200)}, burst_seconds=0)
+    order = []
+
+    def request(lane_name):
+        with rate_limiter.lane(lane_name):
+            scheduler.acquire("m", "m", 10)
+            order.append(lane_name)
+
+    scheduler.acquire("m", "m", 10)  # Empty the bucket; the next request fits in 50 ms
+    threads = [threading.Thread(target=request, args=("batch",)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.01)
+    request("interactive")
+    for thread in threads:
+        thread.join()
+    assert order.index("interactive") <= 1
+    metrics = scheduler.metrics()
+    assert metrics["batch"].requests == 4 and metrics["batch"].max_queued == 4
+    assert metrics["batch"].wait(95) >= 0.15
+    assert 'llama_stack_queue_wait_seconds_count{lane="batch"} 4' in scheduler.prometheus()
+
+    # Lanes are ordered per provider bucket, across the provider's models
+    shared = rate_limiter.RequestScheduler({"p": rate_limiter.Limit(rpm=1200)}, burst_seconds=0)
+    order = []
+
+    def on_model(lane_name, model):
+        with rate_limiter.lane(lane_name):
+            shared.acquire("p", model, 10)
+            order.append(lane_name)
+
+    shared.acquire("p", "a", 10)
+    threads = [threading.Thread(target=on_model, args=("batch", "a")) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.01)
+    on_model("interactive", "b")
+    for thread in threads:
+        thread.join()
+    assert order.index("interactive") == 0
+
+
+def test_rate_limits_and_retry_after_parsing():
+    import rate_limiter
+
+    limits = rate_limiter.parse_limits("together=600/200000, llama3.2:1b=60/, meta-llama/Llama-3.2-3B=/9000")
+    assert limits["together"] == rate_limiter.Limit(600, 200000)
+    assert limits["llama3.2:1b"] == rate_limiter.Limit(60, None)
+    assert limits["meta-llama/Llama-3.2-3B"] == rate_limiter.Limit(None, 9000)
+    assert rate_limiter.retry_after({"retry-after": "2"}) == 2.0
+    assert rate_limiter.retry_after({"retry-after-ms": "250"}) == 0.25
+    assert rate_limiter.retry_after({"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"}) == 0.0
+    assert rate_limiter.retry_after({}) is None
+
+
+@requires_client
+def test_scheduled_client_pauses_on_429s_and_charges_agent_turns_to_their_model():
+    from llama_stack_client import Agent, LlamaStackClient
+    import client_pool
+    import rate_limiter
+
+    scheduler = rate_limiter.RequestScheduler()
+    with StandInServer(rate_limit=50) as server:
+        client = LlamaStackClient(base_url=server.base_url, max_retries=4,
+                                  http_client=client_pool.build_http_client(2, False, scheduler=scheduler))
+        client.models.list()
+        for _ in range(6):
+            client.inference.chat_completion(model_id="llama3.2:1b", messages=[{"role": "user", "content": "Hi"}])
+        agent = Agent(client, model="meta-llama/Llama-3.2-3B-Instruct-Turbo", instructions="Be brief.")
+        provider, model, tokens = scheduler.classify(client._client.build_request(
+            "POST", f"{server.base_url}/v1/agents/{agent.agent_id}/session/s/turn",
+            json={"messages": [{"role": "user", "content": "Hello"}]}))
+        assert server.throttled >= 1
+    assert (provider, model) == ("together", "meta-llama/Llama-3.2-3B-Instruct-Turbo")
+    assert tokens > rate_limiter.DEFAULT_COMPLETION_TOKENS
+    metrics = scheduler.metrics()["interactive"]
+    # The client's retries are the only retries: each 429 was sent once and paused the provider once
+    assert metrics.throttled == server.throttled and metrics.paused > 0
+    assert metrics.requests == 1 + 6 + 1 + server.throttled  # models.list, chats, agents.create, one resend per 429
+    assert "ollama" in scheduler._buckets
+
+
+# --- hedged_requests ---
+
+@requires_client
+def test_hedger_sends_a_backup_only_after_the_deadline_and_fails_over_on_errors():
+    from llama_stack_client import LlamaStackClient
+    import hedged_requests
+
+    with StandInServer(token_latency=0.01, model_latency={"primary": 0.0, "backup": 0.0}) as server:
+        client = LlamaStackClient(base_url=server.base_url)
+
+        def open_stream(target, question):
+            if question == "fail" and target == "primary":
+                raise RuntimeError("primary down")
+            return client.inference.chat_completion(
+                model_id=target, messages=[{"role": "user", "content": question}], stream=True)
+
+        hedger = hedged_requests.Hedger(open_stream, "primary", "backup", initial_deadline=0.1)
+        fast = hedger.run("one two three")
+        server.model_latency["primary"] = 1.0
+        slow = hedger.run("one two three")
+        failed_over = hedger.run("fail")
+
+    assert (fast.winner, fast.hedged, fast.result.text) == ("primary", False, "Echo: one two three")
+    assert (slow.winner, slow.hedged) == ("backup", True)
+    assert slow.latency < 0.5
+    assert failed_over.winner == "backup" and "primary down" in failed_over.errors["primary"]
+    assert failed_over.latency < 0.1 + 0.05
+    assert len(hedger._ttft) == 2  # The fast first token and the slow primary's censored one, not the failure
+    stats = hedger.stats()
+    assert (stats.requests, stats.hedged, stats.backup_wins) == (3, 2, 2)
+
+
+# --- provider_router ---
+
+@requires_client
+def test_provider_router_follows_latency_respects_tiers_and_persists(tmp_path):
+    import pytest
+    from llama_stack_client import LlamaStackClient
+    import provider_router
+    from stream_metrics import consume
+
+    hosted = provider_router.Candidate("meta-llama/Llama-3.2-3B-Instruct-Turbo", "together", tier=2)
+    local = provider_router.Candidate("llama3.2:1b", "ollama", tier=1)
+    path = str(tmp_path / "router.json")
+    with StandInServer(model_latency={hosted.model: 0.05, local.model: 0.0}) as server:
+        client = LlamaStackClient(base_url=server.base_url)
+        down = set()
+
+        def ask(candidate):
+            if candidate in down:
+                raise RuntimeError("provider down")
+            return consume(client.inference.chat_completion(
+                model_id=candidate.model, messages=[{"role": "user", "content": "Hi"}], stream=True))
+
+        router = provider_router.ProviderRouter([hosted, local], path=path, explore_rate=0.0, explore_after=3600)
+        picks = [router.call(ask)[0] for _ in range(6)]
+        assert set(picks[:2]) == {hosted, local}  # Every candidate is tried once before ranking
+        assert picks[2:] == [local] * 4
+        assert router.call(ask, min_tier=2)[0] == hosted
+        with pytest.raises(ValueError):
+            router.choose(min_tier=3)
+
+        down.add(local)
+        assert router.call(ask)[0] == hosted  # Failed over, and the error is counted
+        stats = router.stats()
+        assert stats[local.key].error_rate > 0 and stats[hosted.key].tokens_per_second > 0
+        router.save()
+
+    restored = provider_router.ProviderRouter([hosted, local], path=path, explore_rate=0.0, explore_after=3600)
+    assert len(restored.stats()[local.key].samples) == 6
+    assert restored.choose() == local
+
+
+# --- rag_ingest ---
+
+def test_streaming_chunker_cuts_at_whitespace_with_overlap():
+    from rag_ingest import StreamingChunker
+
+    text = " ".join(f"w{i:03d}" for i in range(100))  # 100 five-character words
+    chunker = StreamingChunker(chunk_tokens=10, overlap_tokens=2)
+    chunks = [chunk for i in range(0, len(text), 7) for chunk in chunker.feed(text[i:i + 7])] + list(chunker.close())
+    assert all(len(chunk) <= 40 for chunk in chunks)
+    assert all(earlier.split()[-1] == later.split()[0] for earlier, later in zip(chunks, chunks[1:]))
+    assert sorted({word for chunk in chunks for word in chunk.split()}) == text.split()
+
+
+@requires_client
+def test_rag_ingestor_fetches_urls_files_and_text_in_batches(tmp_path):
+    from llama_stack_client import LlamaStackClient
+    from rag_ingest import RAGIngestor, Source, sources_from_documents
+
+    words = " ".join(f"word{i}" for i in range(500))
+    local = tmp_path / "local.md"
+    local.write_text(words)
+    files = {f"docs/{i}.md": words for i in range(10)}
+    with StandInServer(files=files) as server:
+        client = LlamaStackClient(base_url=server.base_url)
+        sources = [Source(path, location=server.file_url(path), metadata={"source": "web"}) for path in files]
+        sources += [Source("local", location=str(local)), Source("missing", location=server.file_url("nope.md"))]
+        sources += list(sources_from_documents([{"document_id": "inline", "content": "Alpaca 7 is an AGI model"}]))
+        sources.append(Source("docs/0.md", text="A second document under an id already in this run"))
+        reports = []
+        ingestor = RAGIngestor(client, "kb", chunk_size_in_tokens=64, batch_size=16, fetch_workers=4,
+                               queue_size=8, progress=reports.append, progress_interval=0.01)
+        stats = ingestor.run(iter(sources))
+        stored = server.chunks["kb"]
+
+    assert (stats.documents, stats.failed) == (12, 2)
+    assert sorted(document_id for document_id, _ in stats.errors) == ["docs/0.md", "missing"]
+    assert stats.chunks == len(stored) and stats.failed_chunks == 0
+    assert stats.batches < stats.chunks / 4 and stats.max_queue_depth <= 8
+    by_document = {}
+    for chunk in stored:
+        by_document.setdefault(chunk["metadata"]["document_id"], []).append(chunk)
+    assert set(by_document) == set(files) | {"local", "inline"}
+    document = sorted(by_document["docs/0.md"], key=lambda chunk: chunk["metadata"]["chunk_index"])
+    assert " ".join(chunk["content"] for chunk in document) == words
+    assert document[0]["metadata"]["source"] == "web"
+    assert reports and stats.documents_per_second > 0 and stats.chunks_per_second > 0
+
+
+
+@requires_client
+def test_rag_ingestor_keeps_inserting_when_recording_a_document_fails(tmp_path):
+    import threading
+    from llama_stack_client import LlamaStackClient
+    from ingest_manifest import IngestManifest
+    from rag_ingest import RAGIngestor, Source
+
+    words = " ".join(f"word{i}" for i in range(200))
+    with StandInServer() as server:
+        client = LlamaStackClient(base_url=server.base_url)
+        manifest = IngestManifest(str(tmp_path / "manifest.sqlite"), server.base_url, "kb")
+
+        def broken_record(*args, **kwargs):
+            raise RuntimeError("disk full")
+
+        manifest.record = broken_record
+        ingestor = RAGIngestor(client, "kb", chunk_size_in_tokens=16, batch_size=4, fetch_workers=2,
+                               insert_workers=1, queue_size=2, progress=None, manifest=manifest)
+        result = []
+        worker = threading.Thread(target=lambda: result.append(ingestor.run([Source(str(i), text=words) for i in range(6)])),
+                                  daemon=True)
+        worker.start()
+        worker.join(timeout=30)
+        assert result, "ingestion hung after the inserter hit an error"
+        stored = len(server.chunks["kb"])
+
+    stats = result[0]
+    assert stats.documents == 6 and stats.chunks == stored and stats.failed_chunks == 0
+    assert sorted(document_id for document_id, _ in stats.errors) == [str(i) for i in range(6)]
+    assert all("disk full" in message for _, message in stats.errors)
+
+
+# --- ingest_manifest ---
+
+@requires_client
+def test_ingest_manifest_skips_unchanged_documents_and_tracks_stale_chunks(tmp_path):
+    from llama_stack_client import LlamaStackClient
+    from ingest_manifest import IngestManifest, ensure_vector_db
+    from rag_ingest import RAGIngestor, Source
+    from registry_cache import RegistryCache
+
+    words = " ".join(f"word{i}" for i in range(500))
+    files = {f"docs/{i}.md": words for i in range(5)}
+    with StandInServer(files=files) as server:
+        client = LlamaStackClient(base_url=server.base_url)
+        registry = RegistryCache(client, path="")
+        manifest = IngestManifest(str(tmp_path / "manifest.sqlite"), server.base_url, "kb")
+        register = {"embedding_model": "all-MiniLM-L6-v2", "embedding_dimension": 384}
+        assert ensure_vector_db(client, registry, "kb", manifest, **register)
+        inline = Source("inline", text="Alpaca 7 is an AGI model")
+
+        def ingest(paths):
+            sources = [Source(path, location=server.file_url(path)) for path in paths] + [inline]
+            return RAGIngestor(client, "kb", chunk_size_in_tokens=64, manifest=manifest).run(sources)
+
+        first = ingest(files)
+        inserted = len(server.chunks["kb"])
+        per_file = (inserted - 1) // 5
+        assert first.chunks == inserted and manifest.live_chunks() == inserted
+        assert not ensure_vector_db(client, registry, "kb", manifest, **register)
+
+        second = ingest(files)
+        assert (second.skipped, second.chunks, len(server.chunks["kb"])) == (6, 0, inserted)
+        assert server.not_modified == 5
+        report = manifest.report()
+        assert (report.added, report.not_modified, report.unchanged) == (6, 5, 1)
+        assert report.embeddings_avoided == inserted
+
+        server.put_file("docs/0.md", words + " word500")
+        third = ingest([path for path in files if path != "docs/4.md"])
+        assert (third.skipped, third.documents) == (4, 5) and third.chunks > 0
+        report = manifest.report()
+        assert (report.modified, report.removed) == (1, 1)
+        assert manifest.stale_chunks() == 2 * per_file and manifest.needs_compaction()
+
+        assert ensure_vector_db(client, registry, "kb", manifest, **register)
+        assert "kb" not in server.chunks and manifest.stale_chunks() == manifest.live_chunks() == 0
+        manifest.close()
+
+
+def test_ingest_manifest_needs_compaction_for_a_single_stale_chunk(tmp_path):
+    from ingest_manifest import IngestManifest
+
+    manifest = IngestManifest(str(tmp_path / "manifest.sqlite"), "http://x", "kb")
+    for i in range(10):
+        manifest.record(f"doc{i}", "v1", 100)
+    manifest.record("note", "v1", 1)
+    assert not manifest.needs_compaction()
+    manifest.record("note", "v2", 1)  # One stale chunk among a thousand is still retrievable
+    assert manifest.stale_chunks() == 1 and manifest.needs_compaction()
+    manifest.close()
+
+
+# --- embedding_cache ---
+
+def test_embedding_cache_computes_each_text_once_and_is_readable_from_another_process(tmp_path):
+    import subprocess
+    import sys
+    from pathlib import Path
+    import numpy as np
+    from embedding_cache import EmbeddingCache
+
+    calls = []
+
+    def compute(texts):
+        calls.append(list(texts))
+        return [[float(len(text)), 1.0, 2.0] for text in texts]
+
+    cache = EmbeddingCache(str(tmp_path), dtype="float16")
+    vectors = cache.embed("m", ["a", "bb", "a", "ccc"], compute, batch_size=2)
+    assert calls == [["a", "bb"], ["ccc"]]
+    assert vectors.dtype == np.float32 and vectors.tolist()[2] == [1.0, 1.0, 2.0]
+    assert cache.embed("m", ["ccc", "bb"], compute).tolist() == [[3.0, 1.0, 2.0], [2.0, 1.0, 2.0]]
+    assert len(calls) == 2 and cache.stats().hits == 2 and cache.entries("m") == 3
+    assert cache.lookup("other model", ["a"]) == [None]
+    with pytest.raises(ValueError):
+        cache.fill("m", ["dddd"], [[1.0, 2.0]])
+
+    # A writer that died after appending a vector but before its key leaves a partial row behind
+    store = next(path for path in tmp_path.iterdir() if path.name.startswith("m-"))
+    with open(store / "vectors.bin", "ab") as f:
+        f.write(b"\0" * 5)
+    assert cache.fill("m", ["dddd"], [[4.0, 1.0, 2.0]]) == 1
+    assert (store / "vectors.bin").stat().st_size == 4 * 3 * 2 and cache.size_on_disk() > 0
+
+    reader = "import sys; from embedding_cache import EmbeddingCache; print(EmbeddingCache(sys.argv[1]).lookup('m', ['dddd', 'a', 'nope']))"
+    out = subprocess.run([sys.executable, "-c", reader, str(tmp_path)], cwd=Path(__file__).parent,
+                         capture_output=True, text=True, check=True).stdout
+    assert "array([4., 1., 2.]" in out and out.strip().endswith("None]")
+
+
+@requires_client
+def test_rag_ingestor_sends_cached_embeddings(tmp_path):
+    from llama_stack_client import LlamaStackClient
+    from embedding_cache import EmbeddingCache
+    from rag_ingest import RAGIngestor, Source
+
+    words = " ".join(f"word{i}" for i in range(300))
+    with StandInServer() as server:
+        client = LlamaStackClient(base_url=server.base_url)
+        cache = EmbeddingCache(str(tmp_path))
+        for vector_db_id in ("kb1", "kb2"):
+            RAGIngestor(client, vector_db_id, chunk_size_in_tokens=64, embedding_cache=cache,
+                        embedding_model="all-MiniLM-L6-v2", progress=None).run([Source("doc", text=words)])
+        first, second = server.chunks["kb1"], server.chunks["kb2"]
+
+    assert server.embedded == len(first) and cache.stats().hits == len(second)
+    assert [chunk["embedding"] for chunk in first] == [chunk["embedding"] for chunk in second]
+    assert len(first[0]["embedding"]) == 384
+
+
+# --- vector_index ---
+
+def test_vector_index_exact_and_ivf_search_removal_and_persistence(tmp_path):
+    import numpy as np
+    from vector_index import VectorIndex
+
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((20, 16))
+    vectors = centers[rng.integers(20, size=3000)] + rng.standard_normal((3000, 16)) * 0.3
+    chunks = [{"content": f"chunk {i}", "metadata": {"document_id": f"doc{i % 100}"}} for i in range(3000)]
+    queries = vectors[:50] + rng.standard_normal((50, 16)) * 0.05
+
+    exact = VectorIndex(16)
+    exact.add(vectors, chunks)
+    scores, rows = exact.search(queries, k=5)
+    assert rows.shape == (50, 5) and (np.diff(scores, axis=1) <= 1e-6).all()
+    assert (rows[:, 0] == np.arange(50)).mean() > 0.9
+
+    ivf = VectorIndex(16, mode="ivf", nlist=30, nprobe=1)
+    ivf.add(vectors, chunks)
+    recall = lambda found: np.mean([len(set(a) & set(b)) / 5 for a, b in zip(found.tolist(), rows.tolist())])
+    narrow, wide = recall(ivf.search(queries, 5)[1]), recall(ivf.search(queries, 5, nprobe=30)[1])
+    assert ivf.trained and narrow < wide == 1.0
+
+    assert ivf.remove_documents(["doc0", "doc1"]) == 60 and len(ivf) == 2940
+    assert all(ivf.chunk(row)["metadata"]["document_id"] not in ("doc0", "doc1")
+               for row in ivf.search(queries, 5, nprobe=30)[1].ravel())
+    path = tmp_path / "index.npz"
+    ivf.save(str(path))
+    loaded = VectorIndex.load(str(path))
+    assert len(loaded) == 2940 and loaded.trained and loaded.mode == "ivf"
+    assert [chunk for _, chunk in loaded.query(queries[5], k=3, nprobe=30)] == \
+           [chunk for _, chunk in ivf.query(queries[5], k=3, nprobe=30)]
+
+    small = VectorIndex(16)
+    small.add(vectors[:2])
+    assert small.search(vectors[1], k=4)[1].tolist() == [[1, 0, -1, -1]]
+
+
+@requires_client
+def test_rag_ingestor_mirrors_chunks_into_a_local_index_for_rag_query():
+    from llama_stack_client import LlamaStackClient
+    from embedding_cache import embedder
+    from rag_ingest import RAGIngestor, Source
+    from vector_index import VectorIndex, rag_query
+
+    documents = [Source("alpaca", text="Alpaca 7 is the first Artificial General Intelligence model"),
+                 Source("agi", text="AGI can understand, learn and apply knowledge across many tasks")]
+    with StandInServer() as server:
+        client = LlamaStackClient(base_url=server.base_url)
+        index = VectorIndex(384)
+        ingestor = RAGIngestor(client, "kb", chunk_size_in_tokens=8, embedding_model="all-MiniLM-L6-v2",
+                               local_index=index, progress=None)
+        ingestor.run(documents)
+        first = len(server.chunks["kb"])
+        ingestor.run([Source("alpaca", text="Alpaca 7 is the first Artificial General Intelligence model")])
+        result = rag_query(index, embedder(client, "all-MiniLM-L6-v2"), "What is Alpaca 7?", k=2)
+
+    assert len(index) == first  # The re-ingested document replaced its own chunks
+    assert result.metadata["document_ids"][0] == "alpaca"
+    assert "Content: Alpaca 7 is" in result.content[1].text
+
+
+# --- query_cache ---
+
+def test_normalize_query_folds_case_punctuation_and_contractions():
+    from query_cache import normalize_query
+
+    assert normalize_query("What is llama stack?") == normalize_query("  what’s Llama   Stack ") == "what is llama stack"
+    assert normalize_query("Who's there?") != normalize_query("What is there?")
+
+
+@requires_client
+def test_query_cache_serves_repeats_and_near_duplicates_until_the_vector_db_changes():
+    from llama_stack_client import LlamaStackClient
+    from embedding_cache import embedder
+    from query_cache import QueryCache, enable_query_cache
+
+    with StandInServer() as server:
+        client = LlamaStackClient(base_url=server.base_url)
+        cache = QueryCache(threshold=0.85)
+        enable_query_cache(client, cache, embed=embedder(client, "all-MiniLM-L6-v2"))
+        client.vector_io.insert(vector_db_id="kb", chunks=[
+            {"content": "Llama Stack is a set of APIs", "metadata": {"document_id": "intro"}}])
+        rag_tool = client.tool_runtime.rag_tool
+
+        def queries():
+            return server.paths.count("/v1/tool-runtime/rag-tool/query")
+
+        first = rag_tool.query(content="What is llama stack?", vector_db_ids=["kb"])
+        assert "Llama Stack is a set of APIs" in first.content[1].text
+        assert rag_tool.query(content="what's Llama Stack", vector_db_ids=["kb"]) is first
+        assert rag_tool.query(content="So what is Llama Stack?", vector_db_ids=["kb"]) is first
+        assert rag_tool.query(content="What is llama stack?", vector_db_ids=["kb", "other"]) is not first
+        assert queries() == 2
+        stats = cache.stats()
+        assert (stats.exact_hits, stats.similar_hits, stats.misses) == (1, 1, 2) and stats.hit_rate == 0.5
+        # The remembered paraphrase expires with the result it copies
+        assert len({entry.created for entry in cache._entries.values() if entry.result is first}) == 1
+
+        client.vector_io.insert(vector_db_id="kb", chunks=[{"content": "New page", "metadata": {"document_id": "new"}}])
+        assert cache.stats().invalidated == 3 and len(cache) == 0  # Both phrasings and the two-DB query
+        rag_tool.query(content="What is llama stack?", vector_db_ids=["kb"])
+        assert queries() == 3
+
+        # A result fetched while its vector DB was written to is not cached
+        generation = cache.generation(["kb"])
+        cache.invalidate("kb")
+        cache.put("Anything", ["kb"], None, first, 0.1, generation=generation)
+        assert cache.get_exact("Anything", ["kb"]) is None
+
+
+# --- shared_utils ---
+
+def test_percentile_uses_nearest_rank():
+    from shared_utils import percentile
+
+    assert percentile([], 50) == 0.0
+    assert percentile([3, 1, 2, 4], 50) == 2 and percentile([3, 1, 2, 4], 99) == 4 and percentile([5], 0) == 5
+
+
+def test_backoff_delays_grow_with_jitter_and_cap():
+    import itertools
+    from shared_utils import backoff_delays
+
+    delays = list(itertools.islice(backoff_delays(initial=0.1, maximum=0.4, jitter=0.5), 6))
+    assert 0.05 <= delays[0] <= 0.1
+    assert all(0.2 <= d <= 0.4 for d in delays[3:])
+    assert len(set(delays)) > 1
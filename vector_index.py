@@ -0,0 +1,325 @@
+"""
+vector_index.py
+---------------
+In-process vector index for 12-llama-stack-tool-rag.py, used as a local stand-in or near-cache for
+`rag_tool.query` so that retrieval does not round-trip to the server's `inline::faiss` provider.
+Vectors are kept unit-length, so the inner product is the cosine similarity (and ranks like faiss' L2 distance).
+The exact mode scores every stored vector with NumPy, in blocks so memory stays flat. The approximate mode is an
+inverted file (IVF): k-means splits the vectors into `nlist` lists, and a query only scores the `nprobe` lists
+whose centroids are closest, so raising `nprobe` trades speed for recall. Chunks (content and metadata) are kept
+next to their vectors, documents can be removed, and `save()`/`load()` persist everything to one .npz file.
+Run this file directly to benchmark recall@k, query latency and build time at 10k, 100k and 1M chunks.
+"""
+
+import json  # For chunk payloads and settings inside the .npz file
+import logging  # For quiet benchmark output
+import math  # For the default number of lists
+import os  # For paths and atomic replacement
+import tempfile  # For atomic writes
+import threading  # For guarding the index between ingest workers and queries
+import time  # For build time and latency
+from typing import Optional
+
+import numpy as np  # For vectorized scoring (installed with faiss-cpu)
+
+from shared_utils import percentile  # Shared nearest-rank percentile
+
+# Setting this to a file path makes script 12 answer queries from a local index saved there
+LOCAL_INDEX_PATH_ENV = "LLAMA_STACK_LOCAL_INDEX"
+MODES = ("exact", "ivf")
+DEFAULT_NPROBE = 8
+KMEANS_ITERATIONS = 10
+TRAIN_POINTS_PER_LIST = 64  # k-means trains on a sample of this many vectors per list
+MIN_TRAIN_SIZE = 1024  # Below this many vectors the IVF mode searches exactly
+SEARCH_BLOCK = 65536  # Vectors scored at a time by exact search
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _top_k(scores, rows, k):
+    """Best k (scores, rows) of each query row, best first; short rows are padded with -inf / -1."""
+    if scores.shape[1] > k:
+        keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores, rows = np.take_along_axis(scores, keep, 1), np.take_along_axis(rows, keep, 1)
+    order = np.argsort(-scores, axis=1, kind="stable")
+    scores, rows = np.take_along_axis(scores, order, 1), np.take_along_axis(rows, order, 1)
+    if scores.shape[1] < k:
+        pad = k - scores.shape[1]
+        scores = np.pad(scores, ((0, 0), (0, pad)), constant_values=-np.inf)
+        rows = np.pad(rows, ((0, 0), (0, pad)), constant_values=-1)
+    return scores, rows
+
+
+def kmeans(vectors, clusters, iterations=KMEANS_ITERATIONS, seed=0):
+    """Spherical k-means: unit-length centroids of unit-length `vectors`, and each vector's cluster."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = _nearest(vectors, centroids)
+        sums = np.stack([np.bincount(assignment, weights=vectors[:, j], minlength=clusters)
+                         for j in range(vectors.shape[1])], axis=1)
+        empty = np.bincount(assignment, minlength=clusters) == 0
+        # Re-seed empty clusters with random vectors instead of letting them die
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        centroids = _normalize(sums)
+    return centroids, _nearest(vectors, centroids)
+
+
+def _nearest(vectors, centroids):
+    return np.concatenate([np.argmax(vectors[start:start + SEARCH_BLOCK] @ centroids.T, axis=1)
+                           for start in range(0, len(vectors), SEARCH_BLOCK)]) if len(vectors) else np.empty(0, np.int64)
+
+
+class VectorIndex:
+    """
+    `add(vectors, chunks)` stores unit-length copies of the vectors with their chunks; `search(queries, k)` returns
+    (scores, rows) arrays of shape (queries, k), best first, with row -1 where fewer than k vectors exist.
+    In "ivf" mode the lists are trained by `train()`, or by the first search that needs them; vectors added later
+    join the nearest existing list until the next `train()`.
+    """
+
+    def __init__(self, dimension, mode="exact", nlist=None, nprobe=DEFAULT_NPROBE, seed=0):
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode {mode!r}; expected one of {MODES}")
+        self.dimension = dimension
+        self.mode = mode
+        self.nlist = nlist  # None picks about sqrt(size) lists when training
+        self.nprobe = nprobe
+        self.seed = seed
+        self._vectors = np.empty((0, dimension), dtype=np.float32)
+        self._size = 0
+        self._deleted = np.empty(0, dtype=bool)
+        self._chunks: list = []
+        self._rows_by_document: dict = {}
+        self._centroids: Optional[np.ndarray] = None
+        self._assignment = np.empty(0, dtype=np.int32)
+        self._lists: Optional[tuple] = None  # (rows ordered by list, start offset of each list)
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        with self._lock:
+            return self._size - int(self._deleted[:self._size].sum())
+
+    @property
+    def trained(self):
+        return self._centroids is not None
+
+    def reserve(self, size):
+        """Grow the storage to hold `size` vectors at once, avoiding repeated copies while adding."""
+        with self._lock:
+            if size > len(self._vectors):
+                vectors = np.empty((size, self.dimension), dtype=np.float32)
+                vectors[:self._size] = self._vectors[:self._size]
+                deleted = np.zeros(size, dtype=bool)
+                deleted[:self._size] = self._deleted[:self._size]
+                self._vectors, self._deleted = vectors, deleted
+
+    def add(self, vectors, chunks=None):
+        """Add vectors (and their chunks, e.g. vector IO chunk dicts); returns their rows."""
+        vectors = _normalize(vectors)
+        if vectors.shape[1] != self.dimension:
+            raise ValueError(f"Expected {self.dimension}-dimensional vectors, got {vectors.shape[1]}")
+        chunks = list(chunks) if chunks is not None else [None] * len(vectors)
+        with self._lock:
+            start = self._size
+            if start + len(vectors) > len(self._vectors):
+                self.reserve(max(start + len(vectors), int(len(self._vectors) * 1.5)))
+            self._vectors[start:start + len(vectors)] = vectors
+            self._deleted[start:start + len(vectors)] = False
+            for row, chunk in enumerate(chunks, start=start):
+                if chunk:
+                    self._rows_by_document.setdefault((chunk.get("metadata") or {}).get("document_id"), []).append(row)
+            self._chunks.extend(chunks)
+            self._size += len(vectors)
+            if self.trained:
+                self._assignment = np.concatenate([self._assignment, _nearest(vectors, self._centroids).astype(np.int32)])
+                self._lists = None
+            return np.arange(start, self._size)
+
+    def remove_documents(self, document_ids):
+        """Drop the chunks whose metadata names one of `document_ids`; returns how many were dropped."""
+        with self._lock:
+            rows = [row for document_id in set(document_ids) for row in self._rows_by_document.pop(document_id, [])]
+            self._deleted[rows] = True
+            return len(rows)
+
+    def chunk(self, row):
+        return self._chunks[row]
+
+    def train(self):
+        """Cluster the stored vectors into lists (IVF mode)."""
+        with self._lock:
+            live = np.flatnonzero(~self._deleted[:self._size])
+            nlist = min(self.nlist or max(1, int(math.sqrt(len(live)))), len(live))
+            rng = np.random.default_rng(self.seed)
+            sample = live if len(live) <= nlist * TRAIN_POINTS_PER_LIST else \
+                rng.choice(live, nlist * TRAIN_POINTS_PER_LIST, replace=False)
+            self._centroids, _ = kmeans(self._vectors[np.sort(sample)], nlist, seed=self.seed)
+            self._assignment = _nearest(self._vectors[:self._size], self._centroids).astype(np.int32)
+            self._lists = None
+
+    def _inverted_lists(self):
+        if self._lists is None:
+            order = np.argsort(self._assignment, kind="stable")
+            starts = np.searchsorted(self._assignment[order], np.arange(len(self._centroids) + 1))
+            self._lists = (order, starts)
+        return self._lists
+
+    def search(self, queries, k=5, nprobe=None, exact=None):
+        """
+        Top-k rows for each query. `exact=True` scores every vector whatever the mode;
+        `nprobe` overrides the number of lists scanned in IVF mode.
+        """
+        queries = _normalize(queries)
+        with self._lock:
+            if exact is None:
+                exact = self.mode == "exact" or len(self) < MIN_TRAIN_SIZE
+            if exact:
+                return self._search_exact(queries, k)
+            if not self.trained:
+                self.train()
+            return self._search_ivf(queries, k, nprobe or self.nprobe)
+
+    def _search_exact(self, queries, k):
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.full((len(queries), 0), -1, dtype=np.int64)
+        for start in range(0, self._size, SEARCH_BLOCK):
+            stop = min(start + SEARCH_BLOCK, self._size)
+            scores = queries @ self._vectors[start:stop].T
+            scores[:, self._deleted[start:stop]] = -np.inf
+            rows = np.broadcast_to(np.arange(start, stop), scores.shape)
+            best_scores, best_rows = _top_k(np.concatenate([best_scores, scores], 1),
+                                            np.concatenate([best_rows, rows], 1), k)
+        return self._drop_deleted(*_top_k(best_scores, best_rows, k))
+
+    def _search_ivf(self, queries, k, nprobe):
+        order, starts = self._inverted_lists()
+        nprobe = min(nprobe, len(self._centroids))
+        probes = _top_k(queries @ self._centroids.T, np.broadcast_to(np.arange(len(self._centroids)),
+                                                                     (len(queries), len(self._centroids))), nprobe)[1]
+        all_scores, all_rows = [], []
+        for query, lists in zip(queries, probes):
+            rows = np.concatenate([order[starts[j]:starts[j + 1]] for j in lists])
+            rows = rows[~self._deleted[rows]]
+            scores, rows = _top_k((self._vectors[rows] @ query)[None, :], rows[None, :], k)
+            all_scores.append(scores[0])
+            all_rows.append(rows[0])
+        return self._drop_deleted(np.array(all_scores), np.array(all_rows))
+
+    @staticmethod
+    def _drop_deleted(scores, rows):
+        rows = np.where(np.isfinite(scores), rows, -1)
+        return scores, rows
+
+    def query(self, vector, k=5, nprobe=None):
+        """[(score, chunk)] for one query vector, best first."""
+        scores, rows = self.search(vector, k, nprobe)
+        return [(float(score), self._chunks[row]) for score, row in zip(scores[0], rows[0]) if row >= 0]
+
+    def save(self, path):
+        """Write the live vectors, chunks and IVF lists to `path` (.npz) atomically."""
+        with self._lock:
+            live = np.flatnonzero(~self._deleted[:self._size])
+            settings = {"dimension": self.dimension, "mode": self.mode, "nlist": self.nlist, "nprobe": self.nprobe,
+                        "seed": self.seed}
+            arrays = {
+                "vectors": self._vectors[live],
+                "settings": np.array(json.dumps(settings)),
+                "chunks": np.array(json.dumps([self._chunks[row] for row in live])),
+            }
+            if self.trained:
+                arrays["centroids"] = self._centroids
+                arrays["assignment"] = self._assignment[live]
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temp file and rename so concurrent readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            index = cls(**json.loads(str(data["settings"])))
+            index.add(data["vectors"], json.loads(str(data["chunks"])))
+            if "centroids" in data:
+                index._centroids = data["centroids"]
+                index._assignment = data["assignment"].astype(np.int32)
+        return index
+
+
+def rag_query(index, embed, content, k=5, nprobe=None):
+    """
+    Answer like `client.tool_runtime.rag_tool.query(content=..., vector_db_ids=[...])` from a local index.
+    `embed(texts)` returns the query embedding, e.g. embedding_cache.embedder(client, "all-MiniLM-L6-v2").
+    """
+    from llama_stack_client.types import QueryResult  # Same result type as rag_tool.query
+
+    hits = index.query(np.asarray(embed([content]), dtype=np.float32)[0], k, nprobe)
+    items = [{"type": "text", "text": f"knowledge_search tool found {len(hits)} chunks:\nBEGIN of knowledge_search tool results.\n"}]
+    for number, (score, chunk) in enumerate(hits, start=1):
+        metadata = chunk.get("metadata") or {}
+        items.append({"type": "text", "text": f"Result {number}:\nDocument_id:{metadata.get('document_id')}\n"
+                                              f"Content: {chunk.get('content')}\n"})
+    items.append({"type": "text", "text": "END of knowledge_search tool results.\n"})
+    return QueryResult(content=items, metadata={
+        "document_ids": [(chunk.get("metadata") or {}).get("document_id") for _, chunk in hits],
+        "scores": [score for score, _ in hits],
+    })
+
+
+def _clustered(rng, count, centers, noise=1.5, block=100_000):
+    """Unit vectors scattered around `centers`, like embeddings of documents on a set of topics."""
+    for start in range(0, count, block):
+        size = min(block, count - start)
+        points = centers[rng.integers(len(centers), size=size)]
+        points += rng.standard_normal(points.shape, dtype=np.float32) * (noise / math.sqrt(centers.shape[1]))
+        yield _normalize(points)
+
+
+def benchmark(sizes=(10_000, 100_000, 1_000_000), dimension=384, queries=200, k=10, nprobes=(1, 4, 16, 64)):
+    """
+    Index `sizes` synthetic 384-dimensional embeddings (clustered around 1000 topics) and report, per size,
+    the IVF build time, then recall@k and p50/p95 latency per query of exact search and IVF at each `nprobes`.
+    """
+    rng = np.random.default_rng(1)
+    centers = _normalize(rng.standard_normal((1000, dimension), dtype=np.float32))
+    for size in sizes:
+        index = VectorIndex(dimension, mode="ivf")
+        index.reserve(size)
+        for block in _clustered(rng, size, centers):
+            index.add(block)
+        probes = next(_clustered(rng, queries, centers))
+        start = time.perf_counter()
+        index.train()
+        build = time.perf_counter() - start
+        print(f"{size:>9} chunks: {len(index._centroids)} lists trained in {build:.1f}s")
+
+        def timed(**options):
+            latencies, found = [], []
+            for probe in probes:
+                start = time.perf_counter()
+                found.append(index.search(probe, k, **options)[1][0])
+                latencies.append(time.perf_counter() - start)
+            return np.array(found), latencies
+
+        truth, latencies = timed(exact=True)
+        print(f"{'exact':>16}: recall@{k} 100.0%, latency p50 {percentile(latencies, 50) * 1000:.2f} ms / "
+              f"p95 {percentile(latencies, 95) * 1000:.2f} ms")
+        for nprobe in nprobes:
+            found, latencies = timed(nprobe=nprobe)
+            recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(found.tolist(), truth.tolist())])
+            print(f"{f'ivf nprobe={nprobe}':>16}: recall@{k} {recall:.1%}, latency p50 "
+                  f"{percentile(latencies, 50) * 1000:.2f} ms / p95 {percentile(latencies, 95) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    benchmark()
@@ -0,0 +1,415 @@
+"""
+warm_library_client.py
+----------------------
+Warm-start mode for LlamaStackAsLibraryClient (see 03-llama-stack-library-client.py).
+`client.initialize()` resolves every provider, opens the registry and kvstores and registers resources
+on every process start. Here one long-lived daemon process initializes the library client once and serves
+its API routes over a Unix socket; short-lived scripts attach with `get_warm_client()` and skip
+initialization entirely. The daemon is started on first use and exits after a period without requests.
+Run `python warm_library_client.py profile` to see where a cold initialize() spends its time, per provider.
+"""
+
+import abc  # For the abstract dispatcher base class
+import asyncio  # For the daemon's long-lived event loop
+import fcntl  # For serializing daemon start-up between scripts
+import json  # For request and response bodies
+import logging  # For silencing per-request logs during the benchmark
+import os  # For socket paths and environment variable access
+import socket  # For probing the daemon socket
+import socketserver  # For the Unix socket server
+import stat  # For checking the runtime directory
+import subprocess  # For starting the daemon and timing cold starts
+import sys  # For locating the Python interpreter
+import threading  # For the event loop thread and idle watchdog
+import time  # For idle tracking and benchmark timing
+import urllib.parse  # For query strings
+from http.server import BaseHTTPRequestHandler
+
+from llama_stack_client import LlamaStackClient  # Client used to talk to the daemon
+
+from client_pool import build_http_client  # Pooled HTTP client (over the Unix socket)
+from shared_utils import backoff_delays  # Backoff while the daemon starts
+
+# Setting this overrides the socket path the daemon listens on and clients attach to
+SOCKET_ENV = "LLAMA_STACK_WARM_SOCKET"
+# Seconds without a request after which the daemon shuts itself down
+DEFAULT_IDLE_TIMEOUT = 30 * 60
+# Seconds to wait for a freshly started daemon to finish initialize()
+DEFAULT_START_TIMEOUT = 300
+
+
+def runtime_dir():
+    """
+    Private (0700, owned by this user) directory for daemon sockets, locks and logs: `$XDG_RUNTIME_DIR/llama-stack`,
+    or `~/.cache/llama-stack/run` where there is no runtime dir. Never a shared temp dir, where another user
+    could pre-create the socket and receive the provider_data (API keys) attached scripts send.
+    """
+    base = os.environ.get("XDG_RUNTIME_DIR")
+    if base:
+        path = os.path.join(base, "llama-stack")
+    else:
+        path = os.path.join(os.path.expanduser("~"), ".cache", "llama-stack", "run")
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+        raise PermissionError(f"{path} is not a directory owned by the current user")
+    if info.st_mode & 0o077:
+        os.chmod(path, 0o700)
+    return path
+
+
+def default_socket_path(template):
+    return os.environ.get(SOCKET_ENV) or os.path.join(runtime_dir(), f"{template}.sock")
+
+
+def check_owner(socket_path):
+    """Raise PermissionError unless `socket_path` belongs to the current user (checked before sending API keys)."""
+    owner = os.stat(socket_path).st_uid
+    if owner != os.getuid():
+        raise PermissionError(f"{socket_path} is owned by uid {owner}, not by the current user")
+
+
+def _open_private(path, flags):
+    """Open `path` with mode 0600, refusing to follow a symlink planted in its place."""
+    return os.open(path, flags | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+
+
+def is_alive(socket_path):
+    """True if a daemon is accepting connections on `socket_path`."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        try:
+            s.connect(socket_path)
+        except OSError:
+            return False
+    return True
+
+
+class EventLoopDispatcher(abc.ABC):
+    """
+    Base class for the daemon's request dispatchers: owns one event loop running in a background thread,
+    so provider clients, connections and kvstores created during initialize() stay usable for every request.
+    Subclasses implement `call()`, returning a JSON-able value or an async iterator of JSON-able stream chunks.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def next_chunk(self, chunks):
+        """Next item of an async iterator returned by call(); raises StopAsyncIteration at the end."""
+        async def step():
+            return await chunks.__anext__()
+        return self.run(step())
+
+    @abc.abstractmethod
+    async def call(self, method, path, params, body, headers):
+        """Handle one request; returns a JSON-able value or an async iterator of JSON-able chunks."""
+
+    def error(self, exc):
+        """(status, payload) to send for an exception raised by call()."""
+        return 500, {"error": {"detail": str(exc)}}
+
+
+class LibraryDispatcher(EventLoopDispatcher):
+    """Dispatches requests to the routes of an initialized AsyncLlamaStackAsLibraryClient."""
+
+    def __init__(self, template, provider_data=None):
+        super().__init__()
+        # llama_stack is imported here rather than at module level: attaching scripts never need it
+        from llama_stack.distribution.library_client import AsyncLlamaStackAsLibraryClient
+
+        self.client = AsyncLlamaStackAsLibraryClient(template, provider_data=provider_data)
+        self.run(self.client.initialize())
+
+    async def call(self, method, path, params, body, headers):
+        from llama_stack.distribution.library_client import convert_pydantic_to_json_value
+        from llama_stack.distribution.request_headers import PROVIDER_DATA_VAR, request_provider_data_context
+        from llama_stack.distribution.server.routes import find_matching_route
+        from llama_stack.distribution.utils.context import preserve_contexts_async_generator
+        from llama_stack.providers.utils.telemetry.tracing import CURRENT_TRACE_CONTEXT, end_trace, start_trace
+
+        # Same steps as the library client's own request path, minus re-parsing the response into client types
+        func, path_params, route = find_matching_route(method, path, self.client.route_impls)
+        kwargs = self.client._convert_body(path, method, {**params, **body, **path_params})
+        with request_provider_data_context(headers):
+            await start_trace(route, {"__location__": "warm_library_client"})
+            if not body.get("stream"):
+                try:
+                    return convert_pydantic_to_json_value(await func(**kwargs))
+                finally:
+                    await end_trace()
+
+            async def chunks():
+                try:
+                    async for chunk in await func(**kwargs):
+                        yield convert_pydantic_to_json_value(chunk)
+                finally:
+                    await end_trace()
+
+            return preserve_contexts_async_generator(chunks(), [CURRENT_TRACE_CONTEXT, PROVIDER_DATA_VAR])
+
+    def error(self, exc):
+        from llama_stack.distribution.server.server import translate_exception
+
+        http_exc = translate_exception(exc)
+        return getattr(http_exc, "status_code", 400), {"error": {"detail": getattr(http_exc, "detail", str(exc))}}
+
+
+class _WarmHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so that attached clients keep their connection open between requests
+    protocol_version = "HTTP/1.1"
+    wbufsize = -1
+
+    def log_message(self, format, *args):
+        pass
+
+    def address_string(self):
+        return "unix"  # Unix socket peers have no address
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_sse(self, chunks, dispatcher):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        while True:
+            try:
+                chunk = dispatcher.next_chunk(chunks)
+            except StopAsyncIteration:
+                break
+            data = f"data: {json.dumps(chunk)}\n\n".encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _dispatch(self):
+        server = self.server
+        server.last_request = time.monotonic()
+        url = urllib.parse.urlsplit(self.path)
+        params = {k: v[0] if len(v) == 1 else v for k, v in urllib.parse.parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        dispatcher = server.dispatcher
+        try:
+            result = dispatcher.run(dispatcher.call(self.command, url.path, params, body, dict(self.headers)))
+        except Exception as e:
+            status, payload = dispatcher.error(e)
+            self._send_json(payload, status)
+            return
+        if hasattr(result, "__anext__"):
+            self._send_sse(result, dispatcher)
+        else:
+            self._send_json(result)
+        server.last_request = time.monotonic()
+
+    do_GET = do_POST = do_DELETE = _dispatch
+
+
+class WarmStackServer(socketserver.ThreadingUnixStreamServer):
+    """Serves a dispatcher over HTTP on a Unix socket until it has been idle for `idle_timeout` seconds."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, dispatcher, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        if os.path.exists(socket_path) and not is_alive(socket_path):
+            os.unlink(socket_path)  # Left behind by a daemon that did not shut down cleanly
+        # The socket is created with the umask's permissions: keep it owner-only from the moment it exists
+        umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, _WarmHandler)
+        finally:
+            os.umask(umask)
+        self.socket_path = socket_path
+        self.dispatcher = dispatcher
+        self.idle_timeout = idle_timeout
+        self.last_request = time.monotonic()
+
+    def _watch_idle(self):
+        while time.monotonic() - self.last_request < self.idle_timeout:
+            time.sleep(min(self.idle_timeout, 30))
+        self.shutdown()
+
+    def serve_until_idle(self):
+        threading.Thread(target=self._watch_idle, daemon=True).start()
+        try:
+            self.serve_forever()
+        finally:
+            self.server_close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+
+def serve(template="together", socket_path=None, provider_data=None, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    """Initialize the library client once and serve it on `socket_path` until idle."""
+    socket_path = socket_path or default_socket_path(template)
+    server = WarmStackServer(socket_path, LibraryDispatcher(template, provider_data), idle_timeout)
+    print(socket_path, flush=True)
+    server.serve_until_idle()
+
+
+def _start_daemon(template, socket_path, timeout):
+    """Start a detached daemon for `template` unless another script already did, and wait until it listens."""
+    with os.fdopen(_open_private(socket_path + ".lock", os.O_WRONLY), "w") as lock:
+        # Only one waiting script starts the daemon; the others find it alive once they get the lock
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if is_alive(socket_path):
+            return
+        with os.fdopen(_open_private(socket_path + ".log", os.O_WRONLY | os.O_APPEND), "a") as log:
+            process = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "serve", "--template", template, "--socket", socket_path],
+                stdout=subprocess.DEVNULL,
+                stderr=log,
+                start_new_session=True,  # Keep running after the script that started it exits
+            )
+        deadline = time.monotonic() + timeout
+        for delay in backoff_delays(initial=0.1, maximum=2.0):
+            if is_alive(socket_path):
+                return
+            if process.poll() is not None:
+                raise RuntimeError(f"Warm Llama Stack daemon exited during start-up; see {socket_path}.log")
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Warm Llama Stack daemon did not start within {timeout}s; see {socket_path}.log")
+            time.sleep(delay)
+
+
+def get_warm_client(template="together", provider_data=None, socket_path=None, start=True,
+                    timeout=DEFAULT_START_TIMEOUT):
+    """
+    Return a LlamaStackClient attached to the warm daemon for `template`, starting the daemon first if needed
+    (pass start=False to raise ConnectionError instead). Only the first caller pays for initialize().
+    `provider_data` (API keys) is sent with each request, so one daemon serves callers with different keys;
+    a socket owned by another user raises PermissionError instead.
+    """
+    socket_path = socket_path or default_socket_path(template)
+    if not is_alive(socket_path):
+        if not start:
+            raise ConnectionError(f"No warm Llama Stack daemon listening on {socket_path}")
+        _start_daemon(template, socket_path, timeout)
+    check_owner(socket_path)
+    return LlamaStackClient(
+        base_url="http://warm-llama-stack",
+        provider_data=provider_data,
+        http_client=build_http_client(http2=False, uds=socket_path),
+    )
+
+
+def profile_initialize(template="together", provider_data=None):
+    """
+    Time one cold start of the library client in this process and return [(phase, seconds)]:
+    importing llama_stack, loading the run config, opening the registry/kvstore, instantiating each provider,
+    registering resources, and whatever else initialize() does.
+    Call it in a fresh process; imports that already happened are not counted.
+    """
+    rows = []
+    start = time.perf_counter()
+    import llama_stack.distribution.resolver as resolver
+    import llama_stack.distribution.stack as stack
+    from llama_stack.distribution.library_client import LlamaStackAsLibraryClient
+    rows.append(("import llama_stack", time.perf_counter() - start))
+
+    def timed(module, name, label):
+        original = getattr(module, name)
+
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await original(*args, **kwargs)
+            finally:
+                rows.append((label(*args), time.perf_counter() - started))
+
+        setattr(module, name, wrapper)
+        return module, name, original
+
+    patches = [
+        timed(stack, "create_dist_registry", lambda *args: "open registry and kvstore"),
+        timed(stack, "register_resources", lambda *args: "register resources"),
+        timed(resolver, "instantiate_provider", lambda provider, *args:
+              f"provider {provider.spec.api.value}/{provider.provider_id} ({provider.provider_type})"),
+    ]
+    try:
+        start = time.perf_counter()
+        client = LlamaStackAsLibraryClient(template, provider_data=provider_data)
+        rows.append(("load run config", time.perf_counter() - start))
+        start = time.perf_counter()
+        client.initialize()
+        total = time.perf_counter() - start
+    finally:
+        for module, name, original in patches:
+            setattr(module, name, original)
+    accounted = sum(seconds for phase, seconds in rows[2:])
+    rows.append(("other initialize() work", total - accounted))
+    return rows
+
+
+def _time_subprocess(code):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], check=True, stdout=subprocess.DEVNULL,
+                   cwd=os.path.dirname(os.path.abspath(__file__)))
+    return time.perf_counter() - start
+
+
+def benchmark(template="together", runs=3):
+    """
+    Print the per-phase/per-provider breakdown of a cold initialize(), then compare the wall time of a
+    short-lived process that lists models with a cold library client against one attached to the warm daemon.
+    """
+    profile = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "profile", "--template", template, "--json"],
+        check=True, capture_output=True, text=True,
+    )
+    rows = json.loads(profile.stdout.strip().splitlines()[-1])
+    print(f"{'initialize() phase':<60} | {'seconds':>8}")
+    for phase, seconds in rows:
+        print(f"{phase:<60} | {seconds:>8.3f}")
+
+    cold_code = (
+        "from llama_stack.distribution.library_client import LlamaStackAsLibraryClient\n"
+        f"client = LlamaStackAsLibraryClient({template!r})\n"
+        "client.initialize()\n"
+        "client.models.list()\n"
+    )
+    warm_code = (
+        "from warm_library_client import get_warm_client\n"
+        f"get_warm_client({template!r}).models.list()\n"
+    )
+    get_warm_client(template)  # Start the daemon outside the measurement
+    cold = sorted(_time_subprocess(cold_code) for _ in range(runs))
+    warm = sorted(_time_subprocess(warm_code) for _ in range(runs))
+    print(f"\n{'process start to first response':<32} | {'p50 s':>8} | {'min s':>8}")
+    print(f"{'cold library client':<32} | {cold[len(cold) // 2]:>8.3f} | {cold[0]:>8.3f}")
+    print(f"{'attached to warm daemon':<32} | {warm[len(warm) // 2]:>8.3f} | {warm[0]:>8.3f}")
+    return rows, cold, warm
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Warm Llama Stack library client daemon.")
+    parser.add_argument("command", choices=["serve", "profile", "benchmark"])
+    parser.add_argument("--template", default="together", help="distribution template or run.yaml path")
+    parser.add_argument("--socket", default=None, help=f"Unix socket path (default: ${SOCKET_ENV} or a file in runtime_dir())")
+    parser.add_argument("--idle-timeout", type=float, default=DEFAULT_IDLE_TIMEOUT, help="seconds before an idle daemon exits")
+    parser.add_argument("--json", action="store_true", help="print the profile as JSON (used by benchmark)")
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    if args.command == "serve":
+        serve(args.template, args.socket, idle_timeout=args.idle_timeout)
+    elif args.command == "profile":
+        rows = profile_initialize(args.template)
+        if args.json:
+            print(json.dumps(rows))
+        else:
+            for phase, seconds in rows:
+                print(f"{phase:<60} | {seconds:>8.3f}")
+    else:
+        benchmark(args.template)